@@ -8,6 +8,9 @@ const API_BASE_URL = window.location.hostname === 'localhost' || window.location
 console.log('API Base URL:', API_BASE_URL);
 console.log('Current hostname:', window.location.hostname);
 
+// Formati accettati dal server (formati.SUPPORTED_EXTENSIONS)
+const SUPPORTED_EXTENSIONS = ['.xlsx', '.xls', '.csv', '.parquet', '.pq', '.arrow', '.feather'];
+
 // Elementi DOM
 const elements = {
     form: document.getElementById('excelForm'),
@@ -40,6 +43,7 @@ const elements = {
 // Stato dell'applicazione
 let appState = {
     currentFile: null,
+    fileHash: null,
     sheetData: null,
     isInfoOpen: false
 };
@@ -176,6 +180,11 @@ function handleDragLeave(event) {
     }
 }
 
+function isSupportedFile(file) {
+    const name = file.name.toLowerCase();
+    return SUPPORTED_EXTENSIONS.some(extension => name.endsWith(extension));
+}
+
 function handleDrop(event) {
     event.preventDefault();
     
@@ -188,11 +197,11 @@ function handleDrop(event) {
     const files = event.dataTransfer.files;
     if (files.length > 0) {
         const file = files[0];
-        if (file.name.endsWith('.xlsx') || file.name.endsWith('.xls')) {
+        if (isSupportedFile(file)) {
             elements.fileInput.files = files;
             processFile(file);
         } else {
-            showMessage('error', 'Per favore seleziona un file Excel (.xlsx o .xls)');
+            showMessage('error', `Per favore seleziona un file Excel, CSV, Parquet o Arrow (${SUPPORTED_EXTENSIONS.join(', ')})`);
         }
     }
 }
@@ -212,6 +221,7 @@ function handleRemoveFile() {
     
     // Reset dello stato
     appState.currentFile = null;
+    appState.fileHash = null;
     appState.sheetData = null;
     
     showMessage('status', 'File rimosso. Puoi caricare un nuovo file.');
@@ -219,8 +229,8 @@ function handleRemoveFile() {
 
 async function processFile(file) {
     // Validazione file
-    if (!file.name.endsWith('.xlsx') && !file.name.endsWith('.xls')) {
-        showMessage('error', 'Per favore seleziona un file Excel (.xlsx o .xls)');
+    if (!isSupportedFile(file)) {
+        showMessage('error', `Per favore seleziona un file Excel, CSV, Parquet o Arrow (${SUPPORTED_EXTENSIONS.join(', ')})`);
         return;
     }
     
@@ -230,6 +240,7 @@ async function processFile(file) {
     }
     
     appState.currentFile = file;
+    appState.fileHash = null;
     
     // Aggiorna il nome del file nel nuovo design
     const fileNameElement = document.getElementById('fileName');
@@ -262,6 +273,8 @@ async function processFile(file) {
         
         const data = await response.json();
         appState.sheetData = data.sheets;
+        // Il server conserva il file analizzato: /adjust può usare solo l'hash
+        appState.fileHash = data.file_hash || null;
         
         populateSheetSelect(data.sheets);
         elements.sheetSection.classList.remove('hidden');
@@ -300,7 +313,9 @@ function populateSheetSelect(sheets) {
         const sheet = sheets[sheetName];
         const option = document.createElement('option');
         option.value = sheetName;
-        option.textContent = `${sheetName} (${sheet.row_count} righe, ${sheet.columns.length} colonne numeriche)`;
+        // Con l'analisi a campione il numero di righe viene dai metadati del file
+        const rowCount = sheet.row_count_exact === false ? `~${sheet.row_count}` : sheet.row_count;
+        option.textContent = `${sheetName} (${rowCount} righe, ${sheet.columns.length} colonne numeriche)`;
         elements.sheetSelect.appendChild(option);
     });
 }
@@ -518,27 +533,44 @@ async function handleFormSubmit(event) {
     elements.submitBtn.innerHTML = '<i class="fas fa-spinner fa-spin mr-2"></i>Elaborazione...';
     
     try {
-        const submitFormData = new FormData();
-        submitFormData.append('file', appState.currentFile);
-        submitFormData.append('sheet_name', formData.get('sheetSelect'));
-        submitFormData.append('quantity_column', quantityColumn);
-        submitFormData.append('price_column', priceColumn);
-        submitFormData.append('remaining_column', remainingColumn);
-        submitFormData.append('target_total', targetTotal);
-        submitFormData.append('data_rows', elements.dataRows.value);
-        // Nuova logica intelligente - non servono più parametri di variazione
+        const buildFormData = (useHash) => {
+            const submitFormData = new FormData();
+            // Con l'hash di /introspect il file non viene caricato una seconda volta
+            if (useHash) {
+                submitFormData.append('file_hash', appState.fileHash);
+            } else {
+                submitFormData.append('file', appState.currentFile);
+            }
+            submitFormData.append('sheet_name', formData.get('sheetSelect'));
+            submitFormData.append('quantity_column', quantityColumn);
+            submitFormData.append('price_column', priceColumn);
+            submitFormData.append('remaining_column', remainingColumn);
+            submitFormData.append('target_total', targetTotal);
+            submitFormData.append('data_rows', elements.dataRows.value);
+            // Nuova logica intelligente - non servono più parametri di variazione
+            return submitFormData;
+        };
         
-        console.log('Invio richiesta a /adjust...');
-        console.log('URL:', `${API_BASE_URL}/adjust`);
-        console.log('FormData entries:');
-        for (let [key, value] of submitFormData.entries()) {
-            console.log(`  ${key}:`, value);
-        }
+        const sendAdjust = async (useHash) => {
+            const submitFormData = buildFormData(useHash);
+            console.log('Invio richiesta a /adjust...');
+            console.log('URL:', `${API_BASE_URL}/adjust`);
+            console.log('FormData entries:');
+            for (let [key, value] of submitFormData.entries()) {
+                console.log(`  ${key}:`, value);
+            }
+            return fetch(`${API_BASE_URL}/adjust`, {
+                method: 'POST',
+                body: submitFormData
+            });
+        };
         
-        const response = await fetch(`${API_BASE_URL}/adjust`, {
-            method: 'POST',
-            body: submitFormData
-        });
+        let response = await sendAdjust(Boolean(appState.fileHash));
+        if (response.status === 404 && appState.fileHash) {
+            // File scaduto dalla cache del server: lo ricarica
+            appState.fileHash = null;
+            response = await sendAdjust(false);
+        }
         
         console.log('Risposta ricevuta:', response.status, response.statusText);
         console.log('Headers:', Object.fromEntries(response.headers.entries()));
@@ -1,99 +1,86 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
+import asyncio
 import tempfile
 import os
 import json
-from typing import Optional
-from solver_semplice import ExcelSolverSemplice as ExcelSolver
+import shutil
+import time
+from typing import Dict, Optional
+from urllib.parse import quote
+from elaborazione import (CorrectionError, adjust_incremental, adjust_workbook, batch_format,
+                          introspect_workbook, prepare_batch, solve_spec, write_batch)
+from incrementale import IncrementalError
+from job_runner import (ClientDisconnectedError, JobRunner, JobTimeoutError, QueueFullError,
+                        RunnerUnavailableError)
+from job_manager import JobManager
+from job_store import create_job_store
+from metriche import (REGISTRY, Gauge, configure_logging, log_event, observe_correction, observe_request,
+                      observe_upload, render_metrics)
+from cache_analisi import ParseCache
+from caricamento import (UPLOAD_FORM_BYTES, UPLOAD_MAX_BYTES, UploadError, UploadTooLargeError, save_upload,
+                          size_limit_error)
+from scrittura_xlsx import FileCorretto
+from formati import SUPPORTED_EXTENSIONS, file_format, is_supported
+from solver_semplice import SOLVER_BACKENDS
 
-def analyze_column_patterns(df, numeric_columns):
-    """
-    Analizza i pattern delle colonne numeriche per identificare automaticamente
-    quantità, prezzi e rimanenze basandosi sui valori tipici
-    """
-    column_analysis = {}
-    
-    for col in numeric_columns:
-        # Estrai i valori non nulli
-        values = df[col].dropna()
-        if len(values) == 0:
-            continue
-            
-        # Calcola statistiche
-        mean_val = values.mean()
-        median_val = values.median()
-        std_val = values.std()
-        min_val = values.min()
-        max_val = values.max()
-        
-        # Conta valori interi vs decimali
-        integer_count = sum(1 for v in values if isinstance(v, (int, float)) and v == int(v))
-        decimal_count = len(values) - integer_count
-        
-        # Analizza i pattern
-        analysis = {
-            'column': col,
-            'mean': float(mean_val) if not pd.isna(mean_val) else 0,
-            'median': float(median_val) if not pd.isna(median_val) else 0,
-            'std': float(std_val) if not pd.isna(std_val) else 0,
-            'min': float(min_val) if not pd.isna(min_val) else 0,
-            'max': float(max_val) if not pd.isna(max_val) else 0,
-            'integer_ratio': integer_count / len(values) if len(values) > 0 else 0,
-            'decimal_ratio': decimal_count / len(values) if len(values) > 0 else 0,
-            'likely_type': 'unknown'
-        }
-        
-        # Euristiche per identificare il tipo di colonna
-        
-        # QUANTITÀ: valori interi, range tipico 1-1000, bassa varianza
-        if (analysis['integer_ratio'] > 0.8 and 
-            analysis['mean'] > 0 and analysis['mean'] < 1000 and
-            analysis['std'] < analysis['mean'] * 0.5):
-            analysis['likely_type'] = 'quantity'
-            analysis['confidence'] = 0.8
-        
-        # PREZZI: valori decimali, range tipico 0.01-1000, alta varianza
-        elif (analysis['decimal_ratio'] > 0.4 and 
-              analysis['mean'] > 0.01 and analysis['mean'] < 10000 and
-              analysis['std'] > analysis['mean'] * 0.2):
-            analysis['likely_type'] = 'price'
-            analysis['confidence'] = 0.7
-        
-        # RIMANENZE/TOTALI: valori decimali, range ampio, alta varianza
-        elif (analysis['mean'] > 10 and 
-              analysis['std'] > analysis['mean'] * 0.4 and
-              analysis['max'] > analysis['mean'] * 2):
-            analysis['likely_type'] = 'remaining'
-            analysis['confidence'] = 0.6
-        
-        # VALORI PICCOLI: potrebbero essere quantità
-        elif (analysis['mean'] < 100 and analysis['integer_ratio'] > 0.6):
-            analysis['likely_type'] = 'quantity'
-            analysis['confidence'] = 0.5
-        
-        # VALORI GRANDI: potrebbero essere totali
-        elif (analysis['mean'] > 100):
-            analysis['likely_type'] = 'remaining'
-            analysis['confidence'] = 0.5
-        
-        column_analysis[col] = analysis
-    
-    return column_analysis
+# Log silenziosi salvo EXCEL_LOG_LEVEL (formato testo o JSON con EXCEL_LOG_FORMAT)
+configure_logging()
 
-def _get_excel_column_letter(index):
-    """
-    Converte un indice numerico in lettera di colonna Excel (0=A, 1=B, 25=Z, 26=AA, etc.)
-    """
-    result = ""
-    while index >= 0:
-        result = chr(index % 26 + ord('A')) + result
-        index = index // 26 - 1
-    return result
+# Pool di processi per le elaborazioni CPU-bound (configurabile via variabili d'ambiente)
+job_runner = JobRunner()
+
+# Lavori asincroni (/jobs): backend in memoria o SQLite, risultati eliminati dopo il TTL
+job_manager = JobManager(job_runner, create_job_store())
+
+# Cache dei file analizzati (SHA-256): /adjust riusa file e colonne di /introspect
+parse_cache = ParseCache()
 
-app = FastAPI(title="Excel Adjuster", description="Applicazione per correzione automatica di file Excel")
+REGISTRY.register(Gauge("excel_cache_bytes", "Byte occupati dalla cache dei file analizzati",
+                        lambda: parse_cache.stats()["bytes"]))
+REGISTRY.register(Gauge("excel_jobs_in_flight", "Elaborazioni in corso o in coda nel pool",
+                        lambda: job_runner.stats()["in_flight"]))
+
+# Numero massimo di specifiche in una richiesta /adjust/batch
+BATCH_MAX_SPECS = int(os.getenv("EXCEL_BATCH_MAX_SPECS", "50"))
+
+UNSUPPORTED_FILE = ("Il file deve essere un Excel (.xlsx o .xls), un CSV o un Parquet/Arrow "
+                    f"({', '.join(SUPPORTED_EXTENSIONS)})")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    eviction = asyncio.create_task(job_manager.eviction_loop())
+    cache_eviction = asyncio.create_task(parse_cache.eviction_loop())
+    yield
+    eviction.cancel()
+    cache_eviction.cancel()
+    parse_cache.clear()
+    job_manager.shutdown()
+    job_runner.shutdown()
+
+
+def _upload_http_error(error: UploadError) -> HTTPException:
+    """File troppo grande → 413, file non valido o sospetto (zip bomb) → 400"""
+    return HTTPException(status_code=413 if isinstance(error, UploadTooLargeError) else 400, detail=str(error))
+
+
+def _job_http_error(error: Exception) -> HTTPException:
+    """Converte gli errori del job runner in risposte HTTP di backpressure"""
+    if isinstance(error, QueueFullError):
+        return HTTPException(status_code=429, detail=str(error), headers={"Retry-After": "5"})
+    if isinstance(error, JobTimeoutError):
+        return HTTPException(status_code=504, detail=str(error))
+    if isinstance(error, ClientDisconnectedError):
+        return HTTPException(status_code=499, detail=str(error))
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": "30"})
+
+
+app = FastAPI(title="Excel Adjuster", description="Applicazione per correzione automatica di file Excel", lifespan=lifespan)
 
 # Configurazione CORS per permettere richieste dal frontend
 app.add_middleware(
@@ -104,6 +91,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Rifiuta subito (413) le richieste con Content-Length oltre il limite, prima di leggerne il corpo"""
+    length = request.headers.get("content-length")
+    if request.method == "POST" and length and length.isdigit() and int(length) > UPLOAD_MAX_BYTES + UPLOAD_FORM_BYTES:
+        return JSONResponse(status_code=413, content={"detail": str(size_limit_error())})
+    return await call_next(request)
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    """Latenza e codice di stato per endpoint (percorso della route, non l'URL con gli id)"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "altro")
+        elapsed = time.perf_counter() - started
+        observe_request(endpoint, status, elapsed)
+        log_event("richiesta", method=request.method, endpoint=endpoint, status=status,
+                  elapsed=round(elapsed, 4))
+
 # Serve file statici (CSS, JS, immagini)
 app.mount("/assets", StaticFiles(directory="assets"), name="assets")
 
@@ -132,9 +144,16 @@ async def api_status():
         "message": "Excel Adjuster API - Backend attivo",
         "status": "running",
         "version": "1.0.0",
-        "environment": "production" if os.getenv("RENDER") else "development"
+        "environment": "production" if os.getenv("RENDER") else "development",
+        "jobs": {**job_runner.stats(), "async_timeout": job_manager.timeout},
+        "cache": parse_cache.stats()
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Metriche in formato Prometheus: latenze, dimensioni dei file, tempi per fase e per passo"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/app.js")
 async def serve_js():
     """Serve il file JavaScript"""
@@ -144,300 +163,540 @@ async def serve_js():
     except FileNotFoundError:
         return HTMLResponse(content="// File app.js non trovato", status_code=404)
 
+async def _cached_upload(file: Optional[UploadFile], file_hash: Optional[str]):
+    """
+    File della richiesta: caricato (e registrato nella cache) oppure indicato con il
+    file_hash di un caricamento precedente. Restituisce (voce della cache, nome del file).
+    """
+    if file is not None and file.filename:
+        # Verifica che sia un file Excel o tabellare (formati.py)
+        if not is_supported(file.filename):
+            raise HTTPException(status_code=400, detail=UNSUPPORTED_FILE)
+        # Copia a blocchi con hash e controlli sullo zip; il file resta nella cache
+        # (su disco) per le correzioni successive
+        try:
+            upload_path, digest, size = await save_upload(file, parse_cache.directory)
+        except UploadError as e:
+            raise _upload_http_error(e)
+        observe_upload(size)
+        return parse_cache.add(upload_path, file.filename, digest, size), file.filename
+    if file_hash:
+        entry = parse_cache.get(file_hash)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="File non più disponibile, caricalo di nuovo")
+        return entry, entry.filename
+    raise HTTPException(status_code=400, detail="Indicare il file oppure file_hash")
+
 @app.post("/introspect")
-async def introspect_excel(file: UploadFile = File(...)):
+async def introspect_excel(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    file_hash: Optional[str] = Form(None),
+    sheet_name: Optional[str] = Form(None),
+    full: bool = Form(False)
+):
     """
-    Analizza un file Excel e restituisce informazioni sui fogli e colonne disponibili
+    Analizza un file Excel e restituisce informazioni sui fogli e colonne disponibili.
+    Di default l'analisi è a campione (prime righe di ogni foglio, righe dai metadati);
+    full=true legge i fogli per intero. Con sheet_name analizza solo quel foglio.
+    La risposta contiene file_hash, da passare a /adjust (o a /introspect) al posto del file.
     """
     try:
-        # Verifica che sia un file Excel
-        if not file.filename.endswith(('.xlsx', '.xls')):
-            raise HTTPException(status_code=400, detail="Il file deve essere un Excel (.xlsx o .xls)")
+        entry, filename = await _cached_upload(file, file_hash)
         
-        # Salva temporaneamente il file con l'estensione corretta
-        file_extension = '.xlsx' if file.filename.endswith('.xlsx') else '.xls'
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_file_path = tmp_file.name
+        sheets = [sheet_name] if sheet_name else None
+        if sheets and entry.sheet_names is not None and sheet_name not in entry.sheet_names:
+            raise HTTPException(status_code=404, detail=f"Foglio '{sheet_name}' non trovato")
         
-        try:
-            # Legge il file Excel
-            excel_file = pd.ExcelFile(tmp_file_path)
-            
-            # Estrae informazioni sui fogli
-            sheets_info = {}
-            for sheet_name in excel_file.sheet_names:
-                df = pd.read_excel(tmp_file_path, sheet_name=sheet_name)
-                
-                # Filtra solo le colonne numeriche e pulisce i dati
-                numeric_columns = df.select_dtypes(include=['number']).columns.tolist()
-                
-                # Pulisce i dati per evitare valori inf/nan
-                clean_df = df.copy()
-                for col in numeric_columns:
-                    # Sostituisce inf e nan con 0
-                    clean_df[col] = clean_df[col].replace([float('inf'), float('-inf')], 0)
-                    clean_df[col] = clean_df[col].fillna(0)
-                
-                # Analizza i pattern delle colonne per identificazione automatica
-                column_analysis = analyze_column_patterns(clean_df, numeric_columns)
-                
-                # Prepara i dati di esempio in modo sicuro
-                sample_data = []
-                if len(clean_df) > 0:
-                    sample_df = clean_df.head(3)
-                    for _, row in sample_df.iterrows():
-                        sample_row = {}
-                        for col in numeric_columns:
-                            value = row[col]
-                            # Converte in float sicuro per JSON
-                            if pd.isna(value) or value == float('inf') or value == float('-inf'):
-                                sample_row[col] = 0.0
-                            else:
-                                sample_row[col] = float(value)
-                        sample_data.append(sample_row)
-                
-                # Identifica automaticamente le colonne più probabili
-                suggested_columns = {
-                    "quantity": None,
-                    "price": None,
-                    "remaining": None
-                }
-                
-                # Trova le colonne con la confidenza più alta per ogni tipo
-                for col, analysis in column_analysis.items():
-                    col_type = analysis.get('likely_type', 'unknown')
-                    confidence = analysis.get('confidence', 0)
-                    
-                    if col_type in suggested_columns:
-                        current_confidence = 0
-                        if suggested_columns[col_type]:
-                            current_confidence = column_analysis[suggested_columns[col_type]].get('confidence', 0)
-                        
-                        if confidence > current_confidence:
-                            suggested_columns[col_type] = col
-                
-                # Crea mapping colonne Excel (A, B, C, D...)
-                excel_column_mapping = {}
-                for i, col in enumerate(numeric_columns):
-                    excel_letter = _get_excel_column_letter(i)
-                    excel_column_mapping[excel_letter] = col
-                
-                sheets_info[sheet_name] = {
-                    "columns": numeric_columns,
-                    "row_count": len(df),
-                    "sample_data": sample_data,
-                    "column_analysis": column_analysis,
-                    "suggested_columns": suggested_columns,
-                    "excel_column_mapping": excel_column_mapping
-                }
-            
-            return {
-                "success": True,
-                "sheets": sheets_info,
-                "filename": file.filename
-            }
-            
-        finally:
-            # Pulisce il file temporaneo
-            os.unlink(tmp_file_path)
+        # Analizza solo i fogli non ancora in cache
+        missing = entry.missing_sheets(full, sheets)
+        if missing is None or missing:
+            with parse_cache.use(entry):
+                # L'analisi gira nel pool di processi: l'event loop resta libero
+                introspection, columns = await job_runner.run(
+                    introspect_workbook, entry.path, filename, True, full, missing, request=request
+                )
+            parse_cache.set_introspection(entry.digest, introspection, columns)
+        
+        return {**entry.introspection(full, sheets), "filename": filename, "file_hash": entry.digest}
             
+    except HTTPException:
+        raise
+    except (QueueFullError, RunnerUnavailableError, JobTimeoutError, ClientDisconnectedError) as e:
+        raise _job_http_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore nell'analisi del file: {str(e)}")
 
+def _check_solver(solver: Optional[str]):
+    if solver is not None and solver not in SOLVER_BACKENDS:
+        raise HTTPException(status_code=400,
+                            detail=f"Solver non supportato: {solver} (valori ammessi: {', '.join(SOLVER_BACKENDS)})")
+
+def _solver_header(result) -> str:
+    """Backend usato ed esito del solver MILP, es. 'milp:optimal' o 'milp:timeout:greedy'"""
+    info = result.get('solver') or {}
+    parts = [info.get('backend', 'greedy')]
+    if 'status' in info:
+        parts.append(info['status'])
+        if info.get('fallback'):
+            parts.append('greedy')
+    return ':'.join(parts)
+
+def _group_targets(group_targets, where: str = "group_targets") -> Dict[str, float]:
+    """Target per gruppo: oggetto JSON {valore della colonna dei gruppi: target ≥ 0}"""
+    if isinstance(group_targets, str):
+        try:
+            group_targets = json.loads(group_targets)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{where} deve essere un oggetto JSON")
+    if not isinstance(group_targets, dict) or not group_targets:
+        raise HTTPException(status_code=400, detail=f"{where} deve essere un oggetto JSON non vuoto {{gruppo: target}}")
+    try:
+        targets = {str(label): float(value) for label, value in group_targets.items()}
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{where}: i target devono essere numeri")
+    if any(value < 0 for value in targets.values()):
+        raise HTTPException(status_code=400, detail=f"{where}: i target non possono essere negativi")
+    return targets
+
+def _check_targets(target_total: Optional[float], group_column: Optional[str], group_targets) -> Optional[Dict[str, float]]:
+    """
+    Un target complessivo oppure una colonna dei gruppi con i target per gruppo
+    (più, facoltativo, il target complessivo). Restituisce i target per gruppo validati.
+    """
+    if group_column:
+        if target_total is not None and target_total <= 0:
+            raise HTTPException(status_code=400, detail="Il totale target deve essere maggiore di 0")
+        return _group_targets(group_targets)
+    if group_targets:
+        raise HTTPException(status_code=400, detail="group_targets richiede group_column")
+    if target_total is None or target_total <= 0:
+        raise HTTPException(status_code=400, detail="Il totale target deve essere maggiore di 0")
+    return None
+
+def _result_headers(result) -> dict:
+    """Statistiche della correzione negli header della risposta (nessun file di appoggio)"""
+    headers = {
+        'X-Original-Total': str(result.get('original_total', 0)),
+        'X-Target-Total': str(result.get('target_total', 0)),
+        'X-Final-Total': str(result.get('final_total', 0)),
+        'X-Difference': str(result.get('residual', 0)),
+        'X-Rows-Processed': str(result.get('rows_processed', 0))
+    }
+    # Totale calcolato dalle formule della colonna rimanenze (formule.py)
+    check = result.get('formula_check') or {}
+    if 'total' in check:
+        headers['X-Formula-Total'] = str(check['total'])
+        headers['X-Formula-Difference'] = str(check['difference'])
+        headers['X-Formula-Consistent'] = str(check['consistent']).lower()
+    # Esito per gruppo delle correzioni con target per gruppo (solver_gruppi.py)
+    if 'groups' in result:
+        groups = result['groups']
+        headers['X-Groups-Reached'] = f"{sum(group['target_reached_exactly'] for group in groups)}/{len(groups)}"
+        headers['X-Group-Results'] = json.dumps([
+            {key: group[key] for key in ("group", "target_total", "final_total", "residual")} for group in groups
+        ])
+    # Limiti per riga (limiti.py): target raggiungibile entro i limiti e righe bloccate
+    if 'bounds' in result:
+        bounds = result['bounds']
+        headers['X-Bounds-Feasible'] = str(bounds['feasible']).lower()
+        headers['X-Bounds-Respected'] = str(bounds['respected']).lower()
+        headers['X-Locked-Rows'] = str(bounds['locked_rows'])
+    return headers
+
+def _workbook_response(output: FileCorretto, filename: str, headers: dict) -> StreamingResponse:
+    """
+    Invia il file corretto in streaming dalla memoria o dal file temporaneo del worker,
+    che non resta su disco dopo la risposta
+    """
+    quoted = quote(filename)
+    if quoted == filename:
+        disposition = f'attachment; filename="{filename}"'
+    else:
+        disposition = f"attachment; filename*=utf-8''{quoted}"
+    return StreamingResponse(
+        output.stream(),
+        media_type=file_format(filename).media_type,
+        headers={**headers, 'Content-Disposition': disposition, 'Content-Length': str(output.size)}
+    )
+
 @app.post("/adjust")
 async def adjust_excel(
-    file: UploadFile = File(...),
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    file_hash: Optional[str] = Form(None),
     sheet_name: str = Form(...),
     quantity_column: str = Form(...),
     price_column: str = Form(...),
     remaining_column: str = Form(...),
-    target_total: float = Form(...),
-    data_rows: int = Form(...)
+    target_total: Optional[float] = Form(None),
+    data_rows: int = Form(...),
+    solver: Optional[str] = Form(None),
+    group_column: Optional[str] = Form(None),
+    group_targets: Optional[str] = Form(None),
+    min_column: Optional[str] = Form(None),
+    max_column: Optional[str] = Form(None),
+    lock_column: Optional[str] = Form(None)
 ):
     """
-    Applica l'algoritmo di correzione al file Excel e restituisce il file modificato
+    Applica l'algoritmo di correzione al file Excel e restituisce il file modificato.
+    Il file può essere caricato di nuovo oppure indicato con il file_hash restituito da /introspect.
+    CSV, Parquet e Arrow (un solo foglio, formati.TABLE_SHEET) tornano nel loro formato.
+    Con group_column e group_targets (oggetto JSON {gruppo: target}) il target è per gruppo;
+    target_total è allora facoltativo e, se indicato, vincola anche il totale complessivo.
+    min_column, max_column e lock_column (facoltative) sono le colonne con quantità minima,
+    massima e blocco di ogni riga, rispettati da tutti i passaggi della correzione.
     """
     try:
         # Validazione input
-        if target_total <= 0:
-            raise HTTPException(status_code=400, detail="Il totale target deve essere maggiore di 0")
+        targets = _check_targets(target_total, group_column, group_targets)
+        _check_solver(solver)
         
-        if not file.filename.endswith(('.xlsx', '.xls')):
-            raise HTTPException(status_code=400, detail="Il file deve essere un Excel (.xlsx o .xls)")
+        entry, filename = await _cached_upload(file, file_hash)
         
-        # Salva temporaneamente il file con l'estensione corretta
-        file_extension = '.xlsx' if file.filename.endswith('.xlsx') else '.xls'
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_file_path = tmp_file.name
+        # Colonne già lette da /introspect o da una correzione precedente
+        columns = [quantity_column, price_column, remaining_column] + [
+            column for column in (group_column, min_column, max_column, lock_column) if column]
+        sheet_data = entry.columns(sheet_name, columns)
         
-        try:
-            print(f"Creazione solver con parametri:")
-            print(f"  file_path: {tmp_file_path}")
-            print(f"  sheet_name: {sheet_name}")
-            print(f"  quantity_column: {quantity_column}")
-            print(f"  price_column: {price_column}")
-            print(f"  remaining_column: {remaining_column}")
-            print(f"  target_total: {target_total}")
-            print(f"  data_rows: {data_rows}")
-            
-            # Inizializza il solver con la nuova logica intelligente
-            solver = ExcelSolver(
-                file_path=tmp_file_path,
-                sheet_name=sheet_name,
-                quantity_column=quantity_column,
-                price_column=price_column,
-                remaining_column=remaining_column,
-                target_total=target_total,
-                data_rows=data_rows
+        with parse_cache.use(entry):
+            # Parsing (se serve), solver e scrittura girano nel pool di processi
+            outcome = await job_runner.run(
+                adjust_workbook,
+                entry.path,
+                filename,
+                sheet_name,
+                quantity_column,
+                price_column,
+                remaining_column,
+                target_total,
+                data_rows,
+                sheet_data=sheet_data,
+                solver_backend=solver,
+                keep_state=True,
+                group_column=group_column or None,
+                group_targets=targets,
+                min_column=min_column or None,
+                max_column=max_column or None,
+                lock_column=lock_column or None,
+                request=request
             )
+        # Colonne lette (se mancavano) e formule della colonna rimanenze per le prossime correzioni
+        parse_cache.set_sheet(entry.digest, outcome["sheet_data"])
+        # Stato del solver per le correzioni incrementali (/adjust/incremental)
+        result_id = parse_cache.set_result(entry.digest, outcome["state"])
+        
+        result = outcome["result"]
+        observe_correction(result, outcome["timings"])
+        
+        # Aggiunge le statistiche agli header della risposta
+        headers = {
+            **_result_headers(result),
+            'X-File-Hash': entry.digest,
+            'X-Solver': _solver_header(result)
+        }
+        if result_id:
+            headers['X-Result-Id'] = result_id
+        
+        return _workbook_response(outcome["output"], outcome["output_filename"], headers)
             
-            print("Solver creato con successo")
-            
-            # Esegue la correzione
-            result = solver.adjust()
-            
-            if not result["success"]:
-                raise HTTPException(status_code=400, detail=result["error"])
-            
-            # Crea il file di output
-            # Se il file originale era .xls, salva come .xlsx (conversione automatica)
-            if file_extension == '.xls':
-                output_filename = f"adjusted_{file.filename.replace('.xls', '.xlsx')}"
-            else:
-                output_filename = f"adjusted_{file.filename}"
-            output_path = os.path.join(tempfile.gettempdir(), output_filename)
-            
-            # Salva il file modificato preservando le formule originali
-            from openpyxl import load_workbook
-            import pandas as pd
-            
-            # Se il file è .xls, convertilo in .xlsx per l'elaborazione
-            if file_extension == '.xls':
-                # Leggi con pandas (supporta .xls) e salva come .xlsx
-                xlsx_path = tmp_file_path.replace('.xls', '.xlsx')
-                df_dict = pd.read_excel(tmp_file_path, sheet_name=None, engine='xlrd')
-                
-                with pd.ExcelWriter(xlsx_path, engine='openpyxl') as writer:
-                    for sheet_name_df, df in df_dict.items():
-                        df.to_excel(writer, sheet_name=sheet_name_df, index=False)
-                
-                # Usa il file convertito per l'elaborazione
-                wb = load_workbook(xlsx_path)
-            else:
-                # File .xlsx, carica direttamente
-                wb = load_workbook(tmp_file_path)
-            
-            # Lavora sul foglio specificato
-            if sheet_name in wb.sheetnames:
-                ws = wb[sheet_name]
-                
-                # Trova gli indici delle colonne
-                quantity_col_idx = None
-                price_col_idx = None
-                remaining_col_idx = None
-                
-                # Cerca le colonne nell'header (prima riga)
-                for col_idx, cell in enumerate(ws[1], 1):
-                    if cell.value == solver.quantity_column:
-                        quantity_col_idx = col_idx
-                    elif cell.value == solver.price_column:
-                        price_col_idx = col_idx
-                    elif cell.value == solver.remaining_column:
-                        remaining_col_idx = col_idx
-                
-                if quantity_col_idx and price_col_idx and remaining_col_idx:
-                    # Aggiorna le colonne Quantità, Prezzo e Rimanenze
-                    # Escludi la riga con la formula speciale se presente
-                    max_data_row = ws.max_row
-                    if hasattr(solver, 'special_formula_row') and solver.special_formula_row:
-                        max_data_row = solver.special_formula_row - 1  # Escludi la riga con formula speciale
-                        print(f"Esclusa riga {solver.special_formula_row} con formula speciale")
-                    
-                    # Aggiorna solo le righe che esistono nel DataFrame del solver
-                    for i in range(len(solver.df)):
-                        row_idx = i + 2  # Inizia dalla riga 2 (dopo l'header)
-                        if row_idx <= max_data_row:
-                            # Aggiorna quantità
-                            ws.cell(row=row_idx, column=quantity_col_idx, value=solver.df.iloc[i][solver.quantity_column])
-                            # Aggiorna prezzo
-                            ws.cell(row=row_idx, column=price_col_idx, value=solver.df.iloc[i][solver.price_column])
-                            # NON aggiornare le rimanenze - mantieni le formule originali
-                            # Le formule si ricalcoleranno automaticamente con i nuovi valori di quantità e prezzo
-                    
-                    # Aggiorna la formula speciale se presente
-                    if hasattr(solver, 'special_formula_row') and solver.special_formula_row:
-                        special_row = solver.special_formula_row
-                        # Aggiorna la formula speciale con il nuovo target
-                        new_formula = f'=SUMIF(J2:J{max_data_row},">0") * ({int(target_total)} / SUMIF(J2:J{max_data_row},">0"))'
-                        ws.cell(row=special_row, column=10, value=new_formula)
-                        print(f"Aggiornata formula speciale alla riga {special_row}: {new_formula}")
-            
-            # Forza il ricalcolo delle formule
-            wb.calculation.calcMode = 'auto'
-            wb.calculation.fullCalcOnLoad = True
-            
-            # Ricalcola tutte le formule nel foglio
-            if sheet_name in wb.sheetnames:
-                ws = wb[sheet_name]
-                # Forza il ricalcolo delle formule
-                for row in ws.iter_rows():
-                    for cell in row:
-                        if cell.data_type == 'f':  # Se è una formula
-                            cell.value = cell.value  # Forza il ricalcolo
-            
-            # Forza il ricalcolo di tutte le formule nel foglio
-            for sheet in wb.worksheets:
-                sheet.calculate_dimension()
-            
-            # Salva il workbook modificato
-            wb.save(output_path)
-            
-            # Salva le statistiche in un file temporaneo per il frontend
-            stats_filename = f"stats_{file.filename}.json"
-            stats_path = os.path.join(tempfile.gettempdir(), stats_filename)
-            
-            # Converte i tipi NumPy in tipi Python nativi per la serializzazione JSON
-            serializable_result = {
-                "success": result["success"],
-                "message": result["message"],
-                "original_total": float(result["original_total"]),
-                "final_total": float(result["final_total"]),
-                "target_total": float(result["target_total"])
-            }
-            
-            with open(stats_path, 'w') as f:
-                import json
-                json.dump(serializable_result, f)
-            
-            # Aggiunge le statistiche agli header della risposta
-            headers = {
-                'X-Original-Total': str(result.get('original_total', 0)),
-                'X-Target-Total': str(result.get('target_total', 0)),
-                'X-Final-Total': str(result.get('final_total', 0)),
-                'X-Difference': str(result.get('difference', 0)),
-                'X-Rows-Processed': str(result.get('rows_processed', 0))
-            }
-            
-            return FileResponse(
-                path=output_path,
-                filename=output_filename,
-                media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                headers=headers
+    except HTTPException:
+        raise
+    except CorrectionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (QueueFullError, RunnerUnavailableError, JobTimeoutError, ClientDisconnectedError) as e:
+        raise _job_http_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore nella correzione del file: {str(e)}")
+
+def _parse_changes(changes: Optional[str]):
+    """Righe modificate di /adjust/incremental: lista JSON di {row, price?, quantity?}"""
+    if not changes:
+        return []
+    try:
+        change_list = json.loads(changes)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="changes deve essere una lista JSON")
+    if not isinstance(change_list, list) or not all(isinstance(change, dict) for change in change_list):
+        raise HTTPException(status_code=400, detail="changes deve essere una lista JSON di oggetti")
+    for change in change_list:
+        try:
+            change["row"] = int(change["row"])
+            for key in ("price", "quantity"):
+                if change.get(key) is not None:
+                    change[key] = float(change[key])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400,
+                                detail="Ogni modifica deve avere row (numero di riga) e price/quantity numerici")
+    return change_list
+
+@app.post("/adjust/incremental")
+async def adjust_incremental_excel(
+    request: Request,
+    file_hash: str = Form(...),
+    result_id: str = Form(...),
+    changes: Optional[str] = Form(None),
+    target_total: Optional[float] = Form(None)
+):
+    """
+    Riapplica una correzione precedente (result_id, header X-Result-Id di /adjust) con poche
+    righe modificate e/o un nuovo target, in tempo proporzionale alla modifica.
+    changes è una lista JSON di {row (riga Excel), price?, quantity? (quantità di partenza)}.
+    409 se la modifica richiede una nuova correzione completa con /adjust.
+    """
+    try:
+        change_list = _parse_changes(changes)
+        if target_total is not None and target_total <= 0:
+            raise HTTPException(status_code=400, detail="Il totale target deve essere maggiore di 0")
+        if not change_list and target_total is None:
+            raise HTTPException(status_code=400, detail="Indicare changes oppure target_total")
+        
+        entry, state = parse_cache.get_result(file_hash, result_id)
+        if state is None:
+            raise HTTPException(status_code=404, detail="Correzione precedente non più disponibile, ripeti /adjust")
+        
+        with parse_cache.use(entry):
+            outcome = await job_runner.run(
+                adjust_incremental, entry.path, entry.filename, state, change_list, target_total,
+                request=request
             )
-            
-        finally:
-            # Pulisce il file temporaneo di input
-            os.unlink(tmp_file_path)
-            
+        new_result_id = parse_cache.set_result(entry.digest, outcome["state"])
+        
+        result = outcome["result"]
+        observe_correction(result, outcome["timings"], kind="incremental")
+        headers = {
+            **_result_headers(result),
+            'X-Rows-Changed': str(result['incremental']['rows_changed']),
+            'X-Rows-Moved': str(result['incremental']['rows_moved']),
+            'X-File-Hash': entry.digest,
+            'X-Result-Id': new_result_id
+        }
+        return _workbook_response(outcome["output"], outcome["output_filename"], headers)
+    
+    except HTTPException:
+        raise
+    except IncrementalError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except (QueueFullError, RunnerUnavailableError, JobTimeoutError, ClientDisconnectedError) as e:
+        raise _job_http_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore nella correzione del file: {str(e)}")
+
+def _parse_specs(specs: str):
+    """Specifiche di /adjust/batch: lista JSON di oggetti con foglio, colonne e target"""
+    try:
+        spec_list = json.loads(specs)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="specs deve essere una lista JSON")
+    if not isinstance(spec_list, list) or not spec_list or not all(isinstance(spec, dict) for spec in spec_list):
+        raise HTTPException(status_code=400, detail="specs deve essere una lista JSON non vuota di oggetti")
+    if len(spec_list) > BATCH_MAX_SPECS:
+        raise HTTPException(status_code=400, detail=f"Al massimo {BATCH_MAX_SPECS} specifiche per richiesta")
+    
+    required = ("sheet_name", "quantity_column", "price_column", "remaining_column")
+    for i, spec in enumerate(spec_list, 1):
+        # Con i target per gruppo il target complessivo è facoltativo
+        missing = [key for key in required + (() if spec.get("group_column") else ("target_total",))
+                   if spec.get(key) in (None, "")]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Specifica {i}: campi mancanti {', '.join(missing)}")
+        try:
+            spec["target_total"] = float(spec["target_total"]) if spec.get("target_total") is not None else None
+            spec["data_rows"] = int(spec["data_rows"]) if spec.get("data_rows") is not None else None
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Specifica {i}: target_total e data_rows devono essere numeri")
+        if spec["target_total"] is not None and spec["target_total"] <= 0:
+            raise HTTPException(status_code=400, detail=f"Specifica {i}: il totale target deve essere maggiore di 0")
+        if spec.get("group_column"):
+            spec["group_targets"] = _group_targets(spec.get("group_targets"), f"Specifica {i}: group_targets")
+        elif spec.get("group_targets"):
+            raise HTTPException(status_code=400, detail=f"Specifica {i}: group_targets richiede group_column")
+        _check_solver(spec.get("solver"))
+    return spec_list
+
+@app.post("/adjust/batch")
+async def adjust_batch_excel(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    file_hash: Optional[str] = Form(None),
+    specs: str = Form(...),
+    output_format: Optional[str] = Form(None)
+):
+    """
+    Più correzioni sullo stesso file in una sola richiesta. specs è una lista JSON di
+    {sheet_name, quantity_column, price_column, remaining_column, target_total, data_rows?, solver?,
+    group_column?, group_targets?, min_column?, max_column?, lock_column?} (con i target per
+    gruppo target_total è facoltativo).
+    Il file è letto una sola volta, le specifiche sono risolte in parallelo nel pool di processi
+    e il risultato è un unico .xlsx (un target per foglio; per CSV e Parquet/Arrow il file nel
+    suo formato) oppure uno .zip (una cartella per specifica, con riepilogo.json).
+    """
+    try:
+        spec_list = _parse_specs(specs)
+        try:
+            output_format = batch_format(spec_list, output_format)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        entry, filename = await _cached_upload(file, file_hash)
+        work_dir = tempfile.mkdtemp(prefix="excel_batch_")
+        try:
+            with parse_cache.use(entry):
+                # Colonne già lette da /introspect o da correzioni precedenti
+                cached = {spec["sheet_name"]: entry.sheets[spec["sheet_name"]]
+                          for spec in spec_list if spec["sheet_name"] in entry.sheets}
+                prepared = await job_runner.run(prepare_batch, entry.path, filename, spec_list, cached,
+                                                output_format, request=request)
+                try:
+                    outcomes, written = await _run_batch(request, prepared, filename, spec_list,
+                                                         output_format, work_dir)
+                finally:
+                    if prepared["xlsx_path"] != entry.path and os.path.exists(prepared["xlsx_path"]):
+                        os.unlink(prepared["xlsx_path"])
+        except BaseException:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+        for sheet in prepared["sheets"].values():
+            parse_cache.set_sheet(entry.digest, sheet)
+        for outcome in outcomes:
+            if outcome["result"] is not None:
+                observe_correction(outcome["result"], outcome["timings"], kind="batch")
+        
+        summary = [{key: result.get(key) for key in ("sheet_name", "target_total", "final_total", "success")}
+                   for result in written["results"]]
+        headers = {
+            'X-File-Hash': entry.digest,
+            'X-Batch-Succeeded': f"{sum(result['success'] for result in written['results'])}/{len(spec_list)}",
+            'X-Batch-Results': json.dumps(summary)
+        }
+        media_type = ('application/zip' if output_format == "zip" else
+                      file_format(written["output_filename"]).media_type)
+        return FileResponse(
+            path=written["output_path"],
+            filename=written["output_filename"],
+            media_type=media_type,
+            headers=headers,
+            # La cartella di lavoro del batch viene eliminata dopo l'invio
+            background=BackgroundTask(shutil.rmtree, work_dir, ignore_errors=True)
+        )
+    
     except HTTPException:
         raise
+    except CorrectionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (QueueFullError, RunnerUnavailableError, JobTimeoutError, ClientDisconnectedError) as e:
+        raise _job_http_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore nella correzione del file: {str(e)}")
 
+async def _run_batch(request, prepared, filename, spec_list, output_format, work_dir):
+    """Risolve le specifiche in parallelo nel pool e compone il risultato"""
+    member_paths = ([os.path.join(work_dir, f"{i}.xlsx") for i in range(len(spec_list))]
+                    if output_format == "zip" else None)
+    # Al più una specifica per worker alla volta: il batch non riempie da solo la coda del pool
+    limit = asyncio.Semaphore(job_runner.max_workers)
+    
+    async def solve(i, spec):
+        sheet_data = prepared["sheets"][spec["sheet_name"]].select(
+            [spec["quantity_column"], spec["price_column"], spec["remaining_column"]]
+            + [spec[key] for key in ("group_column", "min_column", "max_column", "lock_column") if spec.get(key)])
+        async with limit:
+            return await job_runner.run(solve_spec, prepared["xlsx_path"], spec, sheet_data,
+                                        member_paths[i] if member_paths else None, request=request)
+    
+    tasks = [asyncio.ensure_future(solve(i, spec)) for i, spec in enumerate(spec_list)]
+    try:
+        outcomes = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    
+    output_path = os.path.join(work_dir, f"adjusted.{output_format}")
+    written = await job_runner.run(write_batch, prepared["xlsx_path"], filename, spec_list, outcomes,
+                                   output_path, output_format, member_paths, request=request)
+    return outcomes, {**written, "output_path": output_path}
+
+@app.post("/jobs")
+async def submit_job(
+    file: UploadFile = File(...),
+    sheet_name: str = Form(...),
+    quantity_column: str = Form(...),
+    price_column: str = Form(...),
+    remaining_column: str = Form(...),
+    target_total: Optional[float] = Form(None),
+    data_rows: int = Form(...),
+    solver: Optional[str] = Form(None),
+    group_column: Optional[str] = Form(None),
+    group_targets: Optional[str] = Form(None),
+    min_column: Optional[str] = Form(None),
+    max_column: Optional[str] = Form(None),
+    lock_column: Optional[str] = Form(None)
+):
+    """
+    Accoda una correzione asincrona (stessi parametri di /adjust) e restituisce l'id del lavoro.
+    Lo stato si legge su /jobs/{job_id}, il file corretto su /jobs/{job_id}/result.
+    """
+    targets = _check_targets(target_total, group_column, group_targets)
+    _check_solver(solver)
+    
+    if not is_supported(file.filename):
+        raise HTTPException(status_code=400, detail=UNSUPPORTED_FILE)
+    
+    params = {
+        "sheet_name": sheet_name,
+        "quantity_column": quantity_column,
+        "price_column": price_column,
+        "remaining_column": remaining_column,
+        "target_total": target_total,
+        "data_rows": data_rows,
+        "solver": solver,
+        "group_column": group_column or None,
+        "group_targets": targets,
+        "min_column": min_column or None,
+        "max_column": max_column or None,
+        "lock_column": lock_column or None
+    }
+    try:
+        upload_path, _, size = await save_upload(file, job_manager.directory)
+        observe_upload(size)
+        return job_manager.submit(upload_path, file.filename, params)
+    except UploadError as e:
+        raise _upload_http_error(e)
+    except (QueueFullError, RunnerUnavailableError) as e:
+        raise _job_http_error(e)
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """
+    Stato di un lavoro: fase corrente (parsing, scaling, rounding, compensation, writing),
+    avanzamento, tempi per fase ed eventuale errore
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Lavoro non trovato o scaduto")
+    return job_manager.public(job)
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """Restituisce il file corretto di un lavoro completato"""
+    job = job_manager.get(job_id)
+    if job is None or (job["status"] == "done" and not os.path.exists(job["output_path"])):
+        raise HTTPException(status_code=404, detail="Lavoro non trovato o scaduto")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Lavoro fallito: {job['error']}")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail="Lavoro non ancora completato")
+    
+    result = job["result"]
+    headers = {**_result_headers(result), 'X-Solver': _solver_header(result)}
+    return FileResponse(
+        path=job["output_path"],
+        filename=job["output_filename"],
+        media_type=file_format(job["output_filename"]).media_type,
+        headers=headers
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,64 @@
+import time
+from typing import Callable, Dict, Optional
+
+# Fasi dell'elaborazione nell'ordine in cui vengono eseguite
+PHASES = ("parsing", "normalization", "scaling", "rounding", "compensation", "writing")
+
+
+class PhaseTracker:
+    """
+    Traccia la fase corrente dell'elaborazione e il tempo speso in ciascuna.
+    Ad ogni cambio di fase invoca callback(phase, progress, timings), dove
+    progress è la frazione di fasi completate (0.0 - 1.0).
+    """
+
+    def __init__(self, callback: Optional[Callable] = None):
+        self.callback = callback
+        self.timings: Dict[str, float] = {}
+        self.current: Optional[str] = None
+        self._started_at = None
+        # Passi dell'algoritmo dentro le fasi (Passaggio 1-3, Step A/B/C): tempi in steps
+        self.steps: Dict[str, float] = {}
+        self.current_step: Optional[str] = None
+        self._step_started_at = None
+
+    def start(self, phase: str):
+        """Chiude la fase corrente e ne avvia una nuova"""
+        self.stop()
+        self.current = phase
+        self._started_at = time.perf_counter()
+        self._notify(phase)
+
+    def step(self, name: str):
+        """Chiude il passo corrente e ne avvia uno nuovo; la fine della fase chiude anche il passo"""
+        self._stop_step()
+        self.current_step = name
+        self._step_started_at = time.perf_counter()
+
+    def _stop_step(self):
+        if self.current_step is None:
+            return
+        elapsed = time.perf_counter() - self._step_started_at
+        self.steps[self.current_step] = self.steps.get(self.current_step, 0.0) + elapsed
+        self.current_step = None
+
+    def stop(self):
+        """Chiude la fase corrente accumulandone la durata"""
+        self._stop_step()
+        if self.current is None:
+            return
+        elapsed = time.perf_counter() - self._started_at
+        self.timings[self.current] = self.timings.get(self.current, 0.0) + elapsed
+        self.current = None
+
+    def finish(self):
+        """Chiude l'ultima fase e segnala il completamento"""
+        self.stop()
+        self._notify("done", 1.0)
+
+    def _notify(self, phase: str, progress: float = None):
+        if self.callback is None:
+            return
+        if progress is None:
+            progress = PHASES.index(phase) / len(PHASES) if phase in PHASES else 0.0
+        self.callback(phase, progress, dict(self.timings))
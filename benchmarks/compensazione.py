@@ -0,0 +1,80 @@
+"""
+Confronto tra la chiusura del residuo (compensazione.close_residual) e il ciclo greedy
+usato in precedenza da _apply_discrete_compensation, su residui fino a milioni di centesimi.
+
+    python benchmarks/compensazione.py [--rows 50000] [--repeat 3] [--seed 0]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from centesimi import exact_dot  # noqa: E402
+from compensazione import close_residual  # noqa: E402
+
+RESIDUALS = (137, -5_003, 98_765, -1_234_567, 4_999_999, -9_876_543, -100_000_000_000)
+
+
+def greedy_loop(prices_cents, quantities, residual):
+    """Ciclo precedente: righe per prezzo crescente, più unità possibili per riga"""
+    delta = np.zeros(len(prices_cents), dtype=np.int64)
+    remaining = abs(residual)
+    for index in np.argsort(prices_cents, kind="stable"):
+        if remaining <= 0:
+            break
+        price = int(prices_cents[index])
+        if residual > 0:
+            step = remaining // price
+        else:
+            step = min(int(quantities[index]) - 1, remaining // price)
+        if step > 0:
+            delta[index] = step if residual > 0 else -step
+            remaining -= step * price
+    return delta
+
+
+def synthetic(rows, rng):
+    """Prezzi in centesimi con fattori comuni (multipli di 5 e 10) e quantità intere"""
+    prices = rng.integers(50, 50_000, rows) * rng.choice([1, 5, 10], rows)
+    quantities = rng.integers(1, 60, rows)
+    return prices.astype(np.int64), quantities.astype(np.int64)
+
+
+def measure(function, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        delta = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return delta, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    prices, quantities = synthetic(args.rows, np.random.default_rng(args.seed))
+    print(f"{args.rows} righe, MCD prezzi {int(np.gcd.reduce(prices))}")
+    print(f"{'residuo':>14} | {'metodo':<8} {'secondi':>9} {'rimasto':>10} {'unità':>8} {'righe':>6}")
+    for residual in RESIDUALS:
+        runs = {
+            "greedy": lambda: greedy_loop(prices, quantities, residual),
+            "dp": lambda: close_residual(prices, quantities, residual).delta
+        }
+        for name, function in runs.items():
+            delta, elapsed = measure(function, args.repeat)
+            remaining = residual - exact_dot(delta, prices)
+            print(f"{residual:>14} | {name:<8} {elapsed:>9.4f} {remaining:>10} "
+                  f"{int(np.abs(delta).sum()):>8} {int(np.count_nonzero(delta)):>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Benchmark della correzione completa (adjust_workbook) su cartelle sintetiche: tempi per fase
+(lettura, normalizzazione, scaling, arrotondamento, compensazione, scrittura) e picco di
+memoria (RSS) di ogni caso, misurati in un processo nuovo. I risultati si salvano in JSON
+e si confrontano con un'esecuzione precedente: oltre la soglia il comando esce con 1.
+
+    python benchmarks/correzione.py [--rows 10000 100000] [--prices lognormal round]
+        [--solver greedy] [--repeat 3] [--output risultati.json]
+        [--baseline riferimento.json] [--threshold 0.25]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from avanzamento import PHASES  # noqa: E402
+from generatore import PRICE_DISTRIBUTIONS, generate_workbook  # noqa: E402
+from lettura_excel import read_sheet_columns  # noqa: E402
+
+# Differenze sotto questa durata (secondi) non contano come regressione (rumore di misura)
+MIN_REGRESSION_SECONDS = 0.05
+
+
+def peak_rss_mb():
+    """Picco di memoria residente del processo in MB (None dove resource non c'è, es. Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux in KB, macOS in byte
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(path, rows, target_total, solver, output_path):
+    """Una correzione nel processo worker: tempi per fase, totale e picco di RSS"""
+    from elaborazione import adjust_workbook
+
+    started = time.perf_counter()
+    outcome = adjust_workbook(path, os.path.basename(path), "Foglio1", "Quantità", "Prezzo",
+                              "Rimanenze", target_total, rows, output_path=output_path,
+                              solver_backend=solver)
+    elapsed = time.perf_counter() - started
+    result = outcome["result"]
+    return {
+        "timings": {**outcome["timings"], "total": elapsed},
+        "peak_rss_mb": peak_rss_mb(),
+        "residual": result["residual"],
+        "target_reached_exactly": bool(result["target_reached_exactly"])
+    }
+
+
+def measure(case, path, output_path, repeat):
+    """Miglior tempo per fase su repeat esecuzioni, ognuna in un processo nuovo"""
+    best = None
+    context = multiprocessing.get_context("spawn")
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            run = executor.submit(run_case, path, case["rows"], case["target_total"],
+                                  case["solver"], output_path).result()
+        if best is None:
+            best = run
+            continue
+        for phase, elapsed in run["timings"].items():
+            best["timings"][phase] = min(best["timings"].get(phase, elapsed), elapsed)
+        if run["peak_rss_mb"] is not None:
+            best["peak_rss_mb"] = min(best["peak_rss_mb"], run["peak_rss_mb"])
+    return best
+
+
+def compare(results, baseline, threshold):
+    """Regressioni rispetto a baseline: metriche peggiorate oltre la soglia relativa"""
+    previous = {case["name"]: case for case in baseline.get("cases", [])}
+    regressions = []
+    for case in results["cases"]:
+        before = previous.get(case["name"])
+        if before is None:
+            continue
+        for phase, elapsed in case["timings"].items():
+            old = before["timings"].get(phase)
+            if old and elapsed > old * (1 + threshold) and elapsed - old > MIN_REGRESSION_SECONDS:
+                regressions.append(f"{case['name']} {phase}: {old:.3f}s → {elapsed:.3f}s")
+        old, new = before.get("peak_rss_mb"), case.get("peak_rss_mb")
+        if old and new and new > old * (1 + threshold):
+            regressions.append(f"{case['name']} peak_rss: {old:.0f} MB → {new:.0f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--sheets", type=int, default=1, help="Fogli per cartella (si corregge il primo)")
+    parser.add_argument("--prices", nargs="+", choices=PRICE_DISTRIBUTIONS, default=["lognormal"])
+    parser.add_argument("--solver", nargs="+", choices=("greedy", "milp"), default=["greedy"])
+    parser.add_argument("--total-row", action="store_true", help="Riga finale con SUMIF")
+    parser.add_argument("--target-ratio", type=float, default=0.8, help="Target come frazione del totale iniziale")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Cartella delle cartelle generate (riusate tra esecuzioni)")
+    parser.add_argument("--output", help="File JSON dei risultati")
+    parser.add_argument("--baseline", help="Risultati JSON di riferimento da confrontare")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Peggioramento relativo tollerato")
+    args = parser.parse_args()
+
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), "excel_adjuster_bench")
+    os.makedirs(workdir, exist_ok=True)
+    output_path = os.path.join(workdir, "adjusted.xlsx")
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cases": []
+    }
+    print(f"{'caso':<56} " + " ".join(f"{phase[:11]:>11}" for phase in PHASES) + f" {'totale':>8} {'RSS MB':>7}")
+    for rows in args.rows:
+        for prices in args.prices:
+            name = f"rows={rows},sheets={args.sheets},prices={prices}" + (",total_row" if args.total_row else "")
+            path = os.path.join(workdir, f"{name.replace(',', '_').replace('=', '')}_seed{args.seed}.xlsx")
+            if not os.path.exists(path):
+                generate_workbook(path, rows, args.sheets, prices, args.total_row, args.seed)
+            sheet = read_sheet_columns(path, "Foglio1", ["Quantità", "Prezzo"], rows)
+            quantities, unit_prices = sheet["Quantità"], sheet["Prezzo"]
+            original = float((quantities.clip(min=0) * unit_prices).sum())
+            target_total = round(original * args.target_ratio, 2)
+
+            for solver in args.solver:
+                case = {"name": f"{name},solver={solver}", "rows": rows, "sheets": args.sheets,
+                        "prices": prices, "solver": solver, "target_total": target_total}
+                case.update(measure(case, path, output_path, args.repeat))
+                results["cases"].append(case)
+                timings = case["timings"]
+                rss = "-" if case["peak_rss_mb"] is None else f"{case['peak_rss_mb']:.0f}"
+                print(f"{case['name']:<56} " + " ".join(f"{timings.get(phase, 0):>11.3f}" for phase in PHASES)
+                      + f" {timings['total']:>8.3f} {rss:>7}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Risultati salvati in {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        known = {case["name"] for case in baseline.get("cases", [])}
+        for case in results["cases"]:
+            if case["name"] not in known:
+                print(f"Caso assente nel riferimento, non confrontato: {case['name']}")
+        for regression in regressions:
+            print(f"REGRESSIONE {regression}")
+        if regressions:
+            return 1
+        print(f"Nessuna regressione oltre il {args.threshold:.0%} rispetto a {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
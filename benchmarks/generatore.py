@@ -0,0 +1,125 @@
+"""
+Generatore di cartelle di inventario sintetiche per i benchmark, con lo stesso tracciato
+di "inventario 2023.xlsx": Magazzino, ID Prodotto, SKU, Prodotto, Quantità, Prezzo e
+Rimanenze (formula =Prezzo*Quantità), più la riga finale facoltativa con SUMIF.
+
+    python benchmarks/generatore.py out.xlsx [--rows 100000] [--sheets 1]
+        [--prices lognormal|uniform|round] [--total-row] [--seed 0]
+
+Con un percorso .xls scrive una cartella Excel 97-2003 (con xlwt, solo per i benchmark):
+al più 65535 righe di dati per foglio e Rimanenze come valore invece che come formula.
+"""
+import argparse
+
+import numpy as np
+from openpyxl import Workbook
+
+HEADER = ("Magazzino", "ID Prodotto", "SKU", "Prodotto", "Quantità", "Prezzo", "Rimanenze")
+PRICE_DISTRIBUTIONS = ("lognormal", "uniform", "round")
+
+
+def synthetic_prices(rows: int, distribution: str, rng) -> np.ndarray:
+    """
+    Prezzi al centesimo:
+    - lognormal: pochi articoli cari e molti economici (mediana ~12€)
+    - uniform: uniformi tra 0,50€ e 500€
+    - round: multipli di 0,50€, 1€ o 5€ (MCD comune alto, caso difficile per la compensazione)
+    """
+    if distribution == "lognormal":
+        prices = rng.lognormal(mean=2.5, sigma=1.0, size=rows)
+    elif distribution == "uniform":
+        prices = rng.uniform(0.5, 500, size=rows)
+    elif distribution == "round":
+        prices = rng.integers(1, 100, size=rows) * rng.choice([0.5, 1, 5], size=rows)
+    else:
+        raise ValueError(f"Distribuzione dei prezzi non supportata: {distribution}")
+    return np.maximum(np.round(prices, 2), 0.01)
+
+
+def synthetic_quantities(rows: int, rng) -> np.ndarray:
+    """Quantità intere con un 20% di righe a zero e qualche valore negativo (da normalizzare)"""
+    quantities = rng.poisson(8, size=rows)
+    quantities[rng.random(rows) < 0.2] = 0
+    quantities[rng.random(rows) < 0.01] *= -1
+    return quantities
+
+
+def generate_workbook(path: str, rows: int, sheets: int = 1, prices: str = "lognormal",
+                      total_row: bool = False, seed: int = 0) -> str:
+    """
+    Scrive una cartella .xlsx con sheets fogli ("Foglio1", "Foglio2", ...) di rows righe
+    di dati ciascuno. total_row aggiunge sotto i dati la riga speciale con
+    =SUMIF(G2:Gn,">0"). Restituisce path.
+    """
+    rng = np.random.default_rng(seed)
+    workbook = Workbook(write_only=True)
+    for index in range(1, sheets + 1):
+        sheet = workbook.create_sheet(f"Foglio{index}")
+        sheet.append(HEADER)
+        price_values = synthetic_prices(rows, prices, rng).tolist()
+        quantity_values = synthetic_quantities(rows, rng).tolist()
+        for row in range(rows):
+            excel_row = row + 2
+            sheet.append((
+                f"Magazzino {index}",
+                10000 + row,
+                f"SKU{row:07d}",
+                f"Prodotto {row}",
+                quantity_values[row],
+                price_values[row],
+                f"=F{excel_row}*E{excel_row}"
+            ))
+        if total_row:
+            sheet.append((None,) * 6 + (f'=SUMIF(G2:G{rows + 1},">0")',))
+    workbook.save(path)
+    return path
+
+
+# Righe di dati al massimo in un foglio .xls (65536 righe, intestazione compresa)
+XLS_MAX_ROWS = 65535
+
+
+def generate_xls(path: str, rows: int, sheets: int = 1, prices: str = "lognormal", seed: int = 0) -> str:
+    """
+    Come generate_workbook ma in formato .xls: xlwt non salva il risultato delle formule,
+    quindi Rimanenze contiene il valore Prezzo × Quantità. Restituisce path.
+    """
+    import xlwt
+
+    if rows > XLS_MAX_ROWS:
+        raise ValueError(f"Un foglio .xls ha al più {XLS_MAX_ROWS} righe di dati")
+    rng = np.random.default_rng(seed)
+    workbook = xlwt.Workbook()
+    for index in range(1, sheets + 1):
+        sheet = workbook.add_sheet(f"Foglio{index}")
+        for column, name in enumerate(HEADER):
+            sheet.write(0, column, name)
+        price_values = synthetic_prices(rows, prices, rng).tolist()
+        quantity_values = synthetic_quantities(rows, rng).tolist()
+        for row in range(rows):
+            values = (f"Magazzino {index}", 10000 + row, f"SKU{row:07d}", f"Prodotto {row}",
+                      quantity_values[row], price_values[row], round(quantity_values[row] * price_values[row], 2))
+            for column, value in enumerate(values):
+                sheet.write(row + 1, column, value)
+    workbook.save(path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--sheets", type=int, default=1)
+    parser.add_argument("--prices", choices=PRICE_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--total-row", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.path.lower().endswith(".xls"):
+        generate_xls(args.path, args.rows, args.sheets, args.prices, args.seed)
+    else:
+        generate_workbook(args.path, args.rows, args.sheets, args.prices, args.total_row, args.seed)
+    print(args.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Benchmark della scrittura del risultato per i file .xls: la conversione precedente
+(pd.read_excel di tutti i fogli + pd.ExcelWriter + patch dell'.xlsx intermedio) contro
+la conversione nativa in streaming di conversione_xls (xlrd → XML, celle corrette applicate
+nello stesso passaggio). Per ogni caso: lettura delle colonne con xlrd, tempo di scrittura e
+picco di memoria (RSS) di ogni percorso, misurati in un processo nuovo, più il confronto
+delle celle dei due risultati (--verify).
+
+    python benchmarks/xls.py [--rows 10000 60000] [--sheets 3] [--repeat 3]
+        [--verify] [--output risultati.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from correzione import peak_rss_mb  # noqa: E402
+from generatore import generate_xls  # noqa: E402
+
+# Colonna Quantità del tracciato di generatore.HEADER (1-based)
+QUANTITY_COLUMN = 5
+
+
+def legacy_write(path, output_path, patches):
+    """Percorso precedente: tutti i fogli in DataFrame, .xlsx intermedio, poi patch dell'XML"""
+    import pandas as pd
+    from scrittura_xlsx import patch_workbook
+
+    with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as tmp_xlsx:
+        xlsx_path = tmp_xlsx.name
+    try:
+        frames = pd.read_excel(path, sheet_name=None, engine="xlrd")
+        with pd.ExcelWriter(xlsx_path, engine="openpyxl") as writer:
+            for sheet_name, frame in frames.items():
+                frame.to_excel(writer, sheet_name=sheet_name, index=False)
+        patch_workbook(xlsx_path, output_path, patches)
+    finally:
+        os.unlink(xlsx_path)
+
+
+def native_write(path, output_path, patches):
+    from conversione_xls import convert_xls
+
+    convert_xls(path, output_path, patches)
+
+
+def run_case(path, output_path, method):
+    """Lettura delle colonne e scrittura del risultato con il percorso method, nel processo worker"""
+    import numpy as np
+    from lettura_excel import read_sheet_columns
+    from scrittura_xlsx import column_patches
+
+    started = time.perf_counter()
+    sheet = read_sheet_columns(path, "Foglio1", ["Quantità", "Prezzo", "Rimanenze"])
+    parsed = time.perf_counter()
+    # Correzione simulata: quantità scalate dell'80% (la scrittura non dipende dal solver)
+    quantities = sheet["Quantità"]
+    updated = np.rint(np.nan_to_num(quantities).clip(min=0) * 0.8)
+    patches = {"Foglio1": column_patches(QUANTITY_COLUMN, quantities, updated)}
+    written_start = time.perf_counter()
+    (legacy_write if method == "legacy" else native_write)(path, output_path, patches)
+    finished = time.perf_counter()
+    return {
+        "timings": {"parsing": parsed - started, "writing": finished - written_start, "total": finished - started},
+        "peak_rss_mb": peak_rss_mb(),
+        "cells": len(patches["Foglio1"]),
+        "output_bytes": os.path.getsize(output_path)
+    }
+
+
+def measure(path, output_path, method, repeat):
+    """Miglior tempo su repeat esecuzioni, ognuna in un processo nuovo"""
+    best = None
+    context = multiprocessing.get_context("spawn")
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            run = executor.submit(run_case, path, output_path, method).result()
+        if best is None:
+            best = run
+            continue
+        for phase, elapsed in run["timings"].items():
+            best["timings"][phase] = min(best["timings"][phase], elapsed)
+        if run["peak_rss_mb"] is not None:
+            best["peak_rss_mb"] = min(best["peak_rss_mb"], run["peak_rss_mb"])
+    return best
+
+
+def same_cells(legacy_path, native_path):
+    """
+    Le due cartelle hanno gli stessi valori? Confronto per foglio come DataFrame
+    (la conversione precedente rinomina le intestazioni vuote in 'Unnamed: i')
+    """
+    import pandas as pd
+
+    legacy = pd.read_excel(legacy_path, sheet_name=None)
+    native = pd.read_excel(native_path, sheet_name=None)
+    if list(legacy) != list(native):
+        return False
+    return all(legacy[name].equals(native[name]) for name in legacy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 60_000])
+    parser.add_argument("--sheets", type=int, default=3, help="Fogli per cartella (si corregge il primo)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verify", action="store_true", help="Confronta le celle dei due risultati")
+    parser.add_argument("--workdir", help="Cartella delle cartelle generate (riusate tra esecuzioni)")
+    parser.add_argument("--output", help="File JSON dei risultati")
+    args = parser.parse_args()
+
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), "excel_adjuster_bench")
+    os.makedirs(workdir, exist_ok=True)
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cases": []
+    }
+    print(f"{'caso':<32} {'percorso':<9} {'lettura':>8} {'scrittura':>10} {'totale':>8} {'RSS MB':>7} {'MB out':>7}")
+    for rows in args.rows:
+        name = f"rows={rows},sheets={args.sheets}"
+        path = os.path.join(workdir, f"rows{rows}_sheets{args.sheets}_seed{args.seed}.xls")
+        if not os.path.exists(path):
+            generate_xls(path, rows, args.sheets, seed=args.seed)
+        outputs = {}
+        for method in ("legacy", "native"):
+            outputs[method] = os.path.join(workdir, f"adjusted_{method}.xlsx")
+            case = {"name": f"{name},path={method}", "rows": rows, "sheets": args.sheets, "path": method}
+            case.update(measure(path, outputs[method], method, args.repeat))
+            results["cases"].append(case)
+            timings = case["timings"]
+            rss = "-" if case["peak_rss_mb"] is None else f"{case['peak_rss_mb']:.0f}"
+            print(f"{name:<32} {method:<9} {timings['parsing']:>8.3f} {timings['writing']:>10.3f} "
+                  f"{timings['total']:>8.3f} {rss:>7} {case['output_bytes'] / 1e6:>7.1f}")
+        legacy, native = results["cases"][-2], results["cases"][-1]
+        speedup = legacy["timings"]["writing"] / native["timings"]["writing"]
+        print(f"{name:<32} scrittura {speedup:.1f}× più veloce con la conversione nativa")
+        if args.verify:
+            native["same_cells"] = same_cells(outputs["legacy"], outputs["native"])
+            print(f"{name:<32} celle uguali: {native['same_cells']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Risultati salvati in {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
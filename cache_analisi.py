@@ -0,0 +1,255 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from lettura_excel import ColonneFoglio
+
+# Correzioni precedenti conservate per file, per le correzioni incrementali
+CACHE_RESULTS = 8
+
+
+class CacheEntry:
+    """File caricato con i risultati del parsing già calcolati"""
+
+    def __init__(self, digest: str, path: str, filename: str, size: int):
+        self.digest = digest
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.sheet_names: Optional[List[str]] = None
+        # Analisi per foglio: "sample" (a campione) e "full" (completa)
+        self.analyses: Dict[str, Dict[str, Any]] = {"sample": {}, "full": {}}
+        self.sheets: Dict[str, ColonneFoglio] = {}
+        # Stato del solver delle ultime correzioni (result_id → StatoCorrezione)
+        self.results: "OrderedDict[str, Any]" = OrderedDict()
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.in_use = 0
+
+    @property
+    def nbytes(self) -> int:
+        """Occupazione stimata: file su disco più gli array estratti e gli stati del solver"""
+        return (self.size + sum(sheet.nbytes for sheet in self.sheets.values())
+                + sum(state.nbytes for state in self.results.values()))
+
+    def missing_sheets(self, full: bool, sheets: List[str] = None) -> Optional[List[str]]:
+        """
+        Fogli ancora da analizzare (None = tutti, nomi dei fogli non ancora noti).
+        Un'analisi completa vale anche quando basta quella a campione.
+        """
+        if self.sheet_names is None:
+            return sheets
+        done = set(self.analyses["full"])
+        if not full:
+            done |= set(self.analyses["sample"])
+        return [name for name in (sheets or self.sheet_names) if name not in done]
+
+    def introspection(self, full: bool, sheets: List[str] = None) -> Dict[str, Any]:
+        """Risultato di /introspect ricomposto dalle analisi in cache"""
+        info = {}
+        for name in (sheets or self.sheet_names):
+            analysis = self.analyses["full"].get(name)
+            if analysis is None and not full:
+                analysis = self.analyses["sample"].get(name)
+            info[name] = analysis
+        return {
+            "success": True,
+            "sheets": info,
+            "sheet_names": self.sheet_names,
+            "sampled": any(analysis["sampled"] for analysis in info.values()),
+            "filename": self.filename
+        }
+
+    def columns(self, sheet_name: str, columns, data_rows: int = None) -> Optional[ColonneFoglio]:
+        """Colonne già lette del foglio, oppure None se va fatto il parsing"""
+        sheet = self.sheets.get(sheet_name)
+        if sheet is None or not sheet.has_columns(columns):
+            return None
+        return sheet.select(columns, data_rows)
+
+
+class ParseCache:
+    """
+    Cache dei file caricati indicizzata per SHA-256, condivisa da /introspect e /adjust.
+    Conserva il file, il risultato dell'analisi e le colonne estratte per foglio,
+    con un budget in byte (eliminazione LRU) e una scadenza (TTL).
+
+    - max_bytes: budget complessivo (EXCEL_CACHE_BYTES, default 512 MB)
+    - ttl: secondi dall'ultimo utilizzo (EXCEL_CACHE_TTL, default 1800)
+    """
+
+    def __init__(self, max_bytes: int = None, ttl: float = None, directory: str = None):
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("EXCEL_CACHE_BYTES", 512 * 1024 * 1024))
+        self.ttl = ttl if ttl is not None else float(os.getenv("EXCEL_CACHE_TTL", "1800"))
+        self.directory = directory or os.getenv("EXCEL_CACHE_DIR") or os.path.join(
+            tempfile.gettempdir(), "excel_adjuster_cache")
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Stato della cache per /api/status"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(entry.nbytes for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+    def _is_expired(self, entry: CacheEntry, now: float) -> bool:
+        return now - entry.last_used > self.ttl
+
+    def get(self, digest: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and self._is_expired(entry, time.time()) and not entry.in_use:
+                self._remove(digest)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry.last_used = time.time()
+            self._entries.move_to_end(digest)
+            return entry
+
+    def add(self, upload_path: str, filename: str, digest: str, size: int) -> CacheEntry:
+        """
+        Registra un file caricato (o restituisce quello già presente con lo stesso hash).
+        upload_path è il file temporaneo scritto da save_upload in self.directory:
+        viene spostato nella cache oppure eliminato se il file c'è già.
+        """
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                entry.last_used = time.time()
+                self._entries.move_to_end(digest)
+        if entry is not None:
+            os.unlink(upload_path)
+            return entry
+
+        extension = os.path.splitext(filename)[1].lower()
+        path = os.path.join(self.directory, f"{digest}{extension}")
+        os.replace(upload_path, path)
+
+        with self._lock:
+            entry = CacheEntry(digest, path, filename, size)
+            self._entries[digest] = entry
+            self._shrink()
+        return entry
+
+    def set_introspection(self, digest: str, introspection: Dict[str, Any], sheets: Dict[str, ColonneFoglio] = None):
+        """Aggiunge le analisi dei fogli restituite da introspect_workbook"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return
+            entry.sheet_names = introspection["sheet_names"]
+            for name, analysis in introspection["sheets"].items():
+                entry.analyses["sample" if analysis["sampled"] else "full"][name] = analysis
+            for sheet in (sheets or {}).values():
+                self._store_sheet(entry, sheet)
+            self._shrink()
+
+    def set_sheet(self, digest: str, sheet: ColonneFoglio):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return
+            self._store_sheet(entry, sheet)
+            self._shrink()
+
+    def set_result(self, digest: str, state) -> Optional[str]:
+        """Conserva lo stato del solver di una correzione e ne restituisce l'id (None se non c'è)"""
+        if state is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            result_id = uuid.uuid4().hex
+            entry.results[result_id] = state
+            while len(entry.results) > CACHE_RESULTS:
+                entry.results.popitem(last=False)
+            self._shrink()
+            return result_id
+
+    def get_result(self, digest: str, result_id: str):
+        """Stato del solver di una correzione precedente (None se scaduto o sconosciuto)"""
+        entry = self.get(digest)
+        if entry is None:
+            return None, None
+        with self._lock:
+            state = entry.results.get(result_id)
+            if state is not None:
+                entry.results.move_to_end(result_id)
+        return entry, state
+
+    @staticmethod
+    def _store_sheet(entry: CacheEntry, sheet: ColonneFoglio):
+        current = entry.sheets.get(sheet.sheet_name)
+        entry.sheets[sheet.sheet_name] = current.merge(sheet) if current is not None else sheet
+
+    @contextmanager
+    def use(self, entry: CacheEntry):
+        """Impedisce l'eliminazione del file mentre un worker lo sta leggendo"""
+        with self._lock:
+            entry.in_use += 1
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.time()
+
+    def _remove(self, digest: str):
+        entry = self._entries.pop(digest)
+        if os.path.exists(entry.path):
+            os.unlink(entry.path)
+
+    def _shrink(self):
+        """Elimina le voci meno usate finché il totale rientra nel budget"""
+        total = sum(entry.nbytes for entry in self._entries.values())
+        # La voce più recente resta sempre: è quella appena caricata o usata
+        for digest in list(self._entries)[:-1]:
+            if total <= self.max_bytes:
+                break
+            entry = self._entries[digest]
+            if entry.in_use:
+                continue
+            total -= entry.nbytes
+            self._remove(digest)
+
+    def evict_expired(self) -> int:
+        """Elimina le voci non usate da più del TTL"""
+        now = time.time()
+        with self._lock:
+            expired = [digest for digest, entry in self._entries.items()
+                       if self._is_expired(entry, now) and not entry.in_use]
+            for digest in expired:
+                self._remove(digest)
+        return len(expired)
+
+    async def eviction_loop(self):
+        """Pulizia periodica delle voci scadute"""
+        interval = max(1.0, min(self.ttl, 60.0))
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_expired()
+
+    def clear(self):
+        with self._lock:
+            for digest in [d for d, entry in self._entries.items() if not entry.in_use]:
+                self._remove(digest)
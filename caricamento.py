@@ -0,0 +1,130 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+from typing import Tuple
+
+from formati import file_format
+
+# Dimensione massima di un file caricato (oltre: HTTP 413)
+UPLOAD_MAX_BYTES = int(os.getenv("EXCEL_UPLOAD_MAX_BYTES", 100 * 1024 * 1024))
+# Blocchi letti dall'upload e scritti su disco
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Spazio per i campi del form oltre al file, nel controllo anticipato del Content-Length
+UPLOAD_FORM_BYTES = 64 * 1024
+
+# Controlli sulla central directory dei file .xlsx (prima di qualunque parsing)
+ZIP_MAX_BYTES = int(os.getenv("EXCEL_ZIP_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+ZIP_MAX_RATIO = float(os.getenv("EXCEL_ZIP_MAX_RATIO", "100"))
+ZIP_MAX_MEMBERS = 10000
+# Il rapporto di compressione si controlla solo sui membri più grandi di così
+ZIP_RATIO_MIN_BYTES = 1024 * 1024
+
+# Firma dei file .xls (contenitore OLE2)
+_OLE2_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+# Firme dei file Parquet (all'inizio e alla fine) e Arrow IPC / Feather v2 (all'inizio)
+_PARQUET_SIGNATURE = b"PAR1"
+_ARROW_SIGNATURE = b"ARROW1"
+# Byte iniziali di un CSV controllati per escludere i file binari
+_CSV_CHECK_BYTES = 64 * 1024
+
+
+class UploadError(Exception):
+    """File caricato non valido o sospetto (HTTP 400)"""
+
+
+class UploadTooLargeError(UploadError):
+    """File caricato oltre UPLOAD_MAX_BYTES (HTTP 413)"""
+
+
+def _mb(size: int) -> str:
+    return f"{size / (1024 * 1024):.3g} MB"
+
+
+def size_limit_error(max_bytes: int = None) -> UploadTooLargeError:
+    """Errore per un file oltre max_bytes (default UPLOAD_MAX_BYTES)"""
+    max_bytes = UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    return UploadTooLargeError(f"Il file supera la dimensione massima di {_mb(max_bytes)}")
+
+
+def check_workbook(path: str, filename: str):
+    """
+    Verifica economica del file prima del parsing: per i .xlsx legge solo la central
+    directory dello zip (numero di membri, dimensione decompressa totale e di ogni foglio,
+    rapporto di compressione), per i .xls la firma OLE2, per Parquet e Arrow le firme del
+    formato, per i CSV che l'inizio del file sia testo. Solleva UploadError.
+    Le dimensioni dichiarate sono vincolanti: zipfile non legge oltre file_size.
+    """
+    try:
+        name = file_format(filename).name
+    except ValueError as e:
+        raise UploadError(str(e))
+    if name != 'xlsx':
+        _check_signature(path, name)
+        return
+
+    try:
+        with zipfile.ZipFile(path) as archive:
+            members = archive.infolist()
+    except (zipfile.BadZipFile, OSError):
+        raise UploadError("Il file non è un Excel .xlsx valido")
+
+    if len(members) > ZIP_MAX_MEMBERS:
+        raise UploadError(f"Il file .xlsx contiene troppi elementi ({len(members)})")
+    total = 0
+    for info in members:
+        total += info.file_size
+        if info.file_size > ZIP_MAX_BYTES or total > ZIP_MAX_BYTES:
+            raise UploadError(f"Il file .xlsx decompresso supera {_mb(ZIP_MAX_BYTES)} ({info.filename})")
+        if info.file_size >= ZIP_RATIO_MIN_BYTES and info.file_size > ZIP_MAX_RATIO * max(info.compress_size, 1):
+            raise UploadError(f"Rapporto di compressione sospetto in {info.filename} "
+                              f"({info.file_size // max(info.compress_size, 1)}:1)")
+
+
+def _check_signature(path: str, name: str):
+    with open(path, "rb") as f:
+        head = f.read(_CSV_CHECK_BYTES)
+        if name == 'xls' and not head.startswith(_OLE2_SIGNATURE):
+            raise UploadError("Il file non è un Excel .xls valido")
+        if name == 'csv' and b"\x00" in head:
+            raise UploadError("Il file non è un CSV di testo valido")
+        if name == 'arrow' and not head.startswith(_ARROW_SIGNATURE):
+            raise UploadError("Il file non è un file Arrow (IPC / Feather v2) valido")
+        if name == 'parquet':
+            f.seek(max(os.path.getsize(path) - len(_PARQUET_SIGNATURE), 0))
+            if not head.startswith(_PARQUET_SIGNATURE) or f.read() != _PARQUET_SIGNATURE:
+                raise UploadError("Il file non è un Parquet valido")
+
+
+async def save_upload(file, directory: str, max_bytes: int = None) -> Tuple[str, str, int]:
+    """
+    Copia l'upload (UploadFile) su un file temporaneo in directory a blocchi di
+    UPLOAD_CHUNK_BYTES, calcolando intanto lo SHA-256: in memoria resta un solo blocco.
+    Interrompe la copia appena si supera max_bytes (UploadTooLargeError), poi controlla
+    il file con check_workbook. Restituisce (percorso, SHA-256, dimensione); il file
+    va spostato o eliminato dal chiamante.
+    """
+    max_bytes = UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    # Dimensione già nota (multipart con file su disco): rifiuto prima della copia
+    if file.size is not None and file.size > max_bytes:
+        raise size_limit_error(max_bytes)
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="upload_", suffix=".part", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise size_limit_error(max_bytes)
+                digest.update(chunk)
+                f.write(chunk)
+        check_workbook(path, file.filename)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, digest.hexdigest(), size
@@ -0,0 +1,132 @@
+import numpy as np
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+# Numero massimo di cifre decimali gestite dal motore intero
+MAX_SCALA = 9
+
+_INT64_MAX = int(np.iinfo(np.int64).max)
+# Oltre questa soglia la rappresentazione decimale di un float non è più univoca
+_LIMITE_ESATTO = float(2 ** 52)
+
+
+def decimal_scale(values, max_scale: int = MAX_SCALA) -> Optional[int]:
+    """
+    Restituisce il minimo numero di cifre decimali k tale che ogni valore sia
+    esattamente uguale a un intero × 10^-k (come farebbe Decimal(str(v))).
+    Restituisce None se i valori non sono rappresentabili in modo esatto.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return 0
+    if not np.all(np.isfinite(values)):
+        return None
+
+    max_abs = float(np.abs(values).max())
+    for k in range(max_scale + 1):
+        factor = 10.0 ** k
+        if max_abs * factor >= _LIMITE_ESATTO:
+            return None
+        scaled = np.round(values * factor)
+        if np.array_equal(scaled / factor, values):
+            return k
+    return None
+
+
+def to_scaled_int(values, max_scale: int = MAX_SCALA) -> Optional[Tuple[np.ndarray, int]]:
+    """
+    Converte i valori in interi int64 scalati: values == ints × 10^-scale.
+    Restituisce (ints, scale) oppure None se la conversione non è esatta.
+    """
+    scale = decimal_scale(values, max_scale)
+    if scale is None:
+        return None
+    values = np.asarray(values, dtype=np.float64)
+    return np.round(values * 10.0 ** scale).astype(np.int64), scale
+
+
+def exact_dot(a: np.ndarray, b: np.ndarray) -> int:
+    """
+    Prodotto scalare esatto tra due array di interi.
+    Usa int64 quando non c'è rischio di overflow, altrimenti somma a blocchi
+    o ricade sugli interi Python (precisione arbitraria).
+    """
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    n = len(a)
+    if n == 0:
+        return 0
+
+    max_a = max(abs(int(a.max())), abs(int(a.min())))
+    max_b = max(abs(int(b.max())), abs(int(b.min())))
+    max_product = max_a * max_b
+    if max_product == 0:
+        return 0
+
+    # Caso comune: nessun overflow possibile sull'intera somma
+    if max_product * n <= _INT64_MAX:
+        return int(np.dot(a, b))
+
+    # Il singolo prodotto sta in int64: somma a blocchi in interi Python
+    if max_product <= _INT64_MAX:
+        chunk = max(1, _INT64_MAX // max_product)
+        return sum(int(np.dot(a[i:i + chunk], b[i:i + chunk])) for i in range(0, n, chunk))
+
+    # Fallback: interi Python a precisione arbitraria
+    return int(np.dot(a.astype(object), b.astype(object)))
+
+
+def exact_segment_dots(a: np.ndarray, b: np.ndarray, bounds) -> List[int]:
+    """
+    Prodotti scalari esatti di ogni segmento contiguo [bounds[k], bounds[k+1]) di due array
+    di interi (es. righe ordinate per gruppo): una sola riduzione np.add.reduceat in int64
+    quando non c'è rischio di overflow, altrimenti exact_dot segmento per segmento.
+    """
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    bounds = np.asarray(bounds, dtype=np.int64)
+    starts, stops = bounds[:-1], bounds[1:]
+    if len(a) == 0:
+        return [0] * len(starts)
+
+    max_a = max(abs(int(a.max())), abs(int(a.min())))
+    max_b = max(abs(int(b.max())), abs(int(b.min())))
+    if max_a * max_b * len(a) <= _INT64_MAX:
+        sums = np.zeros(len(starts), dtype=np.int64)
+        # reduceat su un segmento vuoto restituirebbe l'elemento iniziale: solo quelli non vuoti
+        filled = stops > starts
+        if filled.any():
+            sums[filled] = np.add.reduceat(a * b, starts[filled])
+        return [int(value) for value in sums]
+    return [exact_dot(a[start:stop], b[start:stop]) for start, stop in zip(starts, stops)]
+
+
+def _decimal_total(quantities, prices) -> Decimal:
+    """Somma Σ(q_i × p_i) con Decimal, usata quando i valori non sono scalabili esattamente"""
+    total = Decimal('0')
+    for qty, price in zip(np.asarray(quantities).tolist(), np.asarray(prices).tolist()):
+        total += Decimal(str(qty)) * Decimal(str(price))
+    return total
+
+
+def exact_total(quantities, prices) -> Decimal:
+    """
+    Calcola Σ(q_i × p_i) in modo esatto con aritmetica intera vettorizzata.
+    Il risultato coincide con la somma Decimal(str(q)) × Decimal(str(p)) riga per riga.
+    """
+    quantities = np.asarray(quantities, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+
+    scaled_q = to_scaled_int(quantities)
+    scaled_p = to_scaled_int(prices)
+    if scaled_q is None or scaled_p is None:
+        return _decimal_total(quantities, prices)
+
+    q_int, q_scale = scaled_q
+    p_int, p_scale = scaled_p
+    return Decimal(exact_dot(q_int, p_int)).scaleb(-(q_scale + p_scale))
+
+
+def exact_total_cents(quantities, prices) -> int:
+    """Totale esatto Σ(q_i × p_i) espresso in centesimi (troncato come int(Decimal × 100))"""
+    return int(exact_total(quantities, prices) * 100)
@@ -0,0 +1,83 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from centesimi import exact_dot, exact_total
+from lettura_excel import ColonneFoglio
+from solver_milp import integer_problem
+
+# Prima riga di dati nel foglio (riga 1 = intestazione)
+FIRST_DATA_ROW = 2
+
+
+class ColonneSolver:
+    """
+    Dati su cui lavora il solver, in array contigui (memoria proporzionale alle righe,
+    non alla larghezza del foglio):
+    - rows: riga Excel di ogni elemento
+    - quantities: quantità (float64 come lette e scalate, int64 dopo l'arrotondamento)
+    - prices: prezzi (NaN e infiniti → 0)
+    - units: prezzi in interi sulla scala del target (es. centesimi con scale=2),
+      None se prezzi o target hanno più di MAX_SCALA cifre decimali (o se la conversione
+      è rimandata con to_units=False, es. agli shard di solver_shard)
+    """
+
+    __slots__ = ("rows", "quantities", "prices", "units", "scale")
+
+    def __init__(self, quantities, prices, target_total: float, first_row: int = FIRST_DATA_ROW,
+                 to_units: bool = True):
+        quantities = np.asarray(quantities, dtype=np.float64)
+        prices = np.asarray(prices, dtype=np.float64)
+        self.quantities = np.where(np.isfinite(quantities), quantities, 0.0)
+        self.prices = np.where(np.isfinite(prices), prices, 0.0)
+        self.rows = np.arange(first_row, first_row + len(self.prices), dtype=np.int64)
+
+        problem = integer_problem(self.prices, target_total) if to_units else None
+        if problem is None:
+            self.units, self.scale = None, None
+        else:
+            self.units, _, self.scale = problem
+
+    @classmethod
+    def from_sheet(cls, sheet: ColonneFoglio, quantity_column: str, price_column: str,
+                   target_total: float, data_rows: int = None, to_units: bool = True) -> "ColonneSolver":
+        """Colonne quantità e prezzo dell'ingestione, limitate alle prime data_rows righe"""
+        return cls(sheet[quantity_column][:data_rows], sheet[price_column][:data_rows], target_total,
+                   to_units=to_units)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, quantity_column: str, price_column: str,
+                   target_total: float) -> "ColonneSolver":
+        return cls(df[quantity_column].to_numpy(dtype=float), df[price_column].to_numpy(dtype=float),
+                   target_total)
+
+    def to_frame(self, quantity_column: str, price_column: str) -> pd.DataFrame:
+        """DataFrame (indice = riga Excel) per chi lavora ancora con pandas"""
+        return pd.DataFrame({quantity_column: self.quantities, price_column: self.prices},
+                            index=pd.Index(self.rows, name="row"))
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    @property
+    def nbytes(self) -> int:
+        units = self.units.nbytes if self.units is not None else 0
+        return self.rows.nbytes + self.quantities.nbytes + self.prices.nbytes + units
+
+    @property
+    def is_integer(self) -> bool:
+        return self.quantities.dtype.kind == "i"
+
+    def round(self):
+        """Arrotonda le quantità all'intero più vicino (da qui in poi int64)"""
+        self.quantities = np.rint(self.quantities).astype(np.int64)
+
+    def total(self) -> float:
+        return float(np.dot(self.quantities, self.prices))
+
+    def exact_total(self) -> Decimal:
+        """Totale Σ(q_i × p_i) esatto: in interi scalati dopo l'arrotondamento, altrimenti Decimal"""
+        if self.is_integer and self.units is not None:
+            return Decimal(exact_dot(self.quantities, self.units)).scaleb(-self.scale)
+        return exact_total(self.quantities, self.prices)
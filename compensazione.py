@@ -0,0 +1,388 @@
+import os
+
+import numpy as np
+
+from centesimi import exact_dot
+
+# Memoria massima (byte) della programmazione dinamica sul residuo
+RESIDUAL_DP_BYTES = int(os.getenv("EXCEL_RESIDUAL_DP_BYTES", 64 * 1024 * 1024))
+# Prezzi distinti (i più economici) usati dalla programmazione dinamica
+RESIDUAL_PRICES = 32
+# Residuo lasciato alla programmazione dinamica, in multipli del prezzo candidato più alto
+RESIDUAL_KEEP = 2
+
+_INT64_MAX = float(np.iinfo(np.int64).max)
+# Byte per valore della finestra della ricerca in ampiezza: parent (int16) più frontiera,
+# livello in costruzione e loro concatenazione (int64, insieme al più 2 valori per posizione)
+_WINDOW_BYTES = 2 + 2 * 8
+# Byte per coppia (valore, passo) di un blocco di espansione: somme e copie filtrate (int64),
+# indici dei passi (int16) e maschere
+_PAIR_BYTES = 24
+
+
+def _half_width(max_bytes: int) -> int:
+    """Semi-larghezza della finestra: metà di max_bytes alla finestra, il resto ai blocchi"""
+    return max(1, max_bytes // (4 * _WINDOW_BYTES))
+
+
+class ChiusuraResiduo:
+    """
+    Esito della chiusura del residuo:
+    - delta: variazione intera della quantità di ogni riga
+    - closed: residuo chiuso esattamente
+    - reachable: il residuo è multiplo del MCD dei prezzi (altrimenti si chiude
+      fino al multiplo più vicino)
+    - remaining: residuo rimasto, in unità di prezzo
+    - changes: unità spostate in totale (Σ |delta|)
+    """
+
+    def __init__(self, delta: np.ndarray, residual: int, remaining: int, reachable: bool, method: str):
+        self.delta = delta
+        self.residual = residual
+        self.remaining = remaining
+        self.reachable = reachable
+        self.method = method
+
+    @property
+    def closed(self) -> bool:
+        return self.remaining == 0
+
+    @property
+    def changes(self) -> int:
+        return int(np.abs(self.delta).sum())
+
+    def to_dict(self):
+        return {
+            "residual": self.residual,
+            "remaining": self.remaining,
+            "closed": self.closed,
+            "reachable": self.reachable,
+            "changes": self.changes,
+            "rows_changed": int(np.count_nonzero(self.delta)),
+            "method": self.method
+        }
+
+
+def _candidate_prices(prices, residual, count):
+    """
+    Indici dei count prezzi più economici, più quelli necessari perché il loro MCD
+    divida il residuo (prices è ordinato in modo crescente)
+    """
+    selected = np.arange(min(count, len(prices)))
+    divisor = int(np.gcd.reduce(prices[selected]))
+    if residual % divisor == 0 or len(selected) == len(prices):
+        return selected
+    rest = np.arange(len(selected), len(prices))
+    divisors = np.gcd.accumulate(np.concatenate([[divisor], prices[rest]]))
+    lowers = np.flatnonzero(np.diff(divisors) != 0)
+    return np.concatenate([selected, rest[lowers]])
+
+
+def _shortest_steps(steps, target, half_width, max_bytes):
+    """
+    Ricerca in ampiezza sugli scostamenti in [-half_width, half_width]: il numero minimo
+    di passi (±prezzo) che somma esattamente a target. Restituisce quante volte è usato
+    ogni passo, oppure None se target non è raggiungibile nella finestra.
+    """
+    width = 2 * half_width + 1
+    parent = np.full(width, -1, dtype=np.int16)
+    parent[half_width] = len(steps)  # origine
+    goal = target + half_width
+    # Blocchi della frontiera espansi insieme, nella memoria lasciata libera dalla finestra
+    chunk = max(1, (max_bytes - width * _WINDOW_BYTES) // (len(steps) * _PAIR_BYTES))
+    frontier = np.array([half_width], dtype=np.int64)
+
+    while parent[goal] < 0 and len(frontier):
+        levels = []
+        for start in range(0, len(frontier), chunk):
+            reached = (frontier[start:start + chunk, None] + steps[None, :]).ravel()
+            step_index = np.tile(np.arange(len(steps), dtype=np.int16), len(reached) // len(steps))
+            keep = (reached >= 0) & (reached < width)
+            reached, step_index = reached[keep], step_index[keep]
+            keep = parent[reached] < 0
+            reached, step_index = reached[keep], step_index[keep]
+            # Per ogni valore nuovo vale uno qualsiasi dei passi che lo raggiungono (stesso
+            # livello): la frontiera non ha duplicati, quindi le coppie (valore, passo) sono
+            # distinte e rileggendo parent resta esattamente una coppia per valore (senza sort)
+            parent[reached] = step_index
+            levels.append(reached[parent[reached] == step_index])
+        frontier = np.concatenate(levels)
+
+    if parent[goal] < 0:
+        return None
+    counts = np.zeros(len(steps), dtype=np.int64)
+    position = goal
+    while position != half_width:
+        step = int(parent[position])
+        counts[step] += 1
+        position -= int(steps[step])
+    return counts
+
+
+def _bounded_steps(prices, lower, upper, target: int, max_bytes: int):
+    """
+    Programmazione dinamica con capacità: il minimo di unità Σ |n_i| con Σ n_i × prezzo_i = target
+    e lower_i ≤ n_i ≤ upper_i. Le unità di ogni prezzo sono scomposte per verso in blocchi
+    di 1, 2, 4, … (zaino 0/1 limitato); le somme parziali restano tra −Σ diminuzioni e
+    +Σ aumenti, finestra ristretta attorno a [0, target] se supera max_bytes.
+    Restituisce le unità nette per prezzo, oppure None se target non è raggiungibile.
+    """
+    prices = [int(price) for price in prices]
+    lower = [int(limit) for limit in lower]
+    # Gli aumenti non superano |target| più tutte le diminuzioni possibili (e viceversa)
+    falling = sum(-limit * price for limit, price in zip(lower, prices))
+    upper = [min(int(limit), (abs(target) + falling) // price) for limit, price in zip(upper, prices)]
+    rising = sum(limit * price for limit, price in zip(upper, prices))
+    lower = [max(limit, -((abs(target) + rising) // price)) for limit, price in zip(lower, prices)]
+    falling = sum(-limit * price for limit, price in zip(lower, prices))
+
+    blocks = []  # (indice del prezzo, unità con segno)
+    for index, price in enumerate(prices):
+        for sign, limit in ((1, upper[index]), (-1, -lower[index])):
+            size = 1
+            while limit > 0:
+                blocks.append((index, sign * min(size, limit)))
+                limit -= size
+                size *= 2
+    if not blocks:
+        return None
+    low, high = -falling, rising
+    # Per valore della finestra: una scelta per blocco (bool) più costi e costi spostati (int64);
+    # a parte la lista dei blocchi e i limiti in interi Python (~256 byte per blocco)
+    budget = (max_bytes - 256 * len(blocks)) // (len(blocks) + 16)
+    if high - low + 1 > budget:
+        pad = (budget - abs(target) - 1) // 2
+        if pad <= 0:
+            return None
+        low, high = max(low, min(target, 0) - pad), min(high, max(target, 0) + pad)
+    if not low <= target <= high:
+        return None
+
+    width = high - low + 1
+    unreachable = np.iinfo(np.int64).max // 2
+    cost = np.full(width, unreachable, dtype=np.int64)
+    cost[-low] = 0
+    moved = np.empty(width, dtype=np.int64)
+    taken = np.zeros((len(blocks), width), dtype=bool)
+    # Operazioni sul posto (out=): nessun altro array grande quanto la finestra
+    for block, (index, count) in enumerate(blocks):
+        shift = count * prices[index]
+        if abs(shift) >= width:
+            continue
+        if shift > 0:
+            moved[:shift] = unreachable
+            np.add(cost[:-shift], abs(count), out=moved[shift:])
+        else:
+            moved[shift:] = unreachable
+            np.add(cost[-shift:], abs(count), out=moved[:shift])
+        np.less(moved, cost, out=taken[block])
+        np.minimum(moved, cost, out=cost)
+
+    position = target - low
+    if cost[position] >= unreachable:
+        return None
+    counts = np.zeros(len(prices), dtype=np.int64)
+    for block in range(len(blocks) - 1, -1, -1):
+        if taken[block, position]:
+            index, count = blocks[block]
+            counts[index] += count
+            position -= count * prices[index]
+    return counts
+
+
+def _reduce(prices, down_capacity, residual: int, keep: int, up_capacity=None):
+    """
+    Riduzione del residuo con i prezzi più alti: dal prezzo più alto, quante più unità
+    possibile finché il residuo supera keep (in diminuzione entro down_capacity, in aumento
+    entro up_capacity se indicata, altrimenti senza limite).
+    Invece di scorrere i prezzi uno a uno salta con searchsorted al prezzo successivo
+    utilizzabile ed esaurisce con una somma cumulativa i prezzi la cui capacità non basta:
+    il residuo si almeno dimezza a ogni giro (O(log residuo) giri).
+    Restituisce (unità usate per prezzo, residuo rimasto).
+    """
+    used = np.zeros(len(prices), dtype=np.int64)
+    sign = 1 if residual > 0 else -1
+    limits = down_capacity if sign < 0 else up_capacity
+    excess = abs(residual) - keep
+    top = len(prices)
+    while top > 0 and excess >= prices[0]:
+        # Prezzo più alto ≤ excess (la chiave resta in int64 anche per residui enormi)
+        index = int(np.searchsorted(prices[:top], min(excess, int(prices[top - 1])), side="right")) - 1
+        if limits is None:
+            count = excess // int(prices[index])
+            used[index] = count
+            excess -= count * int(prices[index])
+            top = index
+            continue
+        # Valore cumulato della capacità dei prezzi da index in giù
+        price_run, capacity = prices[index::-1], limits[index::-1]
+        if float(prices[index]) * float(capacity.sum()) >= _INT64_MAX:
+            # Somme oltre int64: interi Python a precisione arbitraria
+            price_run, capacity = price_run.astype(object), capacity.astype(object)
+        values = np.cumsum(price_run * capacity)
+        full = int(np.searchsorted(values, min(excess, int(values[-1])), side="right"))
+        used[index - full + 1:index + 1] = sign * limits[index - full + 1:index + 1]
+        if full:
+            excess -= int(values[full - 1])
+        if full > index:
+            break
+        # Primo prezzo con capacità sufficiente: ne usa solo una parte
+        partial = index - full
+        count = excess // int(prices[partial])
+        used[partial] = sign * count
+        excess -= count * int(prices[partial])
+        top = partial
+    return used, sign * (excess + keep)
+
+
+def _spread(counts: np.ndarray, capacity: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Distribuisce counts[g] unità sulle righe di ogni gruppo g (righe contigue da starts[g])
+    il più uniformemente possibile entro la capacità di ciascuna: ogni riga riceve fino a
+    L − 1 unità, le prime righe con capacità ≥ L una in più. Il livello L di tutti i gruppi
+    si cerca insieme per bisezione (ogni passo è una somma per gruppo).
+    """
+    capacity = capacity.astype(np.int64)
+    counts = counts.astype(np.int64)
+    group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(capacity))))
+    low = np.zeros(len(counts), dtype=np.int64)
+    high = counts.copy()
+    # Livello minimo L di ogni gruppo con Σ min(capacità, L) ≥ count
+    while (low < high).any():
+        level = (low + high) // 2
+        enough = np.add.reduceat(np.minimum(capacity, level[group]), starts) >= counts
+        high = np.where(enough, level, high)
+        low = np.where(enough, low, np.minimum(level + 1, high))
+    delta = np.minimum(capacity, np.maximum(low - 1, 0)[group])
+    extra = counts - np.add.reduceat(delta, starts)
+    # Una unità in più alle prime extra righe del gruppo con capacità ≥ L
+    wide = capacity >= low[group]
+    rank = np.cumsum(wide)
+    rank -= (rank[starts] - wide[starts])[group]
+    delta[wide & (rank <= extra[group])] += 1
+    return delta
+
+
+def close_residual(units, quantities, residual: int, min_quantity=1,
+                   max_bytes: int = None, max_prices: int = None, max_quantity=None) -> ChiusuraResiduo:
+    """
+    Chiude il residuo Σ delta_i × c_i = residual con il minor numero di unità spostate
+    (problema del resto con monete ±c_i). units sono i prezzi interi in scala comune
+    (es. centesimi), quantities le quantità intere correnti: si può aumentare ogni riga
+    (fino a max_quantity se indicato, np.inf = senza limite), diminuirla fino a min_quantity.
+    min_quantity e max_quantity possono essere un valore unico o un limite per riga.
+
+    1. MCD dei prezzi: se non divide il residuo il target non è raggiungibile e si
+       punta al multiplo più vicino
+    2. Riduzione del residuo con i prezzi più alti (meno unità spostate) finché ne
+       restano pochi multipli del prezzo candidato più alto
+    3. Ricerca in ampiezza (programmazione dinamica) sui prezzi distinti più economici,
+       in una finestra limitata da max_bytes; se i passi trovati superano la capacità
+       delle righe (min_quantity, max_quantity) e togliere quei prezzi non basta, una
+       programmazione dinamica con capacità sugli stessi prezzi
+    """
+    units = np.asarray(units, dtype=np.int64)
+    quantities = np.asarray(quantities, dtype=np.int64)
+    max_bytes = RESIDUAL_DP_BYTES if max_bytes is None else max_bytes
+    max_prices = RESIDUAL_PRICES if max_prices is None else max_prices
+    delta = np.zeros(len(units), dtype=np.int64)
+    down = np.maximum(quantities - np.asarray(min_quantity, dtype=np.int64), 0)
+    up = None
+    if max_quantity is not None:
+        up = np.maximum(np.asarray(max_quantity, dtype=np.float64) - quantities, 0)
+
+    # Le righe senza capacità in nessuna direzione (es. limiti min = max) non si spostano
+    movable = units > 0 if up is None else (units > 0) & ((down > 0) | (up > 0))
+    if residual == 0 or not movable.any():
+        return ChiusuraResiduo(delta, residual, residual, residual == 0, "none")
+
+    # 1. Raggiungibilità
+    divisor = int(np.gcd.reduce(units[movable]))
+    reachable = residual % divisor == 0
+    goal = divisor * int(round(residual / divisor)) if not reachable else residual
+
+    # Prezzi distinti (righe raggruppate per prezzo crescente) con la capacità di
+    # diminuzione complessiva delle loro righe
+    rows_by_price = np.flatnonzero(movable)
+    rows_by_price = rows_by_price[np.argsort(units[rows_by_price], kind="stable")]
+    sorted_units = units[rows_by_price]
+    starts = np.flatnonzero(np.diff(sorted_units, prepend=0))
+    prices = sorted_units[starts]
+    down_capacity = np.add.reduceat(down[rows_by_price], starts)
+
+    candidates = _candidate_prices(prices, goal, max_prices)
+    keep = RESIDUAL_KEEP * int(prices[candidates].max())
+    up_capacity = None
+    if up is not None:
+        # Oltre 2 × (|residuo| + keep) unità per riga la capacità in aumento non serve
+        # (ogni unità sposta almeno 1): limite finito per restare in int64
+        up = np.minimum(up, 2 * (abs(goal) + keep) + 1).astype(np.int64)
+        up_capacity = np.add.reduceat(up[rows_by_price], starts)
+
+    # 2. Riduzione con i prezzi più alti
+    used, remaining = _reduce(prices, down_capacity, goal, keep, up_capacity)
+
+    # 3. Programmazione dinamica sul residuo rimasto
+    method = "bulk"
+    if remaining != 0:
+        half_width = min(abs(remaining) + keep, _half_width(max_bytes))
+        steps_prices = prices[candidates]
+        down_limit, up_limit = down_capacity, up_capacity
+        for _ in range(len(candidates) + 1):
+            spare = down_capacity[candidates] + np.minimum(used[candidates], 0)
+            allowed = spare > 0
+            rising = (np.ones(len(candidates), dtype=bool) if up_capacity is None else
+                      up_capacity[candidates] - np.maximum(used[candidates], 0) > 0)
+            steps = np.concatenate([steps_prices[rising], -steps_prices[allowed]])
+            owners = np.concatenate([candidates[rising], candidates[allowed]])
+            if (abs(remaining) > half_width or (remaining < 0 and not allowed.any())
+                    or (remaining > 0 and not rising.any())):
+                break
+            counts = _shortest_steps(steps, remaining, half_width, max_bytes)
+            if counts is None:
+                break
+            net = np.zeros(len(prices), dtype=np.int64)
+            np.add.at(net, owners, counts * np.sign(steps))
+            total = used + net
+            over = (total < 0) & (-total > down_capacity)
+            over_up = (total > up_capacity) if up_capacity is not None else np.zeros(len(prices), dtype=bool)
+            if not over.any() and not over_up.any():
+                used = total
+                remaining = 0
+                method = "dp"
+                break
+            # Spostamenti oltre la capacità: si riprova senza quei prezzi in quella direzione
+            # (la capacità residua diventa quella già usata dalla riduzione)
+            down_capacity = np.where(over, -np.minimum(used, 0), down_capacity)
+            if up_capacity is not None:
+                up_capacity = np.where(over_up, np.maximum(used, 0), up_capacity)
+
+        if remaining != 0:
+            # Le capacità sono per prezzo: unità nette entro [-capacità in diminuzione,
+            # capacità in aumento] contando anche quelle già usate dalla riduzione
+            lower = -down_limit[candidates] - used[candidates]
+            upper = (up_limit[candidates] - used[candidates] if up_limit is not None
+                     else np.full(len(candidates), np.iinfo(np.int64).max))
+            counts = _bounded_steps(steps_prices, lower, upper, remaining, max_bytes)
+            if counts is not None:
+                used[candidates] += counts
+                remaining = 0
+                method = "dp"
+
+    # Distribuzione delle unità sulle righe di ogni prezzo: le diminuzioni entro la capacità
+    # di ogni riga, gli aumenti entro max_quantity o senza limite (capacità = unità da distribuire)
+    sizes = np.diff(np.append(starts, len(rows_by_price)))
+    for sign in (1, -1):
+        groups = used * sign > 0
+        if not groups.any():
+            continue
+        rows = rows_by_price[np.repeat(groups, sizes)]
+        counts = sign * used[groups]
+        if sign < 0:
+            capacity = down[rows]
+        else:
+            capacity = up[rows] if up is not None else np.repeat(counts, sizes[groups])
+        delta[rows] += sign * _spread(counts, capacity, np.cumsum(sizes[groups]) - sizes[groups])
+
+    remaining = residual - exact_dot(delta, units)
+    return ChiusuraResiduo(delta, residual, remaining, reachable, method)
@@ -0,0 +1,208 @@
+"""
+Conversione nativa dei .xls (Excel 97-2003) in .xlsx, senza pandas: ogni foglio è letto
+con xlrd (on_demand, un foglio alla volta) e scritto in streaming come XML SpreadsheetML
+direttamente nello zip di uscita, applicando nello stesso passaggio le celle corrette.
+Rispetto a pd.read_excel + ExcelWriter + patch dell'.xlsx intermedio: un solo parsing,
+nessun file intermedio, celle copiate con il loro tipo (numeri, testo, date, booleani,
+errori) e l'intestazione com'è nel foglio. Le formule dei .xls non sono leggibili con
+xlrd: restano i valori salvati nel file, come nella conversione con pandas.
+"""
+import re
+import zipfile
+from typing import Dict, Optional
+from xml.sax.saxutils import escape, quoteattr
+
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+from scrittura_xlsx import CellValue
+
+# Righe del foglio accumulate prima di ogni scrittura nello zip
+XLS_ROWS_PER_WRITE = 2000
+
+# Caratteri di controllo non ammessi in XML 1.0
+_ILLEGAL_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# Tipi di cella di xlrd (xlrd.XL_CELL_*)
+_EMPTY, _TEXT, _NUMBER, _DATE, _BOOLEAN, _ERROR, _BLANK = range(7)
+
+# Stili: 0 = generale, 1 = data, 2 = data e ora
+_STYLE_DATE, _STYLE_DATETIME = 1, 2
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '{sheets}</Types>'
+)
+_SHEET_CONTENT_TYPE = ('<Override PartName="/xl/worksheets/sheet{index}.xml" '
+                       'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>')
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '{sheets}<Relationship Id="rId{styles}" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/></Relationships>'
+)
+_SHEET_REL = ('<Relationship Id="rId{index}" '
+              'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+              'Target="worksheets/sheet{index}.xml"/>')
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<workbookPr{date1904}/><sheets>{sheets}</sheets>{calc}</workbook>'
+)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+_SHEET_START = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetData>')
+_SHEET_END = '</sheetData></worksheet>'
+
+
+def _number(value: float) -> str:
+    """Numero come nel resto delle patch (scrittura_xlsx): interi senza decimali"""
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _text(value: str) -> str:
+    return escape(_ILLEGAL_XML.sub("", value))
+
+
+def _cell(ref: str, cell_type: int, value, error_text: Dict[int, str]) -> str:
+    """XML di una cella letta da xlrd ('' per le celle vuote)"""
+    if cell_type == _NUMBER:
+        return f'<c r="{ref}"><v>{_number(value)}</v></c>'
+    if cell_type == _TEXT:
+        if not value:
+            return ""
+        space = ' xml:space="preserve"' if value != value.strip() else ""
+        return f'<c r="{ref}" t="inlineStr"><is><t{space}>{_text(value)}</t></is></c>'
+    if cell_type == _DATE:
+        style = _STYLE_DATE if float(value).is_integer() else _STYLE_DATETIME
+        return f'<c r="{ref}" s="{style}"><v>{_number(value)}</v></c>'
+    if cell_type == _BOOLEAN:
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if cell_type == _ERROR:
+        return f'<c r="{ref}" t="e"><v>{escape(error_text.get(value, "#N/A"))}</v></c>'
+    return ""
+
+
+def _patched_cell(ref: str, value: CellValue) -> str:
+    """XML di una cella corretta: formula se inizia con '=', altrimenti numero"""
+    if isinstance(value, str):
+        if not value.startswith("="):
+            raise ValueError(f"Sono supportati solo numeri e formule, non '{value}'")
+        return f'<c r="{ref}"><f>{escape(value[1:])}</f></c>'
+    return f'<c r="{ref}"><v>{_number(float(value))}</v></c>'
+
+
+def _patches_by_row(cells: Dict[str, CellValue]) -> Dict[int, Dict[int, CellValue]]:
+    """Celle corrette raggruppate per riga (0-based, come xlrd) e colonna (0-based)"""
+    rows: Dict[int, Dict[int, CellValue]] = {}
+    for ref, value in cells.items():
+        letters, row = coordinate_from_string(ref)
+        rows.setdefault(row - 1, {})[column_index_from_string(letters) - 1] = value
+    return rows
+
+
+def _write_sheet(target, sheet, patches: Dict[int, Dict[int, CellValue]], error_text: Dict[int, str]):
+    """Scrive il foglio xlrd come XML, a blocchi di righe, con le celle corrette al loro posto"""
+    letters = [get_column_letter(column + 1) for column in range(max(sheet.ncols, 1))]
+    last_row = max([sheet.nrows - 1] + list(patches))
+    target.write(_SHEET_START.encode("utf-8"))
+    chunk = []
+    for row in range(last_row + 1):
+        number = row + 1
+        if row < sheet.nrows:
+            types, values = sheet.row_types(row), sheet.row_values(row)
+        else:
+            types, values = (), ()
+        # I numeri (il caso più frequente) senza passare da _cell
+        cells = [f'<c r="{letters[column]}{number}"><v>{_number(value)}</v></c>' if cell_type == _NUMBER
+                 else _cell(f"{letters[column]}{number}", cell_type, value, error_text)
+                 for column, (cell_type, value) in enumerate(zip(types, values))]
+        patched = patches.get(row)
+        if patched:
+            for column, value in patched.items():
+                if column >= len(letters):
+                    letters.extend(get_column_letter(index + 1) for index in range(len(letters), column + 1))
+                if column >= len(cells):
+                    cells.extend([""] * (column + 1 - len(cells)))
+                cells[column] = _patched_cell(f"{letters[column]}{number}", value)
+        body = "".join(cells)
+        if body:
+            chunk.append(f'<row r="{number}">{body}</row>')
+        if len(chunk) >= XLS_ROWS_PER_WRITE:
+            target.write("".join(chunk).encode("utf-8"))
+            chunk = []
+    target.write(("".join(chunk) + _SHEET_END).encode("utf-8"))
+
+
+def convert_xls(xls_path: str, out, patches: Optional[Dict[str, Dict[str, CellValue]]] = None,
+                full_calc_on_load: bool = True):
+    """
+    Converte il .xls xls_path in un .xlsx scritto in out (percorso o file binario),
+    applicando le patch {nome foglio: {riferimento cella: valore}} come patch_workbook.
+    I fogli sono letti e scritti uno alla volta: la memoria dipende dal foglio più grande,
+    non dall'intera cartella.
+    """
+    import xlrd
+
+    patches = patches or {}
+    book = xlrd.open_workbook(xls_path, on_demand=True)
+    try:
+        names = book.sheet_names()
+        missing = [name for name in patches if name not in names]
+        if missing:
+            raise ValueError(f"Foglio '{missing[0]}' non trovato")
+
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+            indices = range(1, len(names) + 1)
+            archive.writestr("[Content_Types].xml", _CONTENT_TYPES.format(
+                sheets="".join(_SHEET_CONTENT_TYPE.format(index=index) for index in indices)))
+            archive.writestr("_rels/.rels", _ROOT_RELS)
+            archive.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS.format(
+                sheets="".join(_SHEET_REL.format(index=index) for index in indices), styles=len(names) + 1))
+            archive.writestr("xl/workbook.xml", _WORKBOOK.format(
+                date1904=' date1904="1"' if book.datemode == 1 else "",
+                sheets="".join(f'<sheet name={quoteattr(name)} sheetId="{index}" r:id="rId{index}"/>'
+                               for index, name in zip(indices, names)),
+                calc='<calcPr fullCalcOnLoad="1"/>' if full_calc_on_load else ""))
+            archive.writestr("xl/styles.xml", _STYLES)
+
+            for index, name in zip(indices, names):
+                sheet = book.sheet_by_index(index - 1)
+                with archive.open(f"xl/worksheets/sheet{index}.xml", "w", force_zip64=True) as target:
+                    _write_sheet(target, sheet, _patches_by_row(patches.get(name, {})), xlrd.error_text_from_code)
+                # Il foglio già scritto non serve più: libera la memoria prima del successivo
+                book.unload_sheet(index - 1)
+    finally:
+        book.release_resources()
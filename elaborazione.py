@@ -0,0 +1,853 @@
+# Elaborazioni CPU-bound eseguite nei processi worker (vedi job_runner):
+# analisi dei fogli per /introspect e correzione per /adjust e /adjust/batch.
+# Le funzioni sono a livello di modulo per poter essere serializzate dal pool.
+import pandas as pd
+import numpy as np
+import tempfile
+import os
+import json
+import shutil
+import time
+import zipfile
+from decimal import Decimal
+from concurrent.futures import Executor
+from typing import Any, Dict, List, Optional
+from solver_semplice import ExcelSolverSemplice as ExcelSolver
+from solver_gruppi import ExcelSolverGruppi
+from lettura_excel import ColonneFoglio, read_sheet_columns, sample_sheets
+from scrittura_xlsx import BufferUscita, FileCorretto, column_patches, patch_workbook
+from conversione_xls import convert_xls
+from formati import TABLE_SHEET, file_format
+from tabelle import read_table_frame, write_table
+from avanzamento import PhaseTracker
+from metriche import logger
+from incrementale import IncrementalError, StatoCorrezione
+from formule import FORMULA_CHECK, check_remaining_column, check_stored_column, stored_remaining
+from statistiche import column_statistics, streaming_statistics
+
+# Oltre questo numero di righe le statistiche delle colonne sono calcolate
+# in streaming con mediana approssimata (0 = sempre esatte)
+STATS_EXACT_ROWS = int(os.getenv("EXCEL_STATS_EXACT_ROWS", "1000000"))
+
+
+class CorrectionError(Exception):
+    """L'algoritmo di correzione non è riuscito (errore dei dati, non del server)"""
+
+
+def _statistic(stats, name, i):
+    """Valore della colonna i come float per JSON (0 se non definito)"""
+    value = stats[name][i]
+    return float(value) if not np.isnan(value) else 0
+
+
+def analyze_column_patterns(df, numeric_columns, approximate: bool = None):
+    """
+    Analizza i pattern delle colonne numeriche per identificare automaticamente
+    quantità, prezzi e rimanenze basandosi sui valori tipici.
+    Le statistiche di tutte le colonne sono calcolate insieme su un blocco 2-D NumPy;
+    con approximate=True (default: fogli oltre EXCEL_STATS_EXACT_ROWS righe) a blocchi,
+    con la mediana stimata su un campione.
+    """
+    column_analysis = {}
+    if not numeric_columns:
+        return column_analysis
+
+    block = df[numeric_columns].to_numpy(dtype=np.float64)
+    if approximate is None:
+        approximate = STATS_EXACT_ROWS > 0 and len(block) > STATS_EXACT_ROWS
+    if approximate:
+        stats, median_exact = streaming_statistics(block)
+    else:
+        stats, median_exact = column_statistics(block), np.ones(len(numeric_columns), dtype=bool)
+
+    for i, col in enumerate(numeric_columns):
+        # Colonne senza valori non nulli
+        count = int(stats['count'][i])
+        if count == 0:
+            continue
+
+        # Analizza i pattern
+        analysis = {
+            'column': col,
+            'count': count,
+            'mean': _statistic(stats, 'mean', i),
+            'median': _statistic(stats, 'median', i),
+            'median_exact': bool(median_exact[i]),
+            'std': _statistic(stats, 'std', i),
+            'min': _statistic(stats, 'min', i),
+            'max': _statistic(stats, 'max', i),
+            'integer_ratio': float(stats['integer_ratio'][i]),
+            'decimal_ratio': float(stats['decimal_ratio'][i]),
+            'likely_type': 'unknown'
+        }
+        
+        # Euristiche per identificare il tipo di colonna
+        
+        # QUANTITÀ: valori interi, range tipico 1-1000, bassa varianza
+        if (analysis['integer_ratio'] > 0.8 and 
+            analysis['mean'] > 0 and analysis['mean'] < 1000 and
+            analysis['std'] < analysis['mean'] * 0.5):
+            analysis['likely_type'] = 'quantity'
+            analysis['confidence'] = 0.8
+        
+        # PREZZI: valori decimali, range tipico 0.01-1000, alta varianza
+        elif (analysis['decimal_ratio'] > 0.4 and 
+              analysis['mean'] > 0.01 and analysis['mean'] < 10000 and
+              analysis['std'] > analysis['mean'] * 0.2):
+            analysis['likely_type'] = 'price'
+            analysis['confidence'] = 0.7
+        
+        # RIMANENZE/TOTALI: valori decimali, range ampio, alta varianza
+        elif (analysis['mean'] > 10 and 
+              analysis['std'] > analysis['mean'] * 0.4 and
+              analysis['max'] > analysis['mean'] * 2):
+            analysis['likely_type'] = 'remaining'
+            analysis['confidence'] = 0.6
+        
+        # VALORI PICCOLI: potrebbero essere quantità
+        elif (analysis['mean'] < 100 and analysis['integer_ratio'] > 0.6):
+            analysis['likely_type'] = 'quantity'
+            analysis['confidence'] = 0.5
+        
+        # VALORI GRANDI: potrebbero essere totali
+        elif (analysis['mean'] > 100):
+            analysis['likely_type'] = 'remaining'
+            analysis['confidence'] = 0.5
+        
+        column_analysis[col] = analysis
+    
+    return column_analysis
+
+
+def _get_excel_column_letter(index):
+    """
+    Converte un indice numerico in lettera di colonna Excel (0=A, 1=B, 25=Z, 26=AA, etc.)
+    """
+    result = ""
+    while index >= 0:
+        result = chr(index % 26 + ord('A')) + result
+        index = index // 26 - 1
+    return result
+
+
+# Righe lette per foglio nell'analisi rapida (a campione)
+INTROSPECT_SAMPLE_ROWS = int(os.getenv("EXCEL_INTROSPECT_ROWS", "1000"))
+
+
+def _sheet_info(df, row_count):
+    """
+    Colonne numeriche, dati di esempio, analisi dei pattern e colonne suggerite
+    di un foglio (df può contenere tutte le righe oppure un campione)
+    """
+    # Filtra solo le colonne numeriche e pulisce i dati
+    numeric_columns = df.select_dtypes(include=['number']).columns.tolist()
+
+    # Pulisce i dati per evitare valori inf/nan
+    clean_df = df.copy()
+    for col in numeric_columns:
+        # Sostituisce inf e nan con 0
+        clean_df[col] = clean_df[col].replace([float('inf'), float('-inf')], 0)
+        clean_df[col] = clean_df[col].fillna(0)
+
+    # Analizza i pattern delle colonne per identificazione automatica
+    column_analysis = analyze_column_patterns(clean_df, numeric_columns)
+
+    # Prepara i dati di esempio in modo sicuro
+    sample_data = []
+    if len(clean_df) > 0:
+        sample_df = clean_df.head(3)
+        for _, row in sample_df.iterrows():
+            sample_row = {}
+            for col in numeric_columns:
+                value = row[col]
+                # Converte in float sicuro per JSON
+                if pd.isna(value) or value == float('inf') or value == float('-inf'):
+                    sample_row[col] = 0.0
+                else:
+                    sample_row[col] = float(value)
+            sample_data.append(sample_row)
+
+    # Identifica automaticamente le colonne più probabili
+    suggested_columns = {
+        "quantity": None,
+        "price": None,
+        "remaining": None
+    }
+
+    # Trova le colonne con la confidenza più alta per ogni tipo
+    for col, analysis in column_analysis.items():
+        col_type = analysis.get('likely_type', 'unknown')
+        confidence = analysis.get('confidence', 0)
+
+        if col_type in suggested_columns:
+            current_confidence = 0
+            if suggested_columns[col_type]:
+                current_confidence = column_analysis[suggested_columns[col_type]].get('confidence', 0)
+
+            if confidence > current_confidence:
+                suggested_columns[col_type] = col
+
+    # Crea mapping colonne Excel (A, B, C, D...)
+    excel_column_mapping = {}
+    for i, col in enumerate(numeric_columns):
+        excel_letter = _get_excel_column_letter(i)
+        excel_column_mapping[excel_letter] = col
+
+    info = {
+        "columns": numeric_columns,
+        "row_count": row_count,
+        "sample_data": sample_data,
+        "column_analysis": column_analysis,
+        "suggested_columns": suggested_columns,
+        "excel_column_mapping": excel_column_mapping
+    }
+    return info, numeric_columns
+
+
+def _full_frames(file_path: str, sheets=None):
+    """
+    Nomi di tutti i fogli e generatore (nome, DataFrame) dei fogli richiesti letti per intero.
+    Un solo ExcelFile per tutti i fogli di una cartella: il file non viene riaperto ogni volta.
+    """
+    if not file_format(file_path).workbook:
+        missing = [sheet_name for sheet_name in sheets or [] if sheet_name != TABLE_SHEET]
+        if missing:
+            raise ValueError(f"Foglio '{missing[0]}' non trovato")
+        return [TABLE_SHEET], ((TABLE_SHEET, read_table_frame(file_path)) for _ in range(1))
+
+    excel_file = pd.ExcelFile(file_path)
+    all_sheets = excel_file.sheet_names
+
+    def frames():
+        with excel_file:
+            for sheet_name in (sheets if sheets is not None else all_sheets):
+                if sheet_name not in all_sheets:
+                    raise ValueError(f"Foglio '{sheet_name}' non trovato")
+                yield sheet_name, excel_file.parse(sheet_name)
+
+    return all_sheets, frames()
+
+
+def introspect_workbook(file_path: str, filename: str, collect_columns: bool = False,
+                        full: bool = False, sheets=None, sample_rows: int = None):
+    """
+    Analizza un file Excel (o tabellare: CSV, Parquet, Arrow, con il solo foglio
+    formati.TABLE_SHEET) e restituisce informazioni sui fogli e colonne disponibili.
+
+    Di default l'analisi è a campione: intestazioni e numero di righe dai metadati,
+    pattern calcolati sulle prime sample_rows righe (EXCEL_INTROSPECT_ROWS) di ogni foglio.
+    full=True legge ogni foglio per intero (analisi esatta, row_count esatto).
+    sheets limita l'analisi ai fogli indicati (analisi su richiesta).
+    Con collect_columns=True restituisce anche le colonne numeriche di ogni foglio
+    (ColonneFoglio) da conservare nella cache per le correzioni successive;
+    sono disponibili solo con l'analisi completa.
+    """
+    sheets_info = {}
+    sheets_columns = {}
+
+    if full:
+        all_sheets, frames = _full_frames(file_path, sheets)
+        for sheet_name, df in frames:
+            info, numeric_columns = _sheet_info(df, len(df))
+            info.update(sampled=False, row_count_exact=True, rows_analyzed=len(df))
+            sheets_info[sheet_name] = info
+
+            if collect_columns:
+                # Stesse colonne che read_sheet_columns estrarrebbe dal file
+                sheets_columns[sheet_name] = ColonneFoglio(
+                    sheet_name,
+                    [str(col) for col in df.columns],
+                    {str(col): df[col].to_numpy(dtype=np.float64) for col in numeric_columns}
+                )
+    else:
+        max_rows = sample_rows or INTROSPECT_SAMPLE_ROWS
+        all_sheets, samples = sample_sheets(file_path, sheets, max_rows)
+        for sample in samples:
+            df = pd.DataFrame(sample.rows, columns=sample.header).infer_objects()
+            # Come read_excel: le colonne del tutto vuote sono float (NaN),
+            # ma un foglio con la sola intestazione non ha colonne numeriche
+            if len(df) > 0:
+                for col in df.columns[df.isna().all().to_numpy()]:
+                    df[col] = df[col].astype(np.float64)
+            info, _ = _sheet_info(df, sample.row_count)
+            info.update(sampled=True, row_count_exact=sample.row_count_exact, rows_analyzed=len(df))
+            sheets_info[sample.sheet_name] = info
+
+    result = {
+        "success": True,
+        "sheets": sheets_info,
+        "sheet_names": all_sheets,
+        "sampled": not full,
+        "filename": filename
+    }
+    if collect_columns:
+        return result, sheets_columns
+    return result
+
+
+def _convert_xls(file_path: str) -> str:
+    """
+    Converte un .xls in un .xlsx temporaneo (conversione_xls, senza pandas) da correggere
+    più volte con la patch dell'XML (es. uno zip di /adjust/batch). File temporaneo proprio:
+    lo stesso .xls può essere corretto in parallelo.
+    """
+    with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp_xlsx:
+        xlsx_path = tmp_xlsx.name
+    convert_xls(file_path, xlsx_path, full_calc_on_load=False)
+    return xlsx_path
+
+
+def _write_workbook(src_path: str, out, patches):
+    """
+    File corretto da src_path, nel formato di uscita di formati.file_format: patch dell'XML
+    per i .xlsx, conversione in streaming con le celle corrette già applicate per i .xls
+    (nessun .xlsx intermedio), copia con le sole colonne corrette per i file tabellari
+    """
+    fmt = file_format(src_path)
+    if fmt.name == 'xls':
+        convert_xls(src_path, out, patches)
+    elif fmt.workbook:
+        patch_workbook(src_path, out, patches)
+    else:
+        write_table(src_path, out, patches)
+
+
+def adjusted_filename(filename: str, extension: str = None) -> str:
+    """
+    Nome proposto al client, con l'estensione del formato di uscita (default): i .xls
+    diventano .xlsx (conversione automatica), CSV e Parquet/Arrow restano nel loro formato
+    """
+    if extension is None:
+        extension = file_format(filename).output_filename_extension(filename)
+    return f"adjusted_{os.path.splitext(filename)[0]}{extension}"
+
+
+def _solver_columns(quantity_column, price_column, remaining_column, *optional_columns) -> List[str]:
+    """Colonne lette dal solver: le tre obbligatorie più quelle facoltative indicate (gruppo, limiti)"""
+    columns = [quantity_column, price_column, remaining_column]
+    return columns + [column for column in optional_columns if column is not None]
+
+
+def _label_columns(group_column=None, lock_column=None) -> Optional[List[str]]:
+    """Colonne lette come etichette (gruppo e blocco), None se nessuna"""
+    columns = [column for column in (group_column, lock_column) if column is not None]
+    return columns or None
+
+
+def _run_solver(sheet_name, quantity_column, price_column, remaining_column, target_total,
+                data_rows, sheet_data: ColonneFoglio, phases: PhaseTracker, solver_backend=None,
+                group_column=None, group_targets=None, min_column=None, max_column=None, lock_column=None):
+    """
+    Esegue il solver sulle colonne già lette e restituisce (solver, risultato).
+    Con group_column il target è per gruppo (solver_gruppi.ExcelSolverGruppi) e
+    target_total, se indicato, vincola anche il totale complessivo.
+    min_column / max_column / lock_column: limiti per riga facoltativi (limiti.LimitiRighe).
+    """
+    logger.debug("Creazione solver con parametri:")
+    logger.debug("  sheet_name: %s", sheet_name)
+    logger.debug("  quantity_column: %s", quantity_column)
+    logger.debug("  price_column: %s", price_column)
+    logger.debug("  remaining_column: %s", remaining_column)
+    logger.debug("  target_total: %s", target_total)
+    logger.debug("  data_rows: %s", data_rows)
+
+    columns = _solver_columns(quantity_column, price_column, remaining_column, group_column,
+                              min_column, max_column, lock_column)
+    limits = {"min_column": min_column, "max_column": max_column, "lock_column": lock_column}
+    if any(limits.values()):
+        logger.debug("  limiti per riga: %s", limits)
+    try:
+        if group_column is not None:
+            logger.debug("  group_column: %s (%d target per gruppo)", group_column, len(group_targets or {}))
+            solver = ExcelSolverGruppi(
+                file_path=None,
+                sheet_name=sheet_name,
+                quantity_column=quantity_column,
+                price_column=price_column,
+                remaining_column=remaining_column,
+                group_column=group_column,
+                group_targets=group_targets,
+                target_total=target_total,
+                data_rows=data_rows,
+                sheet_data=sheet_data.select(columns, data_rows),
+                phases=phases,
+                backend=solver_backend,
+                **limits
+            )
+        else:
+            # Inizializza il solver con la nuova logica intelligente
+            solver = ExcelSolver(
+                file_path=None,
+                sheet_name=sheet_name,
+                quantity_column=quantity_column,
+                price_column=price_column,
+                remaining_column=remaining_column,
+                target_total=target_total,
+                data_rows=data_rows,
+                sheet_data=sheet_data.select(columns, data_rows),
+                phases=phases,
+                backend=solver_backend,
+                **limits
+            )
+    except ValueError as e:
+        # Target per gruppo o limiti per riga non validi (errore della richiesta, non del server)
+        raise CorrectionError(str(e))
+
+    logger.debug("Solver creato con successo")
+
+    # Esegue la correzione
+    result = solver.adjust()
+
+    if not result["success"]:
+        raise CorrectionError(result["error"])
+    return solver, result
+
+
+def _quantity_cells(solver, target_total):
+    """Celle da riscrivere nel foglio: le quantità cambiate (e l'eventuale formula speciale)"""
+    # Indici delle colonne già individuati durante l'ingestione
+    column_indices = solver.sheet_data.column_indices
+    quantity_col_idx = column_indices.get(solver.quantity_column)
+
+    # Escludi la riga con la formula speciale se presente
+    max_data_row = None
+    if hasattr(solver, 'special_formula_row') and solver.special_formula_row:
+        max_data_row = solver.special_formula_row - 1
+        logger.debug("Esclusa riga %s con formula speciale", solver.special_formula_row)
+
+    # Riscrive solo le celle Quantità cambiate: i prezzi sono invariati e
+    # le formule delle rimanenze restano intatte (ricalcolo all'apertura)
+    cells = column_patches(
+        quantity_col_idx,
+        solver.sheet_data[solver.quantity_column],
+        solver.data.quantities,
+        last_row=max_data_row
+    )
+
+    # Aggiorna la formula speciale se presente
+    if hasattr(solver, 'special_formula_row') and solver.special_formula_row:
+        special_row = solver.special_formula_row
+        new_formula = f'=SUMIF(J2:J{max_data_row},">0") * ({int(target_total)} / SUMIF(J2:J{max_data_row},">0"))'
+        cells[f"J{special_row}"] = new_formula
+        logger.debug("Aggiornata formula speciale alla riga %s: %s", special_row, new_formula)
+
+    logger.debug("Celle modificate: %d", len(cells))
+    return cells
+
+
+def _remaining_cells(file_path: str, sheet_data: ColonneFoglio, quantity_column: str, price_column: str,
+                     remaining_column: str, quantities, prices):
+    """
+    File tabellari: nessuna formula ricalcola le rimanenze, quindi le righe con quantità o
+    prezzo cambiati ricevono quantità × prezzo (formule.stored_remaining).
+    Cartelle Excel: nessuna cella (le formule si ricalcolano all'apertura).
+    """
+    if file_format(file_path).workbook:
+        return {}
+    original, stored = stored_remaining(sheet_data, quantity_column, price_column, remaining_column,
+                                        quantities, prices)
+    return column_patches(sheet_data.column_indices[remaining_column], original, stored)
+
+
+def _solver_cells(file_path: str, solver, target_total):
+    """Celle da riscrivere: quantità cambiate più, nei file tabellari, le loro rimanenze"""
+    cells = _quantity_cells(solver, target_total)
+    cells.update(_remaining_cells(file_path, solver.sheet_data, solver.quantity_column, solver.price_column,
+                                  solver.remaining_column, solver.data.quantities, solver.data.prices))
+    return cells
+
+
+def _write_output(src_path: str, output_path: str, patches) -> FileCorretto:
+    """
+    Scrive la cartella corretta in output_path oppure, senza percorso, in un buffer
+    (memoria o file temporaneo privato) da inviare in streaming: restituisce il FileCorretto
+    """
+    if output_path is not None:
+        _write_workbook(src_path, output_path, patches)
+        return None
+    buffer = BufferUscita()
+    try:
+        _write_workbook(src_path, buffer, patches)
+    except BaseException:
+        buffer.discard()
+        raise
+    return buffer.detach_file()
+
+
+def _check_formulas(file_path: str, sheet_data: ColonneFoglio, solver, result):
+    """
+    Totale che Excel mostrerà nella colonna rimanenze dopo la correzione, confrontato con
+    final_total (in result["formula_check"]). Restituisce sheet_data con le formule lette.
+    I file tabellari (CSV, Parquet, Arrow) non hanno formule: si verificano le rimanenze
+    salvate (quantità × prezzo per riga e totale).
+    """
+    if not FORMULA_CHECK:
+        return sheet_data
+    try:
+        if file_format(file_path).workbook:
+            report, sheet_data = check_remaining_column(
+                file_path, sheet_data, solver.quantity_column, solver.price_column, solver.remaining_column,
+                solver.data.quantities, solver.data.prices, result["final_total"])
+        else:
+            report = check_stored_column(
+                sheet_data, solver.quantity_column, solver.price_column, solver.remaining_column,
+                solver.data.quantities, solver.data.prices, result["final_total"])
+    except Exception as e:
+        # La verifica è informativa: un errore non blocca la correzione
+        logger.warning("Verifica delle formule non riuscita: %s", e)
+        report = {"column": solver.remaining_column, "error": str(e)}
+    result["formula_check"] = report
+    return sheet_data
+
+
+def _solver_state(solver):
+    """Stato per le correzioni incrementali (None se non applicabile a questi dati)"""
+    try:
+        return StatoCorrezione.from_solver(solver)
+    except IncrementalError as e:
+        logger.debug("Stato incrementale non disponibile: %s", e)
+        return None
+
+
+def adjust_workbook(
+    file_path: str,
+    filename: str,
+    sheet_name: str,
+    quantity_column: str,
+    price_column: str,
+    remaining_column: str,
+    target_total: float,
+    data_rows: int,
+    progress_callback=None,
+    output_path: str = None,
+    sheet_data: ColonneFoglio = None,
+    solver_backend: str = None,
+    keep_state: bool = False,
+    group_column: str = None,
+    group_targets: Dict[str, float] = None,
+    min_column: str = None,
+    max_column: str = None,
+    lock_column: str = None
+):
+    """
+    Applica l'algoritmo di correzione al file Excel e scrive il file modificato in output_path
+    oppure, senza percorso, nel FileCorretto "output" da inviare in streaming al client.
+    Restituisce anche il nome da proporre al client e le statistiche, più le colonne lette
+    (sheet_data) da riusare nelle correzioni successive dello stesso file.
+    progress_callback(phase, progress, timings) riceve l'avanzamento per fase.
+    sheet_data: colonne già estratte in precedenza (cache), evita un nuovo parsing.
+    solver_backend: 'greedy' o 'milp' (default EXCEL_SOLVER).
+    keep_state: restituisce anche lo stato del solver ("state") per adjust_incremental.
+    group_column / group_targets: target per gruppo {valore della colonna: target}; target_total
+    (facoltativo) vincola anche il totale complessivo.
+    min_column / max_column / lock_column: quantità minima, massima e righe bloccate (facoltative).
+    """
+    phases = PhaseTracker(progress_callback)
+    columns = _solver_columns(quantity_column, price_column, remaining_column, group_column,
+                              min_column, max_column, lock_column)
+    phases.start("parsing")
+    if sheet_data is None:
+        # Legge le colonne per intero: data_rows si applica dopo, così il
+        # risultato vale anche per correzioni con un numero di righe diverso
+        # (per i .xls direttamente con xlrd, senza conversione)
+        sheet_data = read_sheet_columns(file_path, sheet_name, columns,
+                                        label_columns=_label_columns(group_column, lock_column))
+
+    solver, result = _run_solver(sheet_name, quantity_column, price_column, remaining_column,
+                                 target_total, data_rows, sheet_data, phases, solver_backend,
+                                 group_column, group_targets, min_column, max_column, lock_column)
+
+    phases.start("writing")
+
+    # Crea il file di output
+    # Se il file originale era .xls, salva come .xlsx (conversione automatica);
+    # CSV e Parquet/Arrow restano nel loro formato
+    output_filename = adjusted_filename(filename)
+
+    cells = _solver_cells(file_path, solver, target_total)
+
+    # .xlsx: patch mirata dell'XML del foglio, gli altri membri dello zip sono copiati
+    # byte per byte; .xls: conversione in streaming con le celle corrette già applicate.
+    # In entrambi i casi fullCalcOnLoad forza il ricalcolo in Excel.
+    # File tabellari: copia con le sole celle di quantità e rimanenze sostituite
+    output = _write_output(file_path, output_path, {sheet_name: cells})
+    sheet_data = _check_formulas(file_path, sheet_data, solver, result)
+
+    phases.finish()
+
+    return {
+        "output_path": output_path,
+        "output": output,
+        "output_filename": output_filename,
+        "result": result,
+        "timings": dict(phases.timings),
+        "sheet_data": sheet_data,
+        "state": _solver_state(solver) if keep_state else None
+    }
+
+
+
+def adjust_incremental(
+    file_path: str,
+    filename: str,
+    state: StatoCorrezione,
+    changes: List[Dict[str, Any]] = None,
+    target_total: float = None,
+    output_path: str = None
+):
+    """
+    Applica a una correzione precedente (state) le righe modificate e/o il nuovo target
+    senza rifare normalizzazione, scaling e arrotondamento, poi scrive il file
+    (in output_path o nel FileCorretto "output", come adjust_workbook).
+    changes: [{row (riga Excel), price?, quantity?}]. Solleva IncrementalError se
+    la modifica richiede una correzione completa. Restituisce anche il nuovo stato.
+    """
+    phases = PhaseTracker()
+    phases.start("compensation")
+    previous_total = float(state.final_total)
+    info = state.apply(changes, target_total)
+    final_total = state.final_total
+    residual = Decimal(str(state.target_total)) - final_total
+    result = {
+        "success": True,
+        "message": "Correzione incrementale applicata",
+        "original_total": previous_total,
+        "final_total": float(final_total),
+        "target_total": state.target_total,
+        "target_reached_exactly": residual == 0,
+        "residual": float(residual),
+        "rows_processed": len(state.prices),
+        "incremental": info
+    }
+    logger.debug("Correzione incrementale: %d righe modificate, %d righe spostate in %.4fs",
+                 info["rows_changed"], info["rows_moved"], info["elapsed"])
+
+    phases.start("writing")
+    output_filename = adjusted_filename(filename)
+    cells = state.cells()
+    cells.update(_remaining_cells(file_path, state.sheet_data, state.quantity_column, state.price_column,
+                                  state.remaining_column, state.quantities, state.prices))
+    output = _write_output(file_path, output_path, {state.sheet_data.sheet_name: cells})
+    phases.finish()
+
+    return {
+        "output_path": output_path,
+        "output": output,
+        "output_filename": output_filename,
+        "result": result,
+        "timings": dict(phases.timings),
+        "state": state
+    }
+
+
+# ----------------------------------------------------------------------
+# Correzioni multiple sullo stesso file (/adjust/batch)
+# ----------------------------------------------------------------------
+
+BATCH_FORMATS = ("xlsx", "zip")
+
+
+def _spec_columns(spec) -> List[str]:
+    return _solver_columns(spec["quantity_column"], spec["price_column"], spec["remaining_column"],
+                           spec.get("group_column"), spec.get("min_column"), spec.get("max_column"),
+                           spec.get("lock_column"))
+
+
+def batch_format(specs: List[Dict[str, Any]], output_format: str = None) -> str:
+    """
+    Formato del risultato di una correzione multipla:
+    'xlsx' (una sola cartella con tutti i fogli corretti, un target per foglio; per i file
+    tabellari il file corretto nel suo formato) oppure 'zip' (una cartella corretta per
+    specifica). Default: xlsx se possibile.
+    """
+    sheet_names = [spec["sheet_name"] for spec in specs]
+    unique = len(set(sheet_names)) == len(sheet_names)
+    if output_format is None:
+        return "xlsx" if unique else "zip"
+    if output_format not in BATCH_FORMATS:
+        raise ValueError(f"Formato non supportato: {output_format} (valori ammessi: {', '.join(BATCH_FORMATS)})")
+    if output_format == "xlsx" and not unique:
+        raise ValueError("Con più specifiche sullo stesso foglio il risultato deve essere uno zip")
+    return output_format
+
+
+def prepare_batch(file_path: str, filename: str, specs: List[Dict[str, Any]],
+                  sheets: Dict[str, ColonneFoglio] = None, output_format: str = None) -> Dict[str, Any]:
+    """
+    Parsing unico per una correzione multipla: ogni foglio è letto una sola volta
+    (unione delle colonne di tutte le specifiche). Un .xls è convertito una sola volta
+    solo per il formato 'zip' (una cartella per specifica): con 'xlsx' la conversione
+    avviene in write_batch, con le celle di tutte le specifiche già applicate.
+    sheets: colonne già estratte in precedenza (cache), lette di nuovo solo se mancano.
+    """
+    phases = PhaseTracker()
+    phases.start("parsing")
+    sheets = dict(sheets or {})
+    needed: Dict[str, List[str]] = {}
+    label_columns: Dict[str, List[str]] = {}
+    for spec in specs:
+        needed.setdefault(spec["sheet_name"], []).extend(_spec_columns(spec))
+        label_columns.setdefault(spec["sheet_name"], []).extend(
+            _label_columns(spec.get("group_column"), spec.get("lock_column")) or [])
+
+    for sheet_name, columns in needed.items():
+        current = sheets.get(sheet_name)
+        if current is not None and current.has_columns(columns):
+            continue
+        sheet = read_sheet_columns(file_path, sheet_name, columns, label_columns=label_columns[sheet_name])
+        sheets[sheet_name] = current.merge(sheet) if current is not None else sheet
+
+    xlsx_path = _convert_xls(file_path) if file_format(filename).name == "xls" and output_format == "zip" else file_path
+    phases.stop()
+    return {"xlsx_path": xlsx_path, "sheets": sheets, "timings": dict(phases.timings)}
+
+
+def solve_spec(xlsx_path: str, spec: Dict[str, Any], sheet_data: ColonneFoglio,
+               output_path: str = None) -> Dict[str, Any]:
+    """
+    Risolve una specifica (foglio, colonne, target) sulle colonne già lette.
+    Restituisce le celle da riscrivere; con output_path scrive anche la cartella corretta.
+    Un errore dei dati non interrompe le altre specifiche: finisce in "error".
+    """
+    phases = PhaseTracker()
+    try:
+        solver, result = _run_solver(
+            spec["sheet_name"], spec["quantity_column"], spec["price_column"], spec["remaining_column"],
+            spec.get("target_total"), spec.get("data_rows"), sheet_data, phases, spec.get("solver"),
+            spec.get("group_column"), spec.get("group_targets"),
+            spec.get("min_column"), spec.get("max_column"), spec.get("lock_column")
+        )
+    except CorrectionError as e:
+        return {"error": str(e), "result": None, "cells": None, "timings": dict(phases.timings)}
+
+    phases.start("writing")
+    cells = _solver_cells(xlsx_path, solver, result["target_total"])
+    if output_path is not None:
+        _write_workbook(xlsx_path, output_path, {spec["sheet_name"]: cells})
+    _check_formulas(xlsx_path, sheet_data, solver, result)
+    phases.stop()
+    return {"error": None, "result": result, "cells": cells, "timings": dict(phases.timings)}
+
+
+def _batch_summary(spec: Dict[str, Any], outcome: Dict[str, Any], member: str = None) -> Dict[str, Any]:
+    """Riga del riepilogo di una correzione multipla (tipi Python, serializzabile in JSON)"""
+    summary = {
+        "sheet_name": spec["sheet_name"],
+        "target_total": float(spec["target_total"]) if spec.get("target_total") is not None else None,
+        "success": outcome["error"] is None,
+        "error": outcome["error"],
+        "timings": outcome["timings"]
+    }
+    result = outcome["result"]
+    if result is not None:
+        summary.update(
+            original_total=float(result["original_total"]),
+            final_total=float(result["final_total"]),
+            target_reached_exactly=bool(result["target_reached_exactly"]),
+            solver=result.get("solver"),
+            formula_check=result.get("formula_check")
+        )
+        if "groups" in result:
+            summary.update(target_total=result["target_total"], groups=result["groups"])
+        if "bounds" in result:
+            summary["bounds"] = result["bounds"]
+    if member is not None:
+        summary["file"] = member
+    return summary
+
+
+def batch_members(filename: str, specs: List[Dict[str, Any]]) -> List[str]:
+    """Nomi dei file nello zip: uno per specifica, numerati nell'ordine della richiesta"""
+    stem = adjusted_filename(filename, '')
+    extension = file_format(filename).output_filename_extension(filename)
+    members = []
+    for i, spec in enumerate(specs, 1):
+        sheet = "".join(c if c.isalnum() or c in "-_" else "_" for c in spec["sheet_name"])
+        target = (format(Decimal(str(spec["target_total"])).normalize(), "f")
+                  if spec.get("target_total") is not None else "gruppi")
+        members.append(f"{i:02d}_{stem}_{sheet}_{target}{extension}")
+    return members
+
+
+def write_batch(xlsx_path: str, filename: str, specs: List[Dict[str, Any]], outcomes: List[Dict[str, Any]],
+                output_path: str, output_format: str, member_paths: List[str] = None) -> Dict[str, Any]:
+    """
+    Compone il risultato di una correzione multipla:
+    - xlsx: una sola patch con le celle di tutti i fogli corretti
+    - zip: le cartelle già scritte dai worker (member_paths) più riepilogo.json
+    Restituisce il nome da proporre al client e il riepilogo per specifica.
+    """
+    if all(outcome["error"] is not None for outcome in outcomes):
+        raise CorrectionError("; ".join(f"{spec['sheet_name']}: {outcome['error']}"
+                                        for spec, outcome in zip(specs, outcomes)))
+
+    if output_format == "xlsx":
+        _write_workbook(xlsx_path, output_path, {
+            spec["sheet_name"]: outcome["cells"]
+            for spec, outcome in zip(specs, outcomes) if outcome["error"] is None
+        })
+        summary = [_batch_summary(spec, outcome) for spec, outcome in zip(specs, outcomes)]
+        return {"output_filename": adjusted_filename(filename), "results": summary}
+
+    members = batch_members(filename, specs)
+    summary = []
+    # Le cartelle .xlsx (e i Parquet/Arrow) sono già compresse: nello zip vengono solo archiviate
+    compression = zipfile.ZIP_DEFLATED if file_format(filename).name == "csv" else zipfile.ZIP_STORED
+    with zipfile.ZipFile(output_path, "w", zipfile.ZIP_STORED) as archive:
+        for spec, outcome, member, path in zip(specs, outcomes, members, member_paths):
+            if outcome["error"] is None:
+                archive.write(path, member, compress_type=compression)
+                summary.append(_batch_summary(spec, outcome, member))
+            else:
+                summary.append(_batch_summary(spec, outcome))
+        archive.writestr("riepilogo.json", json.dumps(summary, indent=2, ensure_ascii=False))
+    return {"output_filename": adjusted_filename(filename, '.zip'), "results": summary}
+
+
+def adjust_batch(file_path: str, filename: str, specs: List[Dict[str, Any]], output_path: str,
+                 output_format: str = None, executor: Executor = None,
+                 sheets: Dict[str, ColonneFoglio] = None) -> Dict[str, Any]:
+    """
+    Applica più specifiche {sheet_name, quantity_column, price_column, remaining_column,
+    target_total, data_rows, solver, group_column?, group_targets?, min_column?, max_column?,
+    lock_column?} allo stesso file: un solo parsing, poi le specifiche
+    risolte in parallelo sui processi di executor (in sequenza se None) e un solo risultato
+    (xlsx multi-foglio o zip, vedi batch_format).
+    """
+    output_format = batch_format(specs, output_format)
+    started = time.perf_counter()
+    prepared = prepare_batch(file_path, filename, specs, sheets, output_format)
+    parsed = time.perf_counter()
+    work_dir = tempfile.mkdtemp(prefix="excel_batch_") if output_format == "zip" else None
+    try:
+        member_paths = [os.path.join(work_dir, f"{i}.xlsx") for i in range(len(specs))] if work_dir else None
+        arguments = [
+            (prepared["xlsx_path"], spec, prepared["sheets"][spec["sheet_name"]].select(_spec_columns(spec)),
+             member_paths[i] if member_paths else None)
+            for i, spec in enumerate(specs)
+        ]
+        if executor is None:
+            outcomes = [solve_spec(*args) for args in arguments]
+        else:
+            outcomes = [future.result() for future in [executor.submit(solve_spec, *args) for args in arguments]]
+        solved = time.perf_counter()
+
+        written = write_batch(prepared["xlsx_path"], filename, specs, outcomes, output_path,
+                              output_format, member_paths)
+    finally:
+        if prepared["xlsx_path"] != file_path and os.path.exists(prepared["xlsx_path"]):
+            os.unlink(prepared["xlsx_path"])
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        **written,
+        "output_path": output_path,
+        "format": output_format,
+        "sheets": prepared["sheets"],
+        "timings": {
+            "parsing": parsed - started,
+            "solving": solved - parsed,
+            "writing": time.perf_counter() - solved
+        }
+    }
@@ -0,0 +1,268 @@
+"""
+Correzione di cartelle di file Excel senza passare dal server HTTP.
+
+    python -m excel_adjusting adjust --jobs 4 --sheet Foglio1 --quantity Quantità \\
+        --price Prezzo --remaining Rimanenze --target 150000 --output corretti/ cartella/
+
+Per ogni file scrive una riga JSON (JSONL) con totali, scarto dal target e tempi per fase,
+nell'ordine in cui i file vengono completati. I file il cui contenuto (SHA-256) e i cui
+parametri non sono cambiati dall'ultima esecuzione vengono saltati.
+Da Python: adjust_files(...) restituisce i record come generatore.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from elaborazione import adjust_workbook, adjusted_filename
+from formati import SUPPORTED_EXTENSIONS, TABLE_SHEET
+from metriche import configure_logging
+
+# Stato dell'ultima esecuzione (hash dei file già corretti), nella cartella di output
+STATE_FILENAME = ".excel_adjusting_state.json"
+# Cartelle Excel e file tabellari (CSV, Parquet, Arrow)
+EXCEL_EXTENSIONS = SUPPORTED_EXTENSIONS
+
+
+def find_workbooks(paths: Iterable[str], recursive: bool = False) -> List[str]:
+    """File Excel (o tabellari) indicati direttamente o contenuti nelle cartelle (esclusi output e file di lock)"""
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            for name in sorted(files):
+                if name.lower().endswith(EXCEL_EXTENSIONS) and not name.startswith(("adjusted_", "~$")):
+                    found.append(os.path.join(root, name))
+            if not recursive:
+                break
+            dirs.sort()
+    return found
+
+
+def path_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 del contenuto del file, letto a blocchi"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _params_digest(params: Dict[str, Any]) -> str:
+    """Impronta dei parametri: cambiando target o colonne il file va corretto di nuovo"""
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _load_state(state_path: str) -> Dict[str, Any]:
+    try:
+        with open(state_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_state(state_path: str, state: Dict[str, Any]):
+    """Scrittura atomica: un'interruzione non lascia lo stato a metà"""
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1, ensure_ascii=False)
+    os.replace(tmp_path, state_path)
+
+
+def adjust_file(path: str, params: Dict[str, Any], output_path: str, verbose: bool = False) -> Dict[str, Any]:
+    """
+    Corregge un file (nel processo worker) e restituisce il record del riepilogo.
+    Il log del solver va su stderr solo con verbose, così lo stdout resta JSONL.
+    """
+    started = time.perf_counter()
+    configure_logging("DEBUG" if verbose else None)
+    try:
+        outcome = adjust_workbook(
+            path,
+            os.path.basename(path),
+            params["sheet_name"],
+            params["quantity_column"],
+            params["price_column"],
+            params["remaining_column"],
+            params["target_total"],
+            params.get("data_rows"),
+            output_path=output_path,
+            solver_backend=params.get("solver"),
+            group_column=params.get("group_column"),
+            group_targets=params.get("group_targets"),
+            min_column=params.get("min_column"),
+            max_column=params.get("max_column"),
+            lock_column=params.get("lock_column")
+        )
+    except Exception as e:
+        return {"status": "failed", "error": str(e), "elapsed": time.perf_counter() - started}
+
+    result = outcome["result"]
+    record = {
+        "status": "done",
+        "output": output_path,
+        "original_total": float(result["original_total"]),
+        "final_total": float(result["final_total"]),
+        "target_total": float(result["target_total"]),
+        "residual": result["residual"],
+        "target_reached_exactly": bool(result["target_reached_exactly"]),
+        "timings": outcome["timings"],
+        "elapsed": time.perf_counter() - started
+    }
+    if "groups" in result:
+        record["groups"] = result["groups"]
+    if "bounds" in result:
+        record["bounds"] = result["bounds"]
+    return record
+
+
+def adjust_files(paths: Iterable[str], params: Dict[str, Any], output_dir: str, jobs: int = None,
+                 targets: Dict[str, float] = None, force: bool = False, recursive: bool = False,
+                 verbose: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Corregge tutti i file Excel di paths (file o cartelle) con un pool di jobs processi
+    (default: numero di core; 1 = nello stesso processo) e scrive i file in output_dir.
+    params: sheet_name, quantity_column, price_column, remaining_column, target_total,
+    data_rows, solver, group_column / group_targets (target per gruppo, target_total facoltativo),
+    min_column / max_column / lock_column (limiti per riga facoltativi).
+    targets: target per nome di file, al posto di target_total.
+    Restituisce un record per file, man mano che vengono completati; i file già corretti
+    con lo stesso contenuto e gli stessi parametri sono "skipped" (salvo force).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    state_path = os.path.join(output_dir, STATE_FILENAME)
+    state = _load_state(state_path)
+    jobs = jobs or os.cpu_count() or 1
+
+    pending = []
+    for path in find_workbooks(paths, recursive):
+        name = os.path.basename(path)
+        file_params = dict(params)
+        if targets and name in targets:
+            file_params["target_total"] = float(targets[name])
+        record = {"file": path, "digest": path_digest(path)}
+        if file_params.get("target_total") is None and not file_params.get("group_targets"):
+            yield {**record, "status": "failed", "error": "Target non indicato per questo file"}
+            continue
+
+        output_path = os.path.join(output_dir, adjusted_filename(name))
+        key = os.path.abspath(path)
+        previous = state.get(key)
+        fingerprint = {"digest": record["digest"], "params": _params_digest(file_params)}
+        if (not force and previous and previous.get("digest") == fingerprint["digest"]
+                and previous.get("params") == fingerprint["params"] and os.path.exists(output_path)):
+            yield {**record, "status": "skipped", "output": output_path}
+            continue
+        pending.append((key, record, fingerprint, file_params, output_path))
+
+    def finished(key, record, fingerprint, summary):
+        if summary["status"] == "done":
+            state[key] = {**fingerprint, "output": summary["output"], "finished_at": time.time()}
+            _save_state(state_path, state)
+        return {**record, **summary}
+
+    if jobs == 1 or len(pending) <= 1:
+        for key, record, fingerprint, file_params, output_path in pending:
+            yield finished(key, record, fingerprint, adjust_file(record["file"], file_params, output_path, verbose))
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(pending))) as executor:
+        futures = {
+            executor.submit(adjust_file, record["file"], file_params, output_path, verbose):
+                (key, record, fingerprint)
+            for key, record, fingerprint, file_params, output_path in pending
+        }
+        for future in as_completed(futures):
+            key, record, fingerprint = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                # Worker terminato in modo anomalo (es. memoria esaurita)
+                summary = {"status": "failed", "error": str(e)}
+            yield finished(key, record, fingerprint, summary)
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m excel_adjusting",
+                                     description="Correzione di file Excel da riga di comando")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    adjust = commands.add_parser("adjust", help="Corregge i file Excel di una o più cartelle")
+    adjust.add_argument("paths", nargs="+", help="File o cartelle con i file .xlsx / .xls / .csv / .parquet / .arrow")
+    adjust.add_argument("--sheet", required=True, help=f"Nome del foglio ({TABLE_SHEET} per i file tabellari)")
+    adjust.add_argument("--quantity", required=True, help="Colonna delle quantità")
+    adjust.add_argument("--price", required=True, help="Colonna dei prezzi")
+    adjust.add_argument("--remaining", required=True, help="Colonna delle rimanenze")
+    adjust.add_argument("--target", type=float, help="Totale target (uguale per tutti i file)")
+    adjust.add_argument("--targets", help="File JSON {nome file: target} con i target per file")
+    adjust.add_argument("--group-column", help="Colonna dei gruppi (es. categoria o magazzino)")
+    adjust.add_argument("--group-targets", help="File JSON {gruppo: target} con i target per gruppo "
+                                                "(--target, se indicato, vincola anche il totale)")
+    adjust.add_argument("--min-column", help="Colonna della quantità minima di ogni riga")
+    adjust.add_argument("--max-column", help="Colonna della quantità massima di ogni riga")
+    adjust.add_argument("--lock-column", help="Colonna del blocco: le righe con un valore (diverso da "
+                                              "0/no/falso) mantengono la quantità originale")
+    adjust.add_argument("--data-rows", type=int, help="Righe di dati da elaborare (default: tutte)")
+    adjust.add_argument("--solver", choices=("greedy", "milp"), help="Backend del solver (default: EXCEL_SOLVER)")
+    adjust.add_argument("--output", default="adjusted", help="Cartella dei file corretti (default: ./adjusted)")
+    adjust.add_argument("--summary", help="File JSONL del riepilogo (default: stdout)")
+    adjust.add_argument("--jobs", "-j", type=int, help="Processi in parallelo (default: numero di core)")
+    adjust.add_argument("--recursive", "-r", action="store_true", help="Cerca i file anche nelle sottocartelle")
+    adjust.add_argument("--force", action="store_true", help="Corregge anche i file non cambiati")
+    adjust.add_argument("--verbose", "-v", action="store_true", help="Mostra il log del solver su stderr")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parser().parse_args(argv)
+    targets = None
+    if args.targets:
+        with open(args.targets, encoding="utf-8") as f:
+            targets = json.load(f)
+    group_targets = None
+    if args.group_targets:
+        with open(args.group_targets, encoding="utf-8") as f:
+            group_targets = json.load(f)
+    if (args.group_column is None) != (group_targets is None):
+        print("--group-column e --group-targets vanno indicati insieme", file=sys.stderr)
+        return 2
+    if args.target is None and not targets and not group_targets:
+        print("Indicare --target, --targets oppure --group-column con --group-targets", file=sys.stderr)
+        return 2
+
+    params = {
+        "sheet_name": args.sheet,
+        "quantity_column": args.quantity,
+        "price_column": args.price,
+        "remaining_column": args.remaining,
+        "target_total": args.target,
+        "data_rows": args.data_rows,
+        "solver": args.solver,
+        "group_column": args.group_column,
+        "group_targets": group_targets,
+        "min_column": args.min_column,
+        "max_column": args.max_column,
+        "lock_column": args.lock_column
+    }
+    failed = 0
+    summary = open(args.summary, "a", encoding="utf-8") if args.summary else sys.stdout
+    try:
+        for record in adjust_files(args.paths, params, args.output, args.jobs, targets,
+                                   args.force, args.recursive, args.verbose):
+            failed += record["status"] == "failed"
+            summary.write(json.dumps(record, ensure_ascii=False) + "\n")
+            summary.flush()
+    finally:
+        if summary is not sys.stdout:
+            summary.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
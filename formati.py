@@ -0,0 +1,67 @@
+"""
+Formati dei file accettati in ingresso e prodotti in uscita. Le cartelle Excel (.xlsx, .xls)
+sono uno dei backend: i file tabellari (CSV, Parquet, Arrow/Feather) hanno un solo foglio,
+TABLE_SHEET, con l'intestazione nella prima riga come in Excel (la riga di dati i è la riga
+i + 1, per le modifiche incrementali e i messaggi di errore). La lettura è in lettura_excel
+(cartelle) e tabelle (file tabellari), la scrittura del risultato in elaborazione._write_workbook.
+"""
+import os
+from typing import Dict, Optional
+
+
+# Nome dell'unico foglio dei file tabellari (come il foglio di un CSV aperto in Excel)
+TABLE_SHEET = os.getenv("EXCEL_TABLE_SHEET", "Foglio1")
+
+
+class FormatoFile:
+    """
+    Backend di un formato di file:
+    - name: identificativo ('xlsx', 'xls', 'csv', 'parquet', 'arrow')
+    - extensions: estensioni riconosciute (minuscole, la prima è quella canonica)
+    - output_extension: estensione del file corretto (i .xls diventano .xlsx)
+    - media_type: Content-Type del file corretto
+    - workbook: cartella Excel con più fogli (False = un solo foglio, TABLE_SHEET)
+    """
+
+    __slots__ = ("name", "extensions", "output_extension", "media_type", "workbook")
+
+    def __init__(self, name: str, extensions: tuple, output_extension: Optional[str], media_type: str,
+                 workbook: bool):
+        self.name = name
+        self.extensions = extensions
+        self.output_extension = output_extension
+        self.media_type = media_type
+        self.workbook = workbook
+
+    def output_filename_extension(self, filename: str) -> str:
+        """Estensione del file corretto: quella del formato di uscita o, se non fissata, quella del file"""
+        return self.output_extension or os.path.splitext(filename)[1].lower()
+
+
+XLSX_MEDIA_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+FORMATS: Dict[str, FormatoFile] = {fmt.name: fmt for fmt in (
+    FormatoFile("xlsx", ('.xlsx',), '.xlsx', XLSX_MEDIA_TYPE, True),
+    FormatoFile("xls", ('.xls',), '.xlsx', XLSX_MEDIA_TYPE, True),
+    FormatoFile("csv", ('.csv',), None, 'text/csv', False),
+    FormatoFile("parquet", ('.parquet', '.pq'), None, 'application/vnd.apache.parquet', False),
+    FormatoFile("arrow", ('.arrow', '.feather'), None, 'application/vnd.apache.arrow.file', False),
+)}
+
+# Estensioni accettate, nell'ordine dei formati
+SUPPORTED_EXTENSIONS = tuple(extension for fmt in FORMATS.values() for extension in fmt.extensions)
+
+
+def file_format(filename: str) -> FormatoFile:
+    """Formato dal nome (o percorso) del file; ValueError se l'estensione non è supportata"""
+    extension = os.path.splitext(filename)[1].lower()
+    for fmt in FORMATS.values():
+        if extension in fmt.extensions:
+            return fmt
+    raise ValueError(f"Formato non supportato: '{extension or filename}' "
+                     f"(estensioni ammesse: {', '.join(SUPPORTED_EXTENSIONS)})")
+
+
+def is_supported(filename: str) -> bool:
+    return os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS
+
@@ -0,0 +1,590 @@
+"""
+Valutazione vettoriale delle formule della colonna rimanenze, per sapere lato server quali
+totali mostrerà Excel dopo la correzione (il file esce con fullCalcOnLoad e le formule
+intatte).
+
+Le formule di una colonna si raggruppano per modello, cioè la formula con i riferimenti
+relativi alla propria riga (=F2*E2 alla riga 2 e =F3*E3 alla riga 3 hanno lo stesso modello
+=F[+0]*E[+0]): ogni modello è analizzato una sola volta (cache) e valutato con NumPy su tutte
+le sue righe insieme. Sono supportati numeri, riferimenti a celle, + - * / ^ %, SUM e
+SUMIF con criterio numerico (">0", "<>0", ...); le somme su intervalli usano somme
+cumulative, quindi anche una riga di totale su un milione di righe costa O(n).
+
+I file tabellari (CSV, Parquet, Arrow) non hanno formule: le rimanenze delle righe corrette
+si riscrivono come quantità × prezzo (stored_remaining) e la verifica confronta ogni riga
+salvata con il prodotto e la somma con il totale corretto.
+"""
+import logging
+import operator
+import os
+import re
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from openpyxl.utils.cell import column_index_from_string, get_column_letter
+
+from centesimi import decimal_scale
+from colonne_solver import FIRST_DATA_ROW
+from lettura_excel import ColonneFoglio, read_column_cells, read_sheet_columns
+from metriche import log_event
+
+# Verifica delle formule dopo la correzione (0 = disattivata, niente lettura aggiuntiva del foglio)
+FORMULA_CHECK = os.getenv("EXCEL_FORMULA_CHECK", "1") != "0"
+# Differenza tollerata tra totale delle formule e final_total del solver (mezzo centesimo)
+FORMULA_TOLERANCE = 0.005
+# Passate massime per le formule che dipendono da altre celle della stessa colonna
+# (es. riga di totale); le catene più lunghe (saldi progressivi) restano non risolte
+MAX_PASSES = 32
+# Celle elencate nel risultato (totali e formule non risolte)
+MAX_REPORTED_CELLS = 20
+
+# Riferimento a una cella (o stringa tra virgolette, lasciata invariata)
+_REFERENCE = re.compile(r'"(?:[^"]|"")*"|(?<![A-Za-z0-9_.$!\]])\$?([A-Za-z]{1,3})(\$?)(\d+)(?![A-Za-z0-9_(!\[])')
+_TOKEN = re.compile(r'''\s*(?:
+    (?P<string>"(?:[^"]|"")*")
+  | (?P<ref>[A-Z]{1,3}(?:\[[+-]\d+\]|\$\d+))
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<func>[A-Za-z_][A-Za-z0-9_.]*)\s*\(
+  | (?P<op>[-+*/^%(),:])
+)''', re.X)
+_CRITERION = re.compile(r'\s*(<>|<=|>=|<|>|=)?\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)\s*$')
+_COMPARISONS = {"=": operator.eq, "<>": operator.ne, "<": operator.lt, "<=": operator.le,
+                ">": operator.gt, ">=": operator.ge}
+_BINARY = {"+": np.add, "-": np.subtract, "*": np.multiply, "/": np.divide, "^": np.power}
+# Modello delle celle con formule non testuali (formule matrice, tabelle dati)
+_UNSUPPORTED = "#"
+
+
+class _NonSupportata(Exception):
+    """Formula fuori dal sottoinsieme valutabile"""
+
+
+def template(formula: str, row: int) -> str:
+    """Modello della formula alla riga row: riferimenti relativi come offset, assoluti invariati"""
+    def relative(match):
+        column, absolute, target = match.groups()
+        if column is None:
+            return match.group(0)
+        target = int(target)
+        return f"{column.upper()}${target}" if absolute else f"{column.upper()}[{target - row:+d}]"
+
+    return _REFERENCE.sub(relative, formula)
+
+
+def _tokens(text: str) -> List[Tuple[str, str]]:
+    tokens, position = [], 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise _NonSupportata(text[position:])
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """Analisi ricorsiva discendente del modello di una formula (precedenze come in Excel)"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        token = self.peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise _NonSupportata(f"atteso {value}")
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.expression()
+        if self.position != len(self.tokens):
+            raise _NonSupportata("testo in eccesso")
+        return node
+
+    def expression(self):
+        node = self.term()
+        while self.peek()[1] in ("+", "-"):
+            node = ("bin", self.take()[1], node, self.term())
+        return node
+
+    def term(self):
+        node = self.power()
+        while self.peek()[1] in ("*", "/"):
+            node = ("bin", self.take()[1], node, self.power())
+        return node
+
+    def power(self):
+        node = self.unary()
+        while self.peek()[1] == "^":
+            node = ("bin", self.take()[1], node, self.unary())
+        return node
+
+    def unary(self):
+        # In Excel il meno unario precede l'elevamento a potenza: -2^2 = 4
+        if self.peek()[1] in ("-", "+"):
+            sign = self.take()[1]
+            node = self.unary()
+            return ("neg", node) if sign == "-" else node
+        node = self.primary()
+        while self.peek()[1] == "%":
+            self.take()
+            node = ("bin", "/", node, ("num", 100.0))
+        return node
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == "number":
+            return ("num", float(value))
+        if kind == "string":
+            return ("str", value[1:-1].replace('""', '"'))
+        if kind == "ref":
+            start = _reference(value)
+            if self.peek()[1] == ":":
+                self.take()
+                end_kind, end = self.take()
+                if end_kind != "ref":
+                    raise _NonSupportata("intervallo")
+                return ("range", start, _reference(end))
+            return ("ref",) + start
+        if kind == "func":
+            return self.function(value.upper())
+        if value == "(":
+            node = self.expression()
+            self.take(")")
+            return node
+        raise _NonSupportata(value)
+
+    def function(self, name: str):
+        args = []
+        if self.peek()[1] != ")":
+            args.append(self.expression())
+            while self.peek()[1] == ",":
+                self.take()
+                args.append(self.expression())
+        self.take(")")
+        if name == "SUM":
+            return ("sum", tuple(args))
+        if name == "SUMIF" and len(args) in (2, 3) and args[0][0] == "range":
+            criterion = _criterion(args[1])
+            sum_range = args[2] if len(args) == 3 else args[0]
+            if sum_range[0] == "ref":
+                sum_range = ("range", sum_range[1:], sum_range[1:])
+            # L'intervallo da sommare parte dalla stessa riga di quello del criterio
+            if sum_range[0] != "range" or sum_range[1][1:] != args[0][1][1:]:
+                raise _NonSupportata("SUMIF")
+            return ("sumif", args[0], criterion, sum_range)
+        raise _NonSupportata(name)
+
+
+def _reference(text: str):
+    """(colonna, relativo, riga o offset) da 'F[+0]' o 'F$12'"""
+    if "[" in text:
+        column, offset = text[:-1].split("[")
+        return column, True, int(offset)
+    column, row = text.split("$")
+    return column, False, int(row)
+
+
+def _criterion(node) -> Tuple[str, float]:
+    """Criterio di SUMIF: numero o testo come ">0"; i criteri su testo non sono supportati"""
+    if node[0] == "num":
+        return "=", node[1]
+    if node[0] == "str":
+        match = _CRITERION.match(node[1])
+        if match:
+            return match.group(1) or "=", float(match.group(2))
+    raise _NonSupportata("criterio di SUMIF")
+
+
+@lru_cache(maxsize=1024)
+def parse_template(text: str):
+    """Albero del modello (tuple annidate), None se la formula non è supportata"""
+    if not text.startswith("="):
+        return None
+    try:
+        return _Parser(_tokens(text[1:])).parse()
+    except _NonSupportata:
+        return None
+
+
+def _walk(node):
+    yield node
+    if node[0] == "bin":
+        yield from _walk(node[2])
+        yield from _walk(node[3])
+    elif node[0] == "neg":
+        yield from _walk(node[1])
+    elif node[0] == "sum":
+        for arg in node[1]:
+            yield from _walk(arg)
+    elif node[0] == "sumif":
+        yield from _walk(node[1])
+        yield from _walk(node[3])
+
+
+def _range_columns(node) -> List[str]:
+    first, last = sorted(column_index_from_string(reference[0]) for reference in node[1:])
+    return [get_column_letter(index) for index in range(first, last + 1)]
+
+
+def _columns(node) -> set:
+    columns = set()
+    for child in _walk(node):
+        if child[0] == "ref":
+            columns.add(child[1])
+        elif child[0] == "range":
+            columns.update(_range_columns(child))
+    return columns
+
+
+def _is_total(node) -> bool:
+    """Formula di totale: somma un intervallo di celle"""
+    return any(child[0] == "range" for child in _walk(node))
+
+
+class FormuleColonna:
+    """
+    Contenuto di una colonna raggruppato per modello di formula:
+    - values: valori delle celle costanti (vuote = 0, NaN dove c'è una formula)
+    - groups: modello → righe Excel con quella formula
+    """
+
+    def __init__(self, values: np.ndarray, groups: Dict[str, np.ndarray], first_row: int = FIRST_DATA_ROW):
+        self.values = values
+        self.groups = groups
+        self.first_row = first_row
+
+    @classmethod
+    def from_cells(cls, cells: List[Any], first_row: int = FIRST_DATA_ROW) -> "FormuleColonna":
+        """Dalle celle di lettura_excel.read_column_cells"""
+        values = np.zeros(len(cells), dtype=np.float64)
+        rows: Dict[str, list] = {}
+        shared: Dict[tuple, str] = {}
+        for index, cell in enumerate(cells):
+            if isinstance(cell, str) and cell.startswith("="):
+                key = template(cell, first_row + index)
+            elif isinstance(cell, tuple):
+                # Formula condivisa (testo della cella master e sua riga) o formula matrice
+                if cell not in shared:
+                    text, row = cell
+                    shared[cell] = template(text, row) if row is not None else _UNSUPPORTED
+                key = shared[cell]
+            elif cell is None or isinstance(cell, (str, bool)):
+                continue
+            else:
+                values[index] = cell
+                continue
+            values[index] = np.nan
+            rows.setdefault(key, []).append(first_row + index)
+        return cls(values, {key: np.array(group, dtype=np.int64) for key, group in rows.items()}, first_row)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + sum(rows.nbytes for rows in self.groups.values())
+
+    def columns(self) -> set:
+        """Lettere delle colonne lette dalle formule"""
+        columns = set()
+        for key in self.groups:
+            node = parse_template(key)
+            if node is not None:
+                columns |= _columns(node)
+        return columns
+
+
+class _Foglio:
+    """Colonne per lettera, indicizzate per riga Excel: le celle fuori dai dati valgono 0"""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.arrays = arrays
+        self._prefix: Dict[tuple, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def column(self, letter: str) -> np.ndarray:
+        values = self.arrays.get(letter)
+        if values is None:
+            raise _NonSupportata(f"colonna {letter}")
+        return values
+
+    def cells(self, letter: str, rows) -> np.ndarray:
+        values = self.column(letter)
+        rows = np.asarray(rows)
+        inside = (rows >= 0) & (rows < len(values))
+        return np.where(inside, values[np.clip(rows, 0, len(values) - 1)], 0.0)
+
+    def invalidate(self, letter: str):
+        self._prefix = {key: value for key, value in self._prefix.items() if letter not in key[::2]}
+
+    def prefix(self, letter: str, criterion=None, sum_letter: str = None):
+        """Somme cumulative (con criterio di SUMIF) e conteggio cumulativo delle celle non risolte"""
+        sum_letter = sum_letter or letter
+        key = (letter, criterion, sum_letter)
+        if key not in self._prefix:
+            values = self.column(letter)
+            summed = self.column(sum_letter)
+            length = max(len(values), len(summed))
+            values = np.pad(values, (0, length - len(values)))
+            summed = np.pad(summed, (0, length - len(summed)))
+            unknown = np.isnan(summed)
+            if criterion is None:
+                contribution = np.where(unknown, 0.0, summed)
+            else:
+                compare, bound = _COMPARISONS[criterion[0]], criterion[1]
+                unknown |= np.isnan(values)
+                with np.errstate(invalid="ignore"):
+                    contribution = np.where(compare(values, bound) & ~unknown, summed, 0.0)
+            self._prefix[key] = (np.concatenate([[0.0], np.cumsum(contribution)]),
+                                 np.concatenate([[0], np.cumsum(unknown)]))
+        return self._prefix[key]
+
+
+def _row_index(reference, rows):
+    _, relative, row = reference
+    return rows + row if relative else np.full(len(rows), row)
+
+
+def _range_sum(sheet: _Foglio, node, rows, criterion=None, sum_node=None) -> np.ndarray:
+    start, end = node[1], node[2]
+    first, last = _row_index(start, rows), _row_index(end, rows)
+    first, last = np.minimum(first, last), np.maximum(first, last)
+    columns = _range_columns(node)
+    sum_columns = _range_columns(sum_node) if sum_node is not None else columns
+    if len(sum_columns) != len(columns):
+        raise _NonSupportata("SUMIF su intervalli di forma diversa")
+
+    total = np.zeros(len(rows))
+    unknown = np.zeros(len(rows), dtype=bool)
+    for letter, sum_letter in zip(columns, sum_columns):
+        sums, counts = sheet.prefix(letter, criterion, sum_letter if sum_node is not None else None)
+        low = np.clip(first, 0, len(sums) - 1)
+        high = np.clip(last + 1, 0, len(sums) - 1)
+        total += sums[high] - sums[low]
+        unknown |= counts[high] > counts[low]
+    return np.where(unknown, np.nan, total)
+
+
+def _evaluate(node, rows: np.ndarray, sheet: _Foglio):
+    kind = node[0]
+    if kind == "num":
+        return node[1]
+    if kind == "ref":
+        return sheet.cells(node[1], _row_index(node[1:], rows))
+    if kind == "neg":
+        return -_evaluate(node[1], rows, sheet)
+    if kind == "bin":
+        with np.errstate(all="ignore"):
+            return _BINARY[node[1]](_evaluate(node[2], rows, sheet), _evaluate(node[3], rows, sheet))
+    if kind == "sum":
+        total = 0.0
+        for arg in node[1]:
+            total = total + (_range_sum(sheet, arg, rows) if arg[0] == "range" else _evaluate(arg, rows, sheet))
+        return total
+    if kind == "sumif":
+        return _range_sum(sheet, node[1], rows, node[2], node[3])
+    # Testo fuori da SUMIF o intervallo fuori da una somma
+    raise _NonSupportata(kind)
+
+
+def evaluate_column(formulas: FormuleColonna, letter: str, arrays: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Valori della colonna letter (indice = riga Excel) calcolati dalle formule sulle colonne
+    arrays (lettera → valori per riga Excel). NaN dove la formula non è supportata, dà
+    errore (#DIV/0!) o dipende da celle non risolte.
+    """
+    values = np.zeros(formulas.first_row + len(formulas))
+    values[formulas.first_row:] = formulas.values
+    sheet = _Foglio({**arrays, letter: values})
+
+    pending = []
+    for key, rows in formulas.groups.items():
+        node = parse_template(key)
+        if node is not None:
+            pending.append((node, rows))
+    for _ in range(MAX_PASSES):
+        progress, remaining = False, []
+        for node, rows in pending:
+            try:
+                result = np.broadcast_to(np.asarray(_evaluate(node, rows, sheet), dtype=np.float64), rows.shape)
+            except _NonSupportata:
+                continue
+            done = np.isfinite(result)
+            if done.any():
+                values[rows[done]] = result[done]
+                sheet.invalidate(letter)
+                progress = True
+            if not done.all():
+                remaining.append((node, rows[~done]))
+        pending = remaining
+        if not progress or not pending:
+            break
+    return values
+
+
+def _cell(letter: str, rows) -> List[str]:
+    return [f"{letter}{row}" for row in rows[:MAX_REPORTED_CELLS]]
+
+
+def check_remaining_column(file_path: str, sheet_data: ColonneFoglio, quantity_column: str,
+                           price_column: str, remaining_column: str, quantities, prices,
+                           final_total: float) -> Tuple[Dict[str, Any], ColonneFoglio]:
+    """
+    Calcola la colonna rimanenze con quantità e prezzi corretti (le prime len(quantities)
+    righe di dati) e la confronta con final_total del solver: somma delle righe di dati e,
+    se c'è, ultima cella di totale (SUM/SUMIF). Le formule lette e le altre colonne usate
+    restano in sheet_data (restituito) per le correzioni successive dello stesso foglio.
+    """
+    started = time.perf_counter()
+    formulas = sheet_data.formulas.get(remaining_column)
+    if formulas is None:
+        formulas = FormuleColonna.from_cells(
+            read_column_cells(file_path, sheet_data.sheet_name, remaining_column, sheet_data.header))
+        sheet_data = sheet_data.merge(ColonneFoglio(sheet_data.sheet_name, sheet_data.header, {},
+                                                    {remaining_column: formulas}))
+
+    letter = get_column_letter(sheet_data.header.index(remaining_column) + 1)
+    by_letter = {get_column_letter(index + 1): name for index, name in enumerate(sheet_data.header)}
+    needed = {column: by_letter[column] for column in formulas.columns() - {letter} if column in by_letter}
+    missing = [name for name in needed.values() if name not in sheet_data.arrays]
+    if missing:
+        sheet_data = sheet_data.merge(read_sheet_columns(file_path, sheet_data.sheet_name, missing))
+
+    first_row = formulas.first_row
+    corrected = {quantity_column: quantities, price_column: prices}
+    arrays = {}
+    for column, name in needed.items():
+        original = np.nan_to_num(sheet_data[name], nan=0.0) if name in sheet_data.arrays else np.zeros(0)
+        update = corrected.get(name)
+        length = max(len(original), 0 if update is None else len(update))
+        values = np.zeros(first_row + length)
+        values[first_row:first_row + len(original)] = original
+        if update is not None:
+            values[first_row:first_row + len(update)] = update
+        arrays[column] = values
+
+    values = evaluate_column(formulas, letter, arrays)
+
+    total_rows = np.array(sorted(row for key, rows in formulas.groups.items()
+                                 if parse_template(key) is not None and _is_total(parse_template(key))
+                                 for row in rows.tolist()), dtype=np.int64)
+    data = np.arange(first_row, min(first_row + len(quantities), len(values)))
+    data = data[~np.isin(data, total_rows)]
+    formula_rows = np.concatenate([rows for rows in formulas.groups.values()] or [np.zeros(0, dtype=np.int64)])
+    unresolved = np.sort(formula_rows[np.isnan(values[formula_rows])])
+
+    rows_total = float(np.nansum(values[data]))
+    totals = [{"cell": f"{letter}{row}", "value": float(values[row])}
+              for row in total_rows[-MAX_REPORTED_CELLS:] if not np.isnan(values[row])]
+    shown = totals[-1]["value"] if totals else rows_total
+    difference = shown - float(final_total)
+    consistent = abs(difference) < FORMULA_TOLERANCE and not np.isnan(values[data]).any()
+
+    report = {
+        "column": remaining_column,
+        "formulas": int(len(formula_rows)),
+        "templates": len(formulas.groups),
+        "rows_total": rows_total,
+        "totals": totals,
+        "total": shown,
+        "final_total": float(final_total),
+        "difference": difference,
+        "consistent": bool(consistent),
+        "unresolved": int(len(unresolved)),
+        "unresolved_cells": _cell(letter, unresolved),
+        "elapsed": time.perf_counter() - started
+    }
+    if not consistent:
+        log_event("totale delle formule diverso dal totale corretto", level=logging.WARNING,
+                  column=remaining_column, total=shown, final_total=float(final_total),
+                  difference=difference, unresolved=len(unresolved))
+    return report, sheet_data
+
+
+# ----------------------------------------------------------------------
+# File tabellari: rimanenze salvate come valori
+# ----------------------------------------------------------------------
+
+def product_values(quantities, prices) -> np.ndarray:
+    """
+    Quantità × prezzo arrotondato alle cifre decimali dei due fattori: il float più vicino al
+    prodotto esatto (3 × 1.1 = 3.3, non 3.3000000000000003)
+    """
+    quantities = np.asarray(quantities, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    values = quantities * prices
+    quantity_scale, price_scale = decimal_scale(quantities), decimal_scale(prices)
+    if quantity_scale is None or price_scale is None:
+        return values
+    return np.round(values, quantity_scale + price_scale)
+
+
+def _data_column(sheet_data: ColonneFoglio, column: str, rows: int) -> np.ndarray:
+    """Prime rows righe di dati di una colonna, celle vuote (o mancanti in fondo) = 0"""
+    values = np.zeros(rows)
+    original = sheet_data[column][:rows]
+    values[:len(original)] = np.nan_to_num(original, nan=0.0)
+    return values
+
+
+def stored_remaining(sheet_data: ColonneFoglio, quantity_column: str, price_column: str,
+                     remaining_column: str, quantities, prices) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rimanenze di un file tabellare dopo la correzione: i valori del file, con quantità × prezzo
+    nelle righe di dati la cui quantità o il cui prezzo è cambiato.
+    Restituisce (valori originali, valori salvati) sulle prime len(quantities) righe di dati.
+    """
+    rows = len(quantities)
+    changed = ((_data_column(sheet_data, quantity_column, rows) != quantities)
+               | (_data_column(sheet_data, price_column, rows) != prices))
+    original = _data_column(sheet_data, remaining_column, rows)
+    stored = original.copy()
+    stored[changed] = product_values(np.asarray(quantities)[changed], np.asarray(prices)[changed])
+    return original, stored
+
+
+def check_stored_column(sheet_data: ColonneFoglio, quantity_column: str, price_column: str,
+                        remaining_column: str, quantities, prices, final_total: float) -> Dict[str, Any]:
+    """
+    Verifica per i file tabellari, con le stesse chiavi di check_remaining_column: ogni
+    rimanenza salvata (stored_remaining) deve valere quantità × prezzo e la loro somma
+    final_total; le righe diverse sono in "inconsistent" / "inconsistent_cells"
+    """
+    started = time.perf_counter()
+    _, stored = stored_remaining(sheet_data, quantity_column, price_column, remaining_column,
+                                 quantities, prices)
+    letter = get_column_letter(sheet_data.header.index(remaining_column) + 1)
+    wrong = np.flatnonzero(np.abs(stored - product_values(quantities, prices)) >= FORMULA_TOLERANCE)
+    rows_total = float(stored.sum())
+    difference = rows_total - float(final_total)
+    consistent = abs(difference) < FORMULA_TOLERANCE and not len(wrong)
+
+    report = {
+        "column": remaining_column,
+        "formulas": 0,
+        "templates": 0,
+        "rows_total": rows_total,
+        "totals": [],
+        "total": rows_total,
+        "final_total": float(final_total),
+        "difference": difference,
+        "consistent": bool(consistent),
+        "unresolved": 0,
+        "unresolved_cells": [],
+        "inconsistent": int(len(wrong)),
+        "inconsistent_cells": _cell(letter, wrong + FIRST_DATA_ROW),
+        "elapsed": time.perf_counter() - started
+    }
+    if not consistent:
+        log_event("rimanenze salvate diverse da quantità × prezzo", level=logging.WARNING,
+                  column=remaining_column, total=rows_total, final_total=float(final_total),
+                  difference=difference, inconsistent=len(wrong))
+    return report
@@ -0,0 +1,202 @@
+import os
+import time
+from decimal import Decimal
+from typing import Any, Dict, List
+
+import numpy as np
+
+from centesimi import exact_dot
+from colonne_solver import FIRST_DATA_ROW
+from compensazione import close_residual
+from lettura_excel import ColonneFoglio
+from scrittura_xlsx import column_patches
+from solver_milp import integer_problem
+
+# Variazione relativa massima del target gestita in modo incrementale (oltre: correzione completa)
+INCREMENTAL_MAX_CHANGE = float(os.getenv("EXCEL_INCREMENTAL_MAX_CHANGE", "0.05"))
+# Righe più economiche e più care considerate per chiudere il residuo, oltre a quelle modificate
+INCREMENTAL_CANDIDATES = 256
+
+
+class IncrementalError(Exception):
+    """La modifica non si può applicare in modo incrementale: serve una correzione completa"""
+
+
+class StatoCorrezione:
+    """
+    Stato del solver dopo una correzione, per applicare piccole modifiche (righe o target)
+    in tempo proporzionale alla modifica invece di ripartire da capo:
+    - quantità normalizzate e fattore di scaling (per le quantità di partenza modificate)
+    - quantità intere finali e prezzi in interi scalati (units, stessa scala del target)
+    - totale esatto corrente Σ q_i × c_i, aggiornato a ogni modifica
+    - indice delle righe ordinate per prezzo, usato dalla compensazione: solo le righe che
+      la correzione completa può spostare (prezzo valido e giacenza normalizzata > 0, come
+      ExcelSolverSemplice._compensation_rows; i limiti per riga richiedono la correzione completa)
+    """
+
+    def __init__(self, sheet_data: ColonneFoglio, quantity_column: str, price_column: str,
+                 remaining_column: str, normalized, factor: float, prices, quantities, target_total: float):
+        self.sheet_data = sheet_data
+        self.quantity_column = quantity_column
+        self.price_column = price_column
+        self.remaining_column = remaining_column
+        self.normalized = np.asarray(normalized, dtype=np.float64).copy()
+        self.factor = float(factor)
+        self.prices = np.asarray(prices, dtype=np.float64).copy()
+
+        valid = np.isfinite(self.prices) & (self.prices > 0)
+        problem = integer_problem(self.prices[valid], target_total)
+        if problem is None:
+            raise IncrementalError("Prezzi o target con troppe cifre decimali")
+        valid_units, self.target, self.scale = problem
+        self.units = np.zeros(len(self.prices), dtype=np.int64)
+        self.units[valid] = valid_units
+        self.target_total = float(target_total)
+
+        # Quantità intere e non negative (un eventuale residuo viene chiuso alla prima modifica)
+        quantities = np.maximum(np.round(np.asarray(quantities, dtype=np.float64)), 0)
+        self.quantities = np.where(valid, quantities, 0).astype(np.int64)
+        self.total = exact_dot(self.quantities, self.units)
+
+        order = np.argsort(self.units, kind="stable")
+        self.order = order[self._movable(order)]
+        self.sorted_units = self.units[self.order]
+        # Righe con il prezzo cambiato rispetto al file (da riscrivere nel foglio)
+        self.price_changed = set()
+
+    @classmethod
+    def from_solver(cls, solver) -> "StatoCorrezione":
+        if getattr(solver, "group_column", None) is not None:
+            raise IncrementalError("Correzione con target per gruppo: serve una correzione completa")
+        if getattr(solver, "limits", None) is not None:
+            raise IncrementalError("Correzione con limiti per riga: serve una correzione completa")
+        return cls(solver.sheet_data, solver.quantity_column, solver.price_column, solver.remaining_column,
+                   solver.normalized_quantities, solver.scaling_factor,
+                   solver.data.prices, solver.data.quantities,
+                   solver.target_total)
+
+    @property
+    def nbytes(self) -> int:
+        return (self.sheet_data.nbytes + self.normalized.nbytes + self.prices.nbytes + self.units.nbytes
+                + self.quantities.nbytes + self.order.nbytes + self.sorted_units.nbytes)
+
+    @property
+    def final_total(self) -> Decimal:
+        return Decimal(self.total).scaleb(-self.scale)
+
+    def _scaled(self, value, what: str) -> int:
+        """Valore in interi sulla scala dello stato (errore se ha più cifre decimali)"""
+        scaled = Decimal(str(value)).scaleb(self.scale)
+        if scaled != scaled.to_integral_value():
+            raise IncrementalError(f"{what} {value} ha più di {self.scale} cifre decimali")
+        return int(scaled)
+
+    def _movable(self, rows):
+        """Righe che la compensazione può spostare: prezzo valido e giacenza normalizzata > 0"""
+        return (self.units[rows] > 0) & (self.normalized[rows] > 0)
+
+    def _unindex(self, row: int):
+        """Toglie la riga dall'indice ordinato per prezzo"""
+        unit = int(self.units[row])
+        lo, hi = np.searchsorted(self.sorted_units, [unit, unit + 1])
+        position = lo + int(np.flatnonzero(self.order[lo:hi] == row)[0])
+        self.order = np.delete(self.order, position)
+        self.sorted_units = np.delete(self.sorted_units, position)
+
+    def _index(self, row: int):
+        """Inserisce la riga nell'indice ordinato per prezzo"""
+        unit = int(self.units[row])
+        position = int(np.searchsorted(self.sorted_units, unit, side="right"))
+        self.order = np.insert(self.order, position, row)
+        self.sorted_units = np.insert(self.sorted_units, position, unit)
+
+    def _change_row(self, change: Dict[str, Any]) -> int:
+        """Applica la modifica di una riga aggiornando il totale; restituisce l'indice della riga"""
+        row = int(change["row"]) - FIRST_DATA_ROW
+        if not 0 <= row < len(self.prices):
+            raise IncrementalError(f"Riga {change['row']} fuori dai dati elaborati")
+        before = int(self.quantities[row]) * int(self.units[row])
+        # Prezzo e quantità di partenza decidono se e dove la riga sta nell'indice
+        if self._movable(row):
+            self._unindex(row)
+
+        if change.get("price") is not None:
+            price = float(change["price"])
+            unit = self._scaled(price, "Il prezzo") if np.isfinite(price) and price > 0 else 0
+            self.units[row] = unit
+            self.prices[row] = price
+            self.price_changed.add(row)
+        if change.get("quantity") is not None:
+            # Quantità di partenza corretta dall'operatore: stesso scaling della correzione
+            self.normalized[row] = max(float(change["quantity"]), 0.0)
+            self.quantities[row] = int(round(self.normalized[row] * self.factor))
+        if self.units[row] == 0:
+            self.quantities[row] = 0
+        if self._movable(row):
+            self._index(row)
+
+        self.total += int(self.quantities[row]) * int(self.units[row]) - before
+        return row
+
+    def _candidates(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Righe modificate più le più economiche e le più care (indice ordinato per prezzo),
+        solo tra quelle che la compensazione può spostare
+        """
+        count = INCREMENTAL_CANDIDATES
+        ends = self.order if len(self.order) <= 2 * count else np.concatenate([self.order[:count], self.order[-count:]])
+        candidates = np.union1d(rows, ends)
+        return candidates[self._movable(candidates)]
+
+    def apply(self, changes: List[Dict[str, Any]] = None, target_total: float = None) -> Dict[str, Any]:
+        """
+        Applica le modifiche {row (riga Excel), price?, quantity?} e l'eventuale nuovo target,
+        poi chiude il residuo spostando il minor numero di unità tra le righe candidate.
+        Solleva IncrementalError se serve una correzione completa.
+        """
+        started = time.perf_counter()
+        changes = changes or []
+        if target_total is not None and target_total != self.target_total:
+            if abs(target_total - self.target_total) > INCREMENTAL_MAX_CHANGE * self.target_total:
+                raise IncrementalError(
+                    f"Variazione del target oltre il {INCREMENTAL_MAX_CHANGE:.0%}: serve una correzione completa")
+            self.target = self._scaled(target_total, "Il target")
+            self.target_total = float(target_total)
+
+        rows = np.array(sorted({self._change_row(change) for change in changes}), dtype=np.int64)
+        residual = self.target - self.total
+
+        closure = None
+        moved = rows
+        if residual != 0:
+            candidates = self._candidates(rows)
+            closure = close_residual(self.units[candidates], self.quantities[candidates], residual)
+            if not closure.closed:
+                # Le righe candidate non bastano: compensazione su tutte le righe spostabili
+                candidates = self.order
+                closure = close_residual(self.units[candidates], self.quantities[candidates], residual)
+            self.quantities[candidates] += closure.delta
+            self.total += residual - closure.remaining
+            moved = np.union1d(rows, candidates[closure.delta != 0])
+
+        return {
+            "rows_changed": len(rows),
+            "rows_moved": len(moved),
+            "residual": residual,
+            "compensation": closure.to_dict() if closure is not None else None,
+            "elapsed": time.perf_counter() - started
+        }
+
+    def cells(self):
+        """Celle da riscrivere rispetto al file originale: quantità e prezzi modificati"""
+        sheet = self.sheet_data
+        cells = column_patches(sheet.column_indices[self.quantity_column], sheet[self.quantity_column],
+                               self.quantities, first_row=FIRST_DATA_ROW)
+        if self.price_changed:
+            original = sheet[self.price_column]
+            updated = np.nan_to_num(original, nan=0.0)
+            changed = np.fromiter(self.price_changed, dtype=np.int64)
+            updated[changed] = self.prices[changed]
+            cells.update(column_patches(sheet.column_indices[self.price_column], original, updated,
+                                        first_row=FIRST_DATA_ROW))
+        return cells
@@ -0,0 +1,260 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from elaborazione import adjust_workbook
+from formati import file_format
+from job_runner import JobRunner
+from job_store import FINISHED_STATUSES, JobStore
+from metriche import observe_correction
+
+# Campi interni del lavoro da non esporre al client
+_PRIVATE_FIELDS = ("input_path", "output_path")
+# Tempo massimo (secondi) di un lavoro asincrono, dall'inizio dell'elaborazione nel worker
+# (l'attesa in coda non conta): più lungo di EXCEL_JOB_TIMEOUT delle richieste sincrone
+ASYNC_JOB_TIMEOUT = float(os.getenv("EXCEL_ASYNC_JOB_TIMEOUT", 3600))
+# Intervallo (secondi) per controllare il tempo massimo dei lavori in esecuzione
+_WATCH_INTERVAL = 1.0
+
+
+def _remove(path: Optional[str]):
+    if path and os.path.exists(path):
+        os.unlink(path)
+
+
+def _json_safe(value):
+    """Converte ricorsivamente i tipi NumPy in tipi Python serializzabili in JSON"""
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class QueueProgress:
+    """Callback di avanzamento serializzabile: inoltra le fasi dal worker al server"""
+
+    def __init__(self, job_id: str, queue):
+        self.job_id = job_id
+        self.queue = queue
+
+    def __call__(self, phase, progress, timings):
+        self.queue.put((self.job_id, phase, progress, timings))
+
+
+class JobManager:
+    """
+    Gestisce i lavori di correzione asincroni: invio al pool di processi,
+    avanzamento per fase, risultato su disco ed eliminazione dopo il TTL.
+    """
+
+    def __init__(self, runner: JobRunner, store: JobStore, directory: str = None, timeout: float = None):
+        self.runner = runner
+        self.store = store
+        self.timeout = ASYNC_JOB_TIMEOUT if timeout is None else timeout
+        self.directory = directory or os.getenv("EXCEL_JOB_DIR") or os.path.join(
+            tempfile.gettempdir(), "excel_adjuster_jobs")
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._manager = None
+        self._queue = None
+        self._drain_thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._watchers = set()
+
+    # ------------------------------------------------------------------
+    # Avanzamento dai processi worker
+    # ------------------------------------------------------------------
+
+    def _progress_queue(self):
+        """Coda condivisa con i worker (creata al primo lavoro)"""
+        with self._lock:
+            if self._queue is None:
+                self._manager = multiprocessing.get_context(self.runner.start_method).Manager()
+                self._queue = self._manager.Queue()
+                self._drain_thread = threading.Thread(target=self._drain, args=(self._queue,), daemon=True)
+                self._drain_thread.start()
+            return self._queue
+
+    def _drain(self, queue):
+        while True:
+            try:
+                message = queue.get()
+            except (EOFError, OSError):
+                return
+            if message is None:
+                return
+            job_id, phase, progress, timings = message
+            job = self.store.get(job_id)
+            if job is None or job["status"] in FINISHED_STATUSES:
+                continue
+            fields = {"phase": phase, "progress": progress, "timings": timings}
+            if job["status"] == "queued":
+                fields.update(status="running", started_at=time.time())
+            self.store.update(job_id, **fields)
+
+    # ------------------------------------------------------------------
+    # Ciclo di vita dei lavori
+    # ------------------------------------------------------------------
+
+    def submit(self, upload_path: str, filename: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Sposta il file caricato (scritto da save_upload in self.directory) tra quelli del
+        lavoro e accoda la correzione. Restituisce il lavoro creato.
+        Solleva QueueFullError / RunnerUnavailableError se il pool è saturo.
+        """
+        job_id = uuid.uuid4().hex
+        extension = os.path.splitext(filename)[1].lower()
+        input_path = os.path.join(self.directory, f"{job_id}_input{extension}")
+        output_path = os.path.join(self.directory,
+                                   f"{job_id}{file_format(filename).output_filename_extension(filename)}")
+        os.replace(upload_path, input_path)
+
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "phase": None,
+            "progress": 0.0,
+            "timings": {},
+            "filename": filename,
+            "params": params,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "output_filename": None,
+            "input_path": input_path,
+            "output_path": output_path
+        }
+        self.store.create(job)
+
+        try:
+            future = self.runner.submit(
+                adjust_workbook,
+                input_path,
+                filename,
+                params["sheet_name"],
+                params["quantity_column"],
+                params["price_column"],
+                params["remaining_column"],
+                params["target_total"],
+                params["data_rows"],
+                progress_callback=QueueProgress(job_id, self._progress_queue()),
+                output_path=output_path,
+                solver_backend=params.get("solver"),
+                group_column=params.get("group_column"),
+                group_targets=params.get("group_targets"),
+                min_column=params.get("min_column"),
+                max_column=params.get("max_column"),
+                lock_column=params.get("lock_column")
+            )
+        except Exception:
+            self.store.delete(job_id)
+            os.unlink(input_path)
+            raise
+
+        watcher = asyncio.ensure_future(self._watch(job_id, future))
+        self._watchers.add(watcher)
+        watcher.add_done_callback(self._watchers.discard)
+        return self.public(job)
+
+    async def _wait(self, job_id: str, future):
+        """
+        Esito del lavoro nel pool. Il tempo massimo (self.timeout) decorre da started_at,
+        impostato dal primo avanzamento del worker: il tempo in coda non conta.
+        Solleva asyncio.TimeoutError se il lavoro in esecuzione lo supera.
+        """
+        waiter = asyncio.wrap_future(future)
+        while True:
+            job = self.store.get(job_id)
+            started_at = job["started_at"] if job else None
+            wait = _WATCH_INTERVAL
+            if started_at is not None:
+                wait = min(wait, started_at + self.timeout - time.time())
+                if wait <= 0:
+                    raise asyncio.TimeoutError
+            done, _ = await asyncio.wait({waiter}, timeout=wait)
+            if done:
+                return waiter.result()
+
+    async def _watch(self, job_id: str, future):
+        """Attende la fine del lavoro nel pool e ne registra l'esito"""
+        job = self.store.get(job_id)
+        try:
+            outcome = await self._wait(job_id, future)
+            self.store.update(
+                job_id,
+                status="done",
+                phase="done",
+                progress=1.0,
+                finished_at=time.time(),
+                timings=outcome["timings"],
+                output_filename=outcome["output_filename"],
+                result=_json_safe(outcome["result"])
+            )
+            observe_correction(outcome["result"], outcome["timings"], kind="job")
+        except asyncio.TimeoutError:
+            self.store.update(job_id, status="failed", finished_at=time.time(),
+                              error="Tempo massimo di elaborazione superato")
+            if job:
+                # Risultato scritto solo in parte; il worker già avviato non si può interrompere:
+                # il file che sta ancora scrivendo è eliminato quando termina
+                _remove(job["output_path"])
+                if not future.cancel():
+                    future.add_done_callback(lambda _future: _remove(job["output_path"]))
+        except Exception as e:
+            self.store.update(job_id, status="failed", finished_at=time.time(), error=str(e))
+            if job:
+                _remove(job["output_path"])
+        finally:
+            if job and os.path.exists(job["input_path"]):
+                os.unlink(job["input_path"])
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    @staticmethod
+    def public(job: Dict[str, Any]) -> Dict[str, Any]:
+        """Stato del lavoro da restituire al client"""
+        status = {key: value for key, value in job.items() if key not in _PRIVATE_FIELDS}
+        status["job_id"] = status.pop("id")
+        if job["status"] == "done":
+            status["result_url"] = f"/jobs/{job['id']}/result"
+        return status
+
+    def evict_expired(self) -> int:
+        """Elimina i lavori terminati da più del TTL e i relativi file"""
+        expired = self.store.expired()
+        for job in expired:
+            for path in (job.get("input_path"), job.get("output_path")):
+                _remove(path)
+            self.store.delete(job["id"])
+        return len(expired)
+
+    async def eviction_loop(self):
+        """Pulizia periodica dei risultati scaduti"""
+        interval = max(1.0, min(self.store.ttl, 60.0))
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_expired()
+
+    def shutdown(self):
+        with self._lock:
+            if self._queue is not None:
+                try:
+                    self._queue.put(None)
+                except (EOFError, OSError):
+                    pass
+            if self._manager is not None:
+                self._manager.shutdown()
+            self._manager = self._queue = None
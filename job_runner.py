@@ -0,0 +1,157 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from metriche import configure_logging
+
+# Intervallo (secondi) per controllare la disconnessione del client
+_POLL_INTERVAL = 0.5
+
+
+class QueueFullError(Exception):
+    """Coda dei lavori piena: il client deve riprovare più tardi (HTTP 429)"""
+
+
+class RunnerUnavailableError(Exception):
+    """Pool di processi non disponibile o in chiusura (HTTP 503)"""
+
+
+class JobTimeoutError(Exception):
+    """Il lavoro ha superato il tempo massimo consentito (HTTP 504)"""
+
+
+class ClientDisconnectedError(Exception):
+    """Il client ha chiuso la connessione prima della fine del lavoro"""
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+class JobRunner:
+    """
+    Esegue le elaborazioni CPU-bound in un ProcessPoolExecutor limitato,
+    così che il parsing e il solver non blocchino l'event loop di uvicorn.
+
+    - max_workers: processi del pool (EXCEL_WORKERS, default: numero di core)
+    - max_queue: lavori in attesa oltre a quelli in esecuzione (EXCEL_MAX_QUEUE)
+    - timeout: tempo massimo per lavoro in secondi (EXCEL_JOB_TIMEOUT)
+    """
+
+    def __init__(self, max_workers: int = None, max_queue: int = None, timeout: float = None,
+                 start_method: str = None):
+        self.max_workers = max_workers or _env_int("EXCEL_WORKERS", os.cpu_count() or 1)
+        self.max_queue = max_queue if max_queue is not None else _env_int("EXCEL_MAX_QUEUE", self.max_workers * 2)
+        self.timeout = timeout if timeout is not None else _env_float("EXCEL_JOB_TIMEOUT", 300.0)
+        # spawn: i worker non ereditano thread e stato dell'event loop del server
+        self.start_method = start_method or os.getenv("EXCEL_START_METHOD", "spawn")
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._closed = False
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue
+
+    def stats(self):
+        """Stato del runner per /api/status"""
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "capacity": self.capacity,
+            "timeout": self.timeout
+        }
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+                # Log dei worker con lo stesso livello e formato del server
+                initializer=configure_logging
+            )
+        return self._executor
+
+    def _reserve_slot(self):
+        with self._lock:
+            if self._closed:
+                raise RunnerUnavailableError("Servizio in chiusura")
+            if self._in_flight >= self.capacity:
+                raise QueueFullError("Troppe elaborazioni in corso, riprova tra poco")
+            self._in_flight += 1
+
+    def _release_slot(self, _future=None):
+        with self._lock:
+            self._in_flight -= 1
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """
+        Accoda un lavoro e restituisce il concurrent.futures.Future.
+        Il posto in coda si libera solo quando il processo ha finito davvero.
+        """
+        self._reserve_slot()
+        try:
+            with self._lock:
+                executor = self._get_executor()
+            future = executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # Un worker è morto (es. OOM): ricrea il pool alla prossima richiesta
+            self._release_slot()
+            with self._lock:
+                self._executor = None
+            raise RunnerUnavailableError("Pool di elaborazione non disponibile")
+        except RuntimeError:
+            self._release_slot()
+            raise RunnerUnavailableError("Servizio in chiusura")
+        future.add_done_callback(self._release_slot)
+        return future
+
+    async def run(self, fn: Callable, *args, request=None, timeout: float = None, **kwargs) -> Any:
+        """
+        Esegue fn(*args) nel pool e ne attende il risultato senza bloccare l'event loop.
+        Se request è indicata, il lavoro viene annullato quando il client si disconnette.
+        """
+        future = self.submit(fn, *args, **kwargs)
+        waiter = asyncio.wrap_future(future)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout if timeout is not None else self.timeout)
+
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise JobTimeoutError("Tempo massimo di elaborazione superato")
+                done, _ = await asyncio.wait({waiter}, timeout=min(_POLL_INTERVAL, remaining))
+                if done:
+                    try:
+                        return waiter.result()
+                    except BrokenProcessPool:
+                        with self._lock:
+                            self._executor = None
+                        raise RunnerUnavailableError("Un processo di elaborazione è terminato in modo anomalo")
+                if request is not None and await request.is_disconnected():
+                    raise ClientDisconnectedError("Client disconnesso")
+        except BaseException:
+            # Annulla il lavoro se è ancora in coda (uno già avviato termina da solo)
+            future.cancel()
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
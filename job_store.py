@@ -0,0 +1,152 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+# Stati finali: i lavori in questi stati vengono rimossi dopo il TTL
+FINISHED_STATUSES = ("done", "failed")
+
+
+class JobStore(ABC):
+    """
+    Interfaccia dei backend che conservano lo stato dei lavori asincroni.
+    Un lavoro è un dizionario serializzabile in JSON con almeno 'id' e 'status'.
+    Un backend che non implementa tutti i metodi non si può istanziare.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    @abstractmethod
+    def create(self, job: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def update(self, job_id: str, **fields) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def delete(self, job_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def expired(self, now: float = None) -> List[Dict[str, Any]]:
+        """Lavori terminati da più di ttl secondi"""
+
+
+class MemoryJobStore(JobStore):
+    """Backend in memoria (un solo processo server)"""
+
+    def __init__(self, ttl: float):
+        super().__init__(ttl)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def expired(self, now=None):
+        limit = (now or time.time()) - self.ttl
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()
+                    if job["status"] in FINISHED_STATUSES and (job.get("finished_at") or 0) < limit]
+
+
+class SQLiteJobStore(JobStore):
+    """Backend su disco con SQLite: sopravvive ai riavvii ed è condiviso tra worker uvicorn"""
+
+    def __init__(self, path: str, ttl: float):
+        super().__init__(ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " finished_at REAL,"
+                " data TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (status, finished_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def create(self, job):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, finished_at, data) VALUES (?, ?, ?, ?)",
+                (job["id"], job["status"], job.get("finished_at"), json.dumps(job))
+            )
+
+    def update(self, job_id, **fields):
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = json.loads(row[0])
+            job.update(fields)
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, data = ? WHERE id = ?",
+                (job["status"], job.get("finished_at"), json.dumps(job), job_id)
+            )
+            return job
+
+    def get(self, job_id):
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def delete(self, job_id):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def expired(self, now=None):
+        limit = (now or time.time()) - self.ttl
+        placeholders = ", ".join("?" for _ in FINISHED_STATUSES)
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT data FROM jobs WHERE status IN ({placeholders}) AND finished_at < ?",
+                (*FINISHED_STATUSES, limit)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+def create_job_store(url: str = None, ttl: float = None) -> JobStore:
+    """
+    Crea il backend dalla configurazione:
+    EXCEL_JOB_STORE = 'memory' (default) oppure 'sqlite:///percorso/jobs.db'
+    EXCEL_JOB_TTL = secondi di conservazione dei risultati (default 3600)
+    """
+    url = url or os.getenv("EXCEL_JOB_STORE", "memory")
+    ttl = ttl if ttl is not None else float(os.getenv("EXCEL_JOB_TTL", "3600"))
+    if url == "memory":
+        return MemoryJobStore(ttl)
+    if url.startswith("sqlite:///"):
+        return SQLiteJobStore(url[len("sqlite:///"):], ttl)
+    raise ValueError(f"Backend dei lavori non supportato: {url}")
@@ -0,0 +1,457 @@
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+from formati import file_format
+
+
+class ColonneFoglio:
+    """
+    Risultato dell'ingestione di un foglio: solo le colonne richieste come array NumPy,
+    più le formule già lette di alcune colonne (formule.FormuleColonna, per nome).
+    Le colonne di etichette (es. categoria o magazzino, lette con label_columns) sono
+    array di codici float (NaN = cella vuota) con le etichette in categories[colonna].
+    """
+
+    def __init__(self, sheet_name: str, header: List[str], arrays: Dict[str, np.ndarray],
+                 formulas: Dict[str, Any] = None, categories: Dict[str, List[str]] = None):
+        self.sheet_name = sheet_name
+        self.header = header
+        self.arrays = arrays
+        self.formulas = dict(formulas or {})
+        self.categories = dict(categories or {})
+        # Indice (1-based, come in Excel) di ogni colonna nell'header
+        self.column_indices = {name: header.index(name) + 1 for name in arrays}
+        self.n_rows = len(next(iter(arrays.values()))) if arrays else 0
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.arrays[column]
+
+    @property
+    def nbytes(self) -> int:
+        return (sum(values.nbytes for values in self.arrays.values())
+                + sum(formulas.nbytes for formulas in self.formulas.values()))
+
+    def has_columns(self, columns: List[str]) -> bool:
+        return all(column in self.arrays for column in columns)
+
+    def labels(self, column: str) -> Tuple[np.ndarray, List[str]]:
+        """
+        Codice di gruppo di ogni riga (int64, -1 per le celle vuote) ed etichetta di ogni codice.
+        Una colonna letta come numerica (es. dalla cache di /introspect) usa i valori come etichette.
+        """
+        values = self.arrays[column]
+        empty = np.isnan(values)
+        if column in self.categories:
+            return np.where(empty, -1, values).astype(np.int64), list(self.categories[column])
+        unique, codes = np.unique(values[~empty], return_inverse=True)
+        result = np.full(len(values), -1, dtype=np.int64)
+        result[~empty] = codes
+        return result, [_label(value) for value in unique.tolist()]
+
+    def merge(self, other: "ColonneFoglio") -> "ColonneFoglio":
+        """Unisce le colonne lette in due momenti diversi dallo stesso foglio"""
+        categories = {column: labels for column, labels in self.categories.items() if column not in other.arrays}
+        return ColonneFoglio(self.sheet_name, self.header, {**self.arrays, **other.arrays},
+                             {**self.formulas, **other.formulas}, {**categories, **other.categories})
+
+    def select(self, columns: List[str], data_rows: int = None) -> "ColonneFoglio":
+        """
+        Estrae un sottoinsieme di colonne già lette, con lo stesso risultato di
+        read_sheet_columns(file_path, sheet_name, columns, data_rows)
+        """
+        columns = list(dict.fromkeys(columns))
+        length = max((len(self.arrays[column]) for column in columns), default=0)
+        arrays = {}
+        for column in columns:
+            values = self.arrays[column]
+            # Colonne lette insieme ad altre possono avere righe finali vuote tagliate
+            if len(values) < length:
+                values = np.concatenate([values, np.full(length - len(values), np.nan)])
+            arrays[column] = values[:data_rows] if data_rows is not None else values
+        formulas = {column: self.formulas[column] for column in columns if column in self.formulas}
+        categories = {column: self.categories[column] for column in columns if column in self.categories}
+        return ColonneFoglio(self.sheet_name, self.header, _trim_trailing_empty(arrays), formulas, categories)
+
+
+def _header_names(values) -> List[str]:
+    """
+    Normalizza l'header come fa pandas: celle vuote → 'Unnamed: i',
+    nomi duplicati → 'nome.1', 'nome.2', ...
+    """
+    names = []
+    seen = {}
+    for i, value in enumerate(values):
+        name = f"Unnamed: {i}" if value is None or value == '' else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _to_float(value) -> float:
+    """Converte un valore di cella in float (NaN per celle vuote o non numeriche)"""
+    if value is None or isinstance(value, bool):
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _label(value) -> str:
+    """Etichetta di gruppo di una cella: i numeri interi senza decimali (14.0 → '14')"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _label_code(value, labels: Dict[str, int]) -> float:
+    """Codice (float, NaN per le celle vuote) dell'etichetta della cella, aggiunta se nuova"""
+    if value is None or value == '':
+        return np.nan
+    return float(labels.setdefault(_label(value), len(labels)))
+
+
+def _column_positions(header: List[str], columns: List[str], sheet_name: str) -> List[int]:
+    positions = []
+    for column in columns:
+        if column not in header:
+            raise ValueError(f"Colonna '{column}' non trovata nel foglio '{sheet_name}'")
+        positions.append(header.index(column))
+    return positions
+
+
+def _trim_trailing_empty(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Rimuove le righe finali vuote in tutte le colonne lette"""
+    if not arrays:
+        return arrays
+    filled = np.zeros(len(next(iter(arrays.values()))), dtype=bool)
+    for values in arrays.values():
+        filled |= ~np.isnan(values)
+    last = int(np.flatnonzero(filled)[-1]) + 1 if filled.any() else 0
+    return {name: values[:last] for name, values in arrays.items()}
+
+
+def _read_xlsx(file_path: str, sheet_name: str, columns: List[str], data_rows: Optional[int],
+               label_columns: List[str]):
+    from openpyxl import load_workbook
+
+    # read_only + data_only: parsing in streaming dei soli valori (niente modello in memoria)
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if sheet_name not in wb.sheetnames:
+            raise ValueError(f"Foglio '{sheet_name}' non trovato")
+        ws = wb[sheet_name]
+        # Le dimensioni dichiarate nel file non sono affidabili in modalità read-only
+        ws.reset_dimensions()
+
+        rows = ws.iter_rows(values_only=True)
+        header = _header_names(next(rows, ()))
+        positions = _column_positions(header, columns, sheet_name)
+
+        # Legge solo l'intervallo di colonne che contiene quelle richieste
+        min_col = min(positions)
+        max_col = max(positions)
+        rows = ws.iter_rows(min_row=2, min_col=min_col + 1, max_col=max_col + 1, values_only=True)
+        offsets = [p - min_col for p in positions]
+
+        values = [[] for _ in columns]
+        # Etichette → codice per le colonne di etichette (None per quelle numeriche)
+        labels = [{} if column in label_columns else None for column in columns]
+        for row_number, row in enumerate(rows):
+            if data_rows is not None and row_number >= data_rows:
+                break
+            for target, offset, column_labels in zip(values, offsets, labels):
+                value = row[offset] if offset < len(row) else None
+                target.append(_to_float(value) if column_labels is None else _label_code(value, column_labels))
+    finally:
+        wb.close()
+
+    arrays = {column: np.array(vals, dtype=np.float64) for column, vals in zip(columns, values)}
+    categories = {column: list(column_labels) for column, column_labels in zip(columns, labels)
+                  if column_labels is not None}
+    return header, arrays, categories
+
+
+def _xls_values(sheet, position: int, end_row: int) -> np.ndarray:
+    """
+    Valori numerici di una colonna xlrd (righe 1..end_row-1): numeri e date direttamente
+    dall'array dei valori, il testo convertito cella per cella solo se c'è (NaN se non
+    numerico), NaN per celle vuote, booleani ed errori (come nella lettura dei .xlsx)
+    """
+    import xlrd
+
+    values = np.full(end_row - 1, np.nan)
+    if position >= sheet.ncols:
+        return values
+    types = np.asarray(sheet.col_types(position, start_rowx=1, end_rowx=end_row), dtype=np.int8)
+    raw = np.asarray(sheet.col_values(position, start_rowx=1, end_rowx=end_row), dtype=object)
+    numeric = np.flatnonzero((types == xlrd.XL_CELL_NUMBER) | (types == xlrd.XL_CELL_DATE))
+    values[numeric] = raw[numeric].astype(np.float64)
+    for row in np.flatnonzero(types == xlrd.XL_CELL_TEXT).tolist():
+        values[row] = _to_float(raw[row]) if raw[row] != '' else np.nan
+    return values
+
+
+def _read_xls(file_path: str, sheet_name: str, columns: List[str], data_rows: Optional[int],
+              label_columns: List[str]):
+    import xlrd
+
+    # on_demand: carica solo il foglio richiesto
+    book = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        if sheet_name not in book.sheet_names():
+            raise ValueError(f"Foglio '{sheet_name}' non trovato")
+        sheet = book.sheet_by_name(sheet_name)
+
+        header = _header_names(sheet.row_values(0) if sheet.nrows > 0 else [])
+        positions = _column_positions(header, columns, sheet_name)
+
+        end_row = sheet.nrows if data_rows is None else min(sheet.nrows, data_rows + 1)
+        arrays = {}
+        categories = {}
+        for column, position in zip(columns, positions):
+            if column not in label_columns:
+                arrays[column] = _xls_values(sheet, position, end_row)
+                continue
+            raw = sheet.col_values(position, start_rowx=1, end_rowx=end_row) if position < sheet.ncols else []
+            labels = {}
+            vals = np.array([_label_code(v, labels) for v in raw], dtype=np.float64)
+            categories[column] = list(labels)
+            # Le colonne xlrd possono essere più corte del foglio
+            if len(vals) < end_row - 1:
+                vals = np.concatenate([vals, np.full(end_row - 1 - len(vals), np.nan)])
+            arrays[column] = vals
+    finally:
+        book.release_resources()
+
+    return header, arrays, categories
+
+
+def read_sheet_columns(
+    file_path: str,
+    sheet_name: str,
+    columns: List[str],
+    data_rows: int = None,
+    label_columns: List[str] = None
+) -> ColonneFoglio:
+    """
+    Legge in streaming un solo foglio ed estrae soltanto le colonne richieste.
+    La memoria e il tempo di parsing dipendono dal numero di colonne lette,
+    non dalla dimensione dell'intera cartella di lavoro. Per i file tabellari
+    (CSV, Parquet, Arrow) il foglio è formati.TABLE_SHEET (vedi tabelle.py).
+    label_columns: colonne (tra quelle richieste) lette come etichette di gruppo
+    (testo o numeri, vedi ColonneFoglio.labels) invece che come valori numerici.
+    """
+    # Elimina i duplicati mantenendo l'ordine (es. stessa colonna usata due volte)
+    columns = list(dict.fromkeys(columns))
+    label_columns = label_columns or []
+
+    fmt = file_format(file_path)
+    if not fmt.workbook:
+        from tabelle import read_table_columns
+
+        header, arrays, categories = read_table_columns(file_path, sheet_name, columns, data_rows, label_columns)
+    elif fmt.name == 'xls':
+        header, arrays, categories = _read_xls(file_path, sheet_name, columns, data_rows, label_columns)
+    else:
+        header, arrays, categories = _read_xlsx(file_path, sheet_name, columns, data_rows, label_columns)
+
+    return ColonneFoglio(sheet_name, header, _trim_trailing_empty(arrays), categories=categories)
+
+
+def read_column_cells(file_path: str, sheet_name: str, column: str, header: List[str] = None) -> List[Any]:
+    """
+    Contenuto grezzo delle celle di una colonna (dalla riga 2): per i .xlsx il testo delle
+    formule invece dei valori calcolati salvati nel file (scrittura_xlsx.column_cells),
+    per i .xls i valori (la conversione in .xlsx non conserva le formule), come per i
+    file tabellari, che non hanno formule.
+    header: intestazione già letta (evita di riaprire il foglio con openpyxl)
+    """
+    fmt = file_format(file_path)
+    if not fmt.workbook:
+        from tabelle import read_table_columns
+
+        _, arrays, _ = read_table_columns(file_path, sheet_name, [column], None, [])
+        return [None if np.isnan(value) else value for value in arrays[column].tolist()]
+
+    if fmt.name == 'xls':
+        import xlrd
+
+        book = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            if sheet_name not in book.sheet_names():
+                raise ValueError(f"Foglio '{sheet_name}' non trovato")
+            sheet = book.sheet_by_name(sheet_name)
+            header = _header_names(sheet.row_values(0) if sheet.nrows > 0 else [])
+            position, = _column_positions(header, [column], sheet_name)
+            cells = sheet.col_values(position, start_rowx=1) if position < sheet.ncols else []
+        finally:
+            book.release_resources()
+        return [value if isinstance(value, float) else None for value in cells]
+
+    from scrittura_xlsx import column_cells
+
+    if header is None:
+        all_names, samples = sample_sheets(file_path, [sheet_name], max_rows=0)
+        header = samples[0].header
+    position, = _column_positions(header, [column], sheet_name)
+    return column_cells(file_path, sheet_name, position + 1)
+
+
+class CampioneFoglio:
+    """
+    Intestazione, prime righe e numero di righe (dai metadati) di un foglio,
+    per un'analisi rapida senza leggere il foglio per intero
+    """
+
+    def __init__(self, sheet_name: str, header: List[str], rows: List[tuple],
+                 row_count: int, row_count_exact: bool):
+        self.sheet_name = sheet_name
+        self.header = header
+        self.rows = rows
+        self.row_count = row_count
+        self.row_count_exact = row_count_exact
+
+
+def _trim_trailing_empty_rows(rows: List[tuple]) -> List[tuple]:
+    last = len(rows)
+    while last > 0 and all(value is None or value == '' for value in rows[last - 1]):
+        last -= 1
+    return rows[:last]
+
+
+def _sample(sheet_name: str, header_values, rows: List[tuple], row_count: int, exact: bool) -> CampioneFoglio:
+    """Allinea intestazione e righe: come pandas, le colonne senza intestazione diventano 'Unnamed: i'"""
+    width = max([len(header_values)] + [len(row) for row in rows])
+    header = _header_names(tuple(header_values) + (None,) * (width - len(header_values)))
+    rows = [tuple(row) + (None,) * (width - len(row)) for row in rows]
+    return CampioneFoglio(sheet_name, header, rows, row_count, exact)
+
+
+class _LazySharedStrings:
+    """
+    Tabella delle stringhe condivise letta in streaming solo fino all'indice richiesto:
+    le prime righe di un foglio usano in genere le prime stringhe della tabella
+    """
+
+    def __init__(self, archive, path: str):
+        self.archive = archive
+        self.path = path
+        self.strings: List[str] = []
+        self._nodes = None
+
+    def __getitem__(self, index: int) -> str:
+        from openpyxl.xml.constants import SHEET_MAIN_NS
+        from openpyxl.xml.functions import iterparse
+
+        if self._nodes is None:
+            self._nodes = iterparse(self.archive.open(self.path))
+        si, t, r = ('{%s}%s' % (SHEET_MAIN_NS, tag) for tag in ('si', 't', 'r'))
+        while index >= len(self.strings):
+            try:
+                _, node = next(self._nodes)
+            except StopIteration:
+                raise IndexError(index)
+            if node.tag == si:
+                # Come Text.content di openpyxl: testo semplice più i run formattati (senza rPh)
+                parts = [child.text or '' if child.tag == t else child.findtext(t) or ''
+                         for child in node if child.tag in (t, r)]
+                self.strings.append(''.join(parts).replace('x005F_', ''))
+                node.clear()
+        return self.strings[index]
+
+
+def _open_xlsx_lazy(file_path: str):
+    """load_workbook(read_only=True, data_only=True) senza leggere tutte le stringhe condivise"""
+    from openpyxl.reader.excel import ExcelReader, SHARED_STRINGS
+
+    class _Reader(ExcelReader):
+        def read_strings(self):
+            ct = self.package.find(SHARED_STRINGS)
+            self.shared_strings = _LazySharedStrings(self.archive, ct.PartName[1:]) if ct is not None else []
+
+    reader = _Reader(file_path, read_only=True, data_only=True)
+    reader.read()
+    return reader.wb
+
+
+def _sample_xlsx(file_path: str, sheet_names: Optional[List[str]], max_rows: int):
+    wb = _open_xlsx_lazy(file_path)
+    try:
+        all_names = list(wb.sheetnames)
+        samples = []
+        for sheet_name in (sheet_names if sheet_names is not None else all_names):
+            if sheet_name not in all_names:
+                raise ValueError(f"Foglio '{sheet_name}' non trovato")
+            ws = wb[sheet_name]
+            # Dimensione dichiarata nel file (<dimension ref="A1:K2424">), può mancare
+            declared_rows = ws.max_row
+            ws.reset_dimensions()
+
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, ())
+            sample = []
+            exhausted = True
+            for row in rows:
+                if len(sample) >= max_rows:
+                    exhausted = False
+                    break
+                sample.append(row)
+            sample = _trim_trailing_empty_rows(sample)
+
+            if exhausted:
+                row_count, exact = len(sample), True
+            else:
+                row_count, exact = max(len(sample), (declared_rows or 1) - 1), False
+            samples.append(_sample(sheet_name, header, sample, row_count, exact))
+    finally:
+        wb.close()
+    return all_names, samples
+
+
+def _sample_xls(file_path: str, sheet_names: Optional[List[str]], max_rows: int):
+    import xlrd
+
+    book = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        all_names = book.sheet_names()
+        samples = []
+        for sheet_name in (sheet_names if sheet_names is not None else all_names):
+            if sheet_name not in all_names:
+                raise ValueError(f"Foglio '{sheet_name}' non trovato")
+            sheet = book.sheet_by_name(sheet_name)
+            header = sheet.row_values(0) if sheet.nrows > 0 else []
+            end_row = min(sheet.nrows, max_rows + 1)
+            sample = [tuple(None if value == '' else value for value in sheet.row_values(rowx))
+                      for rowx in range(1, end_row)]
+            sample = _trim_trailing_empty_rows(sample)
+            # In .xls il numero di righe è noto, ma può includere righe finali vuote
+            exact = end_row == sheet.nrows
+            row_count = len(sample) if exact else sheet.nrows - 1
+            samples.append(_sample(sheet_name, header, sample, row_count, exact))
+            book.unload_sheet(sheet_name)
+    finally:
+        book.release_resources()
+    return all_names, samples
+
+
+def sample_sheets(file_path: str, sheet_names: List[str] = None, max_rows: int = 1000):
+    """
+    Apre il file una sola volta e, per ogni foglio richiesto (default: tutti),
+    legge in streaming l'intestazione e al massimo max_rows righe di dati.
+    Restituisce i nomi di tutti i fogli e i campioni (CampioneFoglio) di quelli richiesti.
+    """
+    fmt = file_format(file_path)
+    if not fmt.workbook:
+        from tabelle import sample_table
+
+        return sample_table(file_path, sheet_names, max_rows)
+    if fmt.name == 'xls':
+        return _sample_xls(file_path, sheet_names, max_rows)
+    return _sample_xlsx(file_path, sheet_names, max_rows)
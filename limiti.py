@@ -0,0 +1,154 @@
+"""
+Limiti per riga della correzione: quantità minima e massima (colonne opzionali del foglio)
+e righe bloccate, che restano alla quantità originale. Lo scaling con limiti è un
+water-filling vettorizzato: un fattore λ per gruppo con Σ p·clip(λ·q, min, max) = target,
+cercato per bisezione su tutti i gruppi insieme (ogni passo è un np.bincount) e rifinito
+in modo esatto sulle righe non saturate.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+from lettura_excel import ColonneFoglio
+
+# Valori della colonna di blocco che indicano una riga NON bloccata (confronto senza maiuscole)
+UNLOCKED_VALUES = {"", "0", "no", "n", "false", "falso"}
+# Passi di bisezione del fattore di scaling (precisione relativa ~2^-60)
+BISECTION_STEPS = 60
+
+
+def _column(sheet: ColonneFoglio, column: Optional[str], rows: int) -> Optional[np.ndarray]:
+    """Colonna numerica letta (NaN per le righe oltre la fine), limitata a rows righe"""
+    if not column:
+        return None
+    values = sheet[column][:rows]
+    if len(values) < rows:
+        values = np.concatenate([values, np.full(rows - len(values), np.nan)])
+    return values
+
+
+class LimitiRighe:
+    """
+    Limiti interi di ogni riga del solver:
+    - lower: quantità minima (0 se non indicata)
+    - upper: quantità massima (np.inf se non indicata)
+    - locked: righe bloccate, con lower = upper = quantità originale
+    """
+
+    __slots__ = ("lower", "upper", "locked", "min_column", "max_column", "lock_column")
+
+    def __init__(self, lower: np.ndarray, upper: np.ndarray, locked: np.ndarray,
+                 min_column: str = None, max_column: str = None, lock_column: str = None):
+        self.lower = lower
+        self.upper = upper
+        self.locked = locked
+        self.min_column = min_column
+        self.max_column = max_column
+        self.lock_column = lock_column
+
+    @classmethod
+    def from_sheet(cls, sheet: ColonneFoglio, quantities: np.ndarray, excel_rows: np.ndarray,
+                   min_column: str = None, max_column: str = None,
+                   lock_column: str = None) -> "LimitiRighe":
+        """
+        Limiti dalle colonne del foglio: minimo arrotondato per eccesso, massimo per difetto
+        (celle vuote = nessun limite); le righe bloccate mantengono la quantità originale
+        (arrotondata, mai negativa)
+        """
+        rows = len(quantities)
+        minimum = _column(sheet, min_column, rows)
+        maximum = _column(sheet, max_column, rows)
+        lower = np.zeros(rows) if minimum is None else np.maximum(np.ceil(np.nan_to_num(minimum, nan=0.0)), 0)
+        upper = np.full(rows, np.inf) if maximum is None else np.where(np.isnan(maximum), np.inf, np.floor(maximum))
+
+        locked = np.zeros(rows, dtype=bool)
+        if lock_column:
+            codes, labels = sheet.labels(lock_column)
+            flags = np.array([label.strip().lower() not in UNLOCKED_VALUES for label in labels] + [False])
+            codes = codes[:rows]
+            locked[:len(codes)] = flags[codes]
+            kept = np.maximum(np.rint(quantities[locked]), 0)
+            lower[locked] = kept
+            upper[locked] = kept
+
+        invalid = np.flatnonzero(lower > upper)
+        if len(invalid):
+            listed = ", ".join(str(row) for row in excel_rows[invalid[:10]])
+            more = f" (e altre {len(invalid) - 10})" if len(invalid) > 10 else ""
+            raise ValueError(f"Quantità minima maggiore della massima nelle righe {listed}{more}")
+        return cls(lower, upper, locked, min_column, max_column, lock_column)
+
+    @property
+    def movable(self) -> np.ndarray:
+        """Righe che la compensazione può spostare (non bloccate e con min < max)"""
+        return self.lower < self.upper
+
+    def clip(self, quantities: np.ndarray) -> np.ndarray:
+        return np.clip(quantities, self.lower, self.upper)
+
+    def to_dict(self, quantities: np.ndarray) -> dict:
+        """Riepilogo dei limiti sulle quantità finali"""
+        return {
+            "min_column": self.min_column,
+            "max_column": self.max_column,
+            "lock_column": self.lock_column,
+            "locked_rows": int(self.locked.sum()),
+            "rows_at_min": int(((quantities == self.lower) & self.movable & (self.lower > 0)).sum()),
+            "rows_at_max": int(((quantities == self.upper) & self.movable).sum()),
+            "respected": bool(((quantities >= self.lower) & (quantities <= self.upper)).all())
+        }
+
+
+def water_filling(quantities: np.ndarray, prices: np.ndarray, lower: np.ndarray, upper: np.ndarray,
+                  targets: np.ndarray, codes: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fattore λ_g di ogni gruppo con Σ_{i∈g} p_i × clip(λ_g × q_i, lower_i, upper_i) = targets[g]
+    (codes = gruppo di ogni riga, None = un solo gruppo; target NaN = λ 1).
+    Ogni termine è non decrescente in λ: bisezione vettorizzata su tutti i gruppi, poi
+    λ esatto sulle righe non saturate (Σ libere p·q × λ = target − Σ saturate p·limite).
+    Restituisce (λ, totale minimo, totale massimo raggiungibili): se il target è fuori
+    dall'intervallo λ satura tutte le righe al limite più vicino.
+    """
+    count = len(targets)
+    codes = np.zeros(len(quantities), dtype=np.int64) if codes is None else codes
+    targets = np.asarray(targets, dtype=np.float64)
+    constrained = ~np.isnan(targets)
+
+    def totals(values):
+        return np.bincount(codes, weights=prices * values, minlength=count)
+
+    # Righe che seguono λ; le altre (quantità 0 o prezzo non valido) restano al minimo
+    free = (quantities > 0) & (prices > 0)
+    fixed = totals(np.where(free, 0.0, lower))
+    unbounded = free & np.isinf(upper)
+    minimum = fixed + totals(np.where(free, lower, 0.0))
+    maximum = fixed + totals(np.where(free & ~unbounded, upper, 0.0))
+    maximum[np.bincount(codes, weights=unbounded, minlength=count) > 0] = np.inf
+
+    # λ con tutte le righe al massimo (limite finito) e le illimitate oltre il target
+    with np.errstate(divide="ignore", invalid="ignore"):
+        saturation = np.where(free & ~unbounded, upper / quantities, 0.0)
+        free_unbounded = totals(np.where(unbounded, quantities, 0.0))
+        reach = np.where(free_unbounded > 0, (targets - fixed) / free_unbounded, 0.0)
+    high = np.maximum(np.maximum(np.nan_to_num(reach), 0), 1.0)
+    np.maximum.at(high, codes, saturation)
+    low = np.zeros(count)
+
+    goal = np.where(constrained, targets, 0.0)
+    for _ in range(BISECTION_STEPS):
+        middle = (low + high) / 2
+        enough = totals(np.clip(middle[codes] * quantities, lower, upper)) >= goal
+        high = np.where(enough, middle, high)
+        low = np.where(enough, low, middle)
+
+    # Rifinitura esatta sulle righe non saturate al λ trovato
+    scaled = high[codes] * quantities
+    inside = free & (scaled > lower) & (scaled < upper)
+    saturated = totals(np.where(inside, 0.0, np.clip(scaled, lower, upper)))
+    slope = totals(np.where(inside, quantities, 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        exact = (goal - saturated) / slope
+    refine = (slope > 0) & (exact >= low) & (exact <= high)
+    factors = np.where(refine, exact, high)
+    factors[~constrained] = 1.0
+    return factors, minimum, maximum
@@ -0,0 +1,238 @@
+"""
+Metriche in formato Prometheus (GET /metrics) e log strutturati.
+
+Le metriche vivono nel processo del server: i worker restituiscono tempi per fase e per
+passo dell'algoritmo nel risultato, registrati qui con observe_correction. Con più processi
+uvicorn ognuno espone le proprie metriche.
+
+Log: livello EXCEL_LOG_LEVEL (default WARNING, quindi silenzioso), formato
+EXCEL_LOG_FORMAT "text" (default) oppure "json" (una riga JSON per evento).
+"""
+import json
+import logging
+import math
+import os
+import sys
+import threading
+from typing import Any, Dict, Iterable, Tuple
+
+LOG_LEVEL = os.getenv("EXCEL_LOG_LEVEL", "WARNING").upper()
+LOG_FORMAT = os.getenv("EXCEL_LOG_FORMAT", "text")
+
+# Limiti degli istogrammi: durate in secondi, dimensioni in byte
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (10e3, 100e3, 1e6, 5e6, 10e6, 25e6, 50e6, 100e6, 250e6)
+
+logger = logging.getLogger("excel_adjuster")
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            **getattr(record, "fields", {})
+        }
+        if record.exc_info:
+            event["exception"] = self.formatException(record.exc_info)
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+def configure_logging(level: str = None, log_format: str = None):
+    """
+    Configura il logger "excel_adjuster" su stderr (una sola volta per processo,
+    le chiamate successive aggiornano solo il livello). Da chiamare anche nei worker.
+    """
+    logger.setLevel((level or LOG_LEVEL).upper())
+    if any(getattr(handler, "_excel_adjuster", False) for handler in logger.handlers):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler._excel_adjuster = True
+    if (log_format or LOG_FORMAT) == "json":
+        handler.setFormatter(_JsonFormatter())
+    else:
+        handler.setFormatter(_TextFormatter("%(asctime)s %(levelname)s [%(process)d] %(message)s"))
+    logger.addHandler(handler)
+    logger.propagate = False
+
+
+def log_event(message: str, level: int = logging.INFO, **fields):
+    """Evento con campi strutturati (chiavi JSON o coppie chiave=valore)"""
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"fields": fields})
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Contatore crescente, con etichette opzionali"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}"
+
+
+class Histogram:
+    """Istogramma cumulativo (bucket, somma e conteggio), con etichette opzionali"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float], labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(self.labels, key, f'le="{_format_number(bound)}"')
+                yield f"{self.name}_bucket{labels} {count}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_number(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {counts[-1]}"
+
+
+class Gauge:
+    """Valore istantaneo letto da una funzione al momento dell'esposizione"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, read):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def samples(self):
+        yield f"{self.name} {_format_number(self.read())}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Testo nel formato di esposizione Prometheus 0.0.4"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "excel_requests_total", "Richieste HTTP per endpoint e codice di stato", ("endpoint", "status")))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "excel_request_duration_seconds", "Latenza delle richieste HTTP", DURATION_BUCKETS, ("endpoint",)))
+UPLOAD_SIZE = REGISTRY.register(Histogram(
+    "excel_upload_bytes", "Dimensione dei file caricati", SIZE_BUCKETS))
+CORRECTIONS = REGISTRY.register(Counter(
+    "excel_corrections_total", "Correzioni completate per tipo, solver ed esito",
+    ("kind", "solver", "exact")))
+PHASE_DURATION = REGISTRY.register(Histogram(
+    "excel_phase_duration_seconds", "Durata delle fasi (parsing, normalization, scaling, rounding, "
+    "compensation, writing)", DURATION_BUCKETS, ("phase",)))
+STEP_DURATION = REGISTRY.register(Histogram(
+    "excel_step_duration_seconds", "Durata dei passi dell'algoritmo (Passaggio 1-3, Step A/B/C, MILP)",
+    DURATION_BUCKETS, ("step",)))
+ROWS_PROCESSED = REGISTRY.register(Counter(
+    "excel_rows_processed_total", "Righe elaborate dal solver"))
+COMPENSATIONS = REGISTRY.register(Counter(
+    "excel_compensation_runs_total", "Chiusure del residuo per metodo", ("method",)))
+COMPENSATION_UNITS = REGISTRY.register(Counter(
+    "excel_compensation_units_total", "Unità spostate dalla compensazione"))
+
+
+def observe_request(endpoint: str, status: int, elapsed: float):
+    REQUESTS.inc(endpoint=endpoint, status=status)
+    REQUEST_DURATION.observe(elapsed, endpoint=endpoint)
+
+
+def observe_upload(size: int):
+    UPLOAD_SIZE.observe(size)
+
+
+def observe_correction(result: Dict[str, Any], timings: Dict[str, float] = None, kind: str = "full"):
+    """Registra tempi per fase e per passo, righe e compensazione di una correzione"""
+    for phase, elapsed in (timings or result.get("timings") or {}).items():
+        PHASE_DURATION.observe(elapsed, phase=phase)
+    for step, elapsed in (result.get("steps") or {}).items():
+        STEP_DURATION.observe(elapsed, step=step)
+    ROWS_PROCESSED.inc(result.get("rows_processed") or 0)
+    compensation = result.get("compensation")
+    if kind == "incremental":
+        compensation = (result.get("incremental") or {}).get("compensation")
+    if compensation:
+        COMPENSATIONS.inc(method=compensation.get("method", ""))
+        COMPENSATION_UNITS.inc(compensation.get("changes", 0))
+    solver = (result.get("solver") or {}).get("backend", "")
+    CORRECTIONS.inc(kind=kind, solver=solver, exact=str(bool(result.get("target_reached_exactly"))).lower())
+    log_event("correzione completata", kind=kind, solver=solver, rows=result.get("rows_processed"),
+              final_total=result.get("final_total"), target_total=result.get("target_total"),
+              residual=result.get("residual"))
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,594 @@
+import io
+import os
+import re
+import struct
+import tempfile
+import zipfile
+import zlib
+import posixpath
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Union
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, unescape
+
+import numpy as np
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+# Namespace usati nei file OOXML
+_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_NS_REL_DOC = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_NS_REL_PKG = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+_CELL_REF = re.compile(r"([A-Z]+)(\d+)")
+_ATTR_R = re.compile(r'\br="([^"]*)"')
+_ATTR_T = re.compile(r'\s+t="[^"]*"')
+_ATTR_SPANS = re.compile(r'\s+spans="[^"]*"')
+
+# Elementi che nello schema di workbook.xml seguono <calcPr>
+_AFTER_CALC_PR = ("oleSize", "customWorkbookViews", "pivotCaches", "smartTagPr",
+                  "smartTagTypes", "webPublishing", "fileRecoveryPr",
+                  "webPublishObjects", "extLst")
+
+CellValue = Union[int, float, str]
+
+# File corretto tenuto in memoria fino a questa dimensione, oltre passa su un file temporaneo
+OUTPUT_SPOOL_BYTES = int(os.getenv("EXCEL_OUTPUT_SPOOL_BYTES", 32 * 1024 * 1024))
+# Dimensione dei blocchi inviati al client
+OUTPUT_CHUNK_BYTES = 1024 * 1024
+
+
+def cell_ref(row: int, column: int) -> str:
+    """Riferimento Excel (es. 'H2') da riga e colonna 1-based"""
+    return f"{get_column_letter(column)}{row}"
+
+
+def _split_ref(ref: str):
+    match = _CELL_REF.fullmatch(ref)
+    if not match:
+        raise ValueError(f"Riferimento di cella non valido: {ref}")
+    return column_index_from_string(match.group(1)), int(match.group(2))
+
+
+@lru_cache(maxsize=None)
+def _column_index(ref: str) -> int:
+    """Indice di colonna 1-based dal riferimento di cella (es. 'H2' → 8)"""
+    return column_index_from_string(ref.rstrip("0123456789"))
+
+
+def _format_value(value: CellValue) -> str:
+    """Contenuto XML di una cella: formula se inizia con '=', altrimenti numero"""
+    if isinstance(value, str):
+        if not value.startswith('='):
+            raise ValueError(f"Sono supportati solo numeri e formule, non '{value}'")
+        return f"<f>{escape(value[1:])}</f>"
+    value = float(value)
+    if value.is_integer() and abs(value) < 1e15:
+        return f"<v>{int(value)}</v>"
+    return f"<v>{value!r}</v>"
+
+
+def column_patches(column: int, original, updated, first_row: int = 2, last_row: int = None) -> Dict[str, CellValue]:
+    """
+    Celle da riscrivere in una colonna: solo le righe il cui valore è cambiato.
+    original/updated sono array allineati che partono da first_row (celle vuote = NaN).
+    """
+    original = np.nan_to_num(np.asarray(original, dtype=np.float64), nan=0.0)
+    updated = np.asarray(updated, dtype=np.float64)
+    changed = np.flatnonzero(original != updated)
+    if last_row is not None:
+        changed = changed[changed + first_row <= last_row]
+
+    letter = get_column_letter(column)
+    return {f"{letter}{i + first_row}": value for i, value in zip(changed.tolist(), updated[changed].tolist())}
+
+
+# ---------------------------------------------------------------------------
+# Risoluzione del foglio e modifica di workbook.xml
+# ---------------------------------------------------------------------------
+
+def _sheet_parts(zin: zipfile.ZipFile) -> Dict[str, str]:
+    """Mappa nome foglio → percorso della parte XML dentro lo zip"""
+    workbook = ElementTree.fromstring(zin.read("xl/workbook.xml"))
+    rels = ElementTree.fromstring(zin.read("xl/_rels/workbook.xml.rels"))
+    targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(f"{{{_NS_REL_PKG}}}Relationship")}
+
+    parts = {}
+    for sheet in workbook.iter(f"{{{_NS_MAIN}}}sheet"):
+        target = targets.get(sheet.get(f"{{{_NS_REL_DOC}}}id"))
+        if target is None:
+            continue
+        if target.startswith("/"):
+            parts[sheet.get("name")] = target.lstrip("/")
+        else:
+            parts[sheet.get("name")] = posixpath.normpath(posixpath.join("xl", target))
+    return parts
+
+
+def _set_full_calc_on_load(xml: str) -> str:
+    """Imposta fullCalcOnLoad="1" (e calcolo automatico) in workbook.xml"""
+    match = re.search(r"<((?:\w+:)?)calcPr\b([^>]*?)(/?)>", xml)
+    if match:
+        prefix, attrs, closing = match.groups()
+        attrs = re.sub(r'\s+(fullCalcOnLoad|calcMode)="[^"]*"', "", attrs)
+        new_tag = f'<{prefix}calcPr{attrs} calcMode="auto" fullCalcOnLoad="1"{closing}>'
+        return xml[:match.start()] + new_tag + xml[match.end():]
+
+    prefix = re.search(r"<((?:\w+:)?)workbook\b", xml).group(1)
+    new_tag = f'<{prefix}calcPr fullCalcOnLoad="1"/>'
+    for name in _AFTER_CALC_PR:
+        position = xml.find(f"<{prefix}{name}")
+        if position != -1:
+            return xml[:position] + new_tag + xml[position:]
+    position = xml.rfind(f"</{prefix}workbook>")
+    return xml[:position] + new_tag + xml[position:]
+
+
+# ---------------------------------------------------------------------------
+# Patch delle celle nel foglio
+# ---------------------------------------------------------------------------
+
+def _patch_row(row_xml: str, row_number: int, cells: Dict[int, CellValue], cell_re, prefix: str) -> str:
+    """Sostituisce o inserisce le celle indicate (colonna → valore) in un elemento <row>"""
+    open_end = row_xml.find(">") + 1
+    if row_xml[open_end - 2] == "/":
+        # <row .../> vuota
+        open_tag = row_xml[:open_end - 2] + ">"
+        body = ""
+        close_tag = f"</{prefix}row>"
+    else:
+        open_tag = row_xml[:open_end]
+        close_start = row_xml.rfind("<")
+        body = row_xml[open_end:close_start]
+        close_tag = row_xml[close_start:]
+
+    # Celle da scrivere in ordine di colonna, consumate con un puntatore
+    pending = sorted(cells.items())
+    next_cell = 0
+    out = []
+    inserted = False
+    position = 0
+    last_column = 0
+    for match in cell_re.finditer(body):
+        if next_cell == len(pending):
+            break
+        attrs = match.group(1)
+        ref = _ATTR_R.search(attrs)
+        column = _column_index(ref.group(1)) if ref else last_column + 1
+        last_column = column
+        if column < pending[next_cell][0]:
+            continue
+
+        # Inserisce prima di questa cella quelle nuove con colonna inferiore
+        out.append(body[position:match.start()])
+        while next_cell < len(pending) and pending[next_cell][0] < column:
+            new_column, value = pending[next_cell]
+            out.append(f'<{prefix}c r="{cell_ref(row_number, new_column)}">{_format_value(value)}</{prefix}c>')
+            inserted = True
+            next_cell += 1
+
+        if next_cell < len(pending) and pending[next_cell][0] == column:
+            attrs = _ATTR_T.sub("", attrs)
+            if not ref:
+                attrs = f' r="{cell_ref(row_number, column)}"' + attrs
+            out.append(f"<{prefix}c{attrs}>{_format_value(pending[next_cell][1])}</{prefix}c>")
+            next_cell += 1
+        else:
+            out.append(match.group(0))
+        position = match.end()
+
+    out.append(body[position:])
+    for new_column, value in pending[next_cell:]:
+        out.append(f'<{prefix}c r="{cell_ref(row_number, new_column)}">{_format_value(value)}</{prefix}c>')
+        inserted = True
+
+    if inserted:
+        # spans è solo un suggerimento: va rimosso se si aggiungono celle
+        open_tag = _ATTR_SPANS.sub("", open_tag)
+    return open_tag + "".join(out) + close_tag
+
+
+def _expand_shared_formulas(xml: str, cells_by_row: Dict[int, Dict[int, CellValue]], cell_re, prefix: str) -> str:
+    """
+    Se una cella da sovrascrivere è la cella "master" di una formula condivisa,
+    converte le celle dipendenti in formule esplicite prima della patch.
+    """
+    from openpyxl.formula.translate import Translator
+
+    formula_re = re.compile(rf"<{prefix}f\b([^>]*?)(?:/>|>(.*?)</{prefix}f>)", re.S)
+
+    def shared_index(attrs):
+        if 't="shared"' not in attrs:
+            return None
+        si = re.search(r'\bsi="(\d+)"', attrs)
+        return si.group(1) if si else None
+
+    # Solo le celle master hanno l'attributo ref: si cercano direttamente quelle
+    masters = {}
+    master_re = re.compile(rf'<{prefix}f\b(?=[^>]*\bt="shared")(?=[^>]*\bref=")([^>]*)>(.*?)</{prefix}f>', re.S)
+    if 't="shared"' in xml:
+        for formula in master_re.finditer(xml):
+            si = shared_index(formula.group(1))
+            if si is None:
+                continue
+            cell_start = xml.rfind(f"<{prefix}c ", 0, formula.start())
+            ref = _ATTR_R.search(xml, cell_start, xml.find(">", cell_start))
+            if not ref:
+                continue
+            column, row = _split_ref(ref.group(1))
+            if column in cells_by_row.get(row, {}):
+                masters[si] = (ref.group(1), "=" + unescape(formula.group(2)))
+
+    if not masters:
+        return xml
+
+    def expand(match):
+        inner = match.group(2) or ""
+        formula = formula_re.search(inner)
+        si = shared_index(formula.group(1)) if formula else None
+        if si not in masters:
+            return match.group(0)
+        origin, text = masters[si]
+        ref = _ATTR_R.search(match.group(1)).group(1)
+        translated = Translator(text, origin=origin).translate_formula(ref)
+        inner = inner.replace(formula.group(0), f"<{prefix}f>{escape(translated[1:])}</{prefix}f>")
+        return f"<{prefix}c{match.group(1)}>{inner}</{prefix}c>"
+
+    return cell_re.sub(expand, xml)
+
+
+def _replace_existing_cells(xml: str, data_start: int, data_end: int,
+                            cells_by_row: Dict[int, Dict[int, CellValue]], prefix: str):
+    """
+    Sostituisce con una regex per colonna le celle che esistono già con attributo r.
+    Il lavoro in Python è proporzionale alle celle modificate, non alle righe del foglio.
+    Restituisce l'XML aggiornato e le celle rimaste da inserire.
+    """
+    by_column: Dict[int, Dict[int, CellValue]] = {}
+    for row, columns in cells_by_row.items():
+        for column, value in columns.items():
+            by_column.setdefault(column, {})[row] = value
+
+    data = xml[data_start:data_end]
+    for column, rows in by_column.items():
+        letter = get_column_letter(column)
+        pattern = re.compile(
+            rf'<{prefix}c\b([^>]*?\br="{letter}(\d+)"[^>]*?)(?:/>|>(?:.*?)</{prefix}c>)', re.S)
+
+        def replace(match, rows=rows):
+            row = int(match.group(2))
+            if row not in rows:
+                return match.group(0)
+            attrs = _ATTR_T.sub("", match.group(1)).rstrip("/")
+            return f"<{prefix}c{attrs}>{_format_value(rows.pop(row))}</{prefix}c>"
+
+        data = pattern.sub(replace, data)
+
+    leftover: Dict[int, Dict[int, CellValue]] = {}
+    for column, rows in by_column.items():
+        for row, value in rows.items():
+            leftover.setdefault(row, {})[column] = value
+    return xml[:data_start] + data + xml[data_end:], leftover
+
+
+def patch_sheet_xml(xml: str, cells: Dict[str, CellValue]) -> str:
+    """
+    Applica le modifiche (riferimento → valore) all'XML di un foglio.
+    Vengono riscritti solo gli elementi <c> interessati; il resto resta invariato.
+    """
+    prefix = re.search(r"<((?:\w+:)?)sheetData\b", xml).group(1)
+    cell_re = re.compile(rf"<{prefix}c\b([^>]*?)(?:/>|>(.*?)</{prefix}c>)", re.S)
+    row_re = re.compile(rf"<{prefix}row\b[^>]*?(?:/>|>.*?</{prefix}row>)", re.S)
+
+    cells_by_row: Dict[int, Dict[int, CellValue]] = {}
+    for ref, value in cells.items():
+        column, row = _split_ref(ref)
+        cells_by_row.setdefault(row, {})[column] = value
+
+    xml = _expand_shared_formulas(xml, cells_by_row, cell_re, prefix)
+
+    # Normalizza <sheetData/> vuoto
+    xml = re.sub(rf"<{prefix}sheetData\s*/>", f"<{prefix}sheetData></{prefix}sheetData>", xml, count=1)
+    data_start = xml.find(">", xml.find(f"<{prefix}sheetData")) + 1
+    data_end = xml.find(f"</{prefix}sheetData>")
+
+    # Passata veloce: sostituisce le celle già presenti, colonna per colonna
+    xml, cells_by_row = _replace_existing_cells(xml, data_start, data_end, cells_by_row, prefix)
+    if not cells_by_row:
+        return xml
+    data_end = xml.find(f"</{prefix}sheetData>")
+
+    # Righe da modificare in ordine crescente, consumate con un puntatore
+    targets = sorted(cells_by_row)
+    next_target = 0
+    out = [xml[:data_start]]
+    position = data_start
+    last_row = 0
+    for match in row_re.finditer(xml, data_start, data_end):
+        if next_target == len(targets):
+            break
+        ref = _ATTR_R.search(xml, match.start(), xml.find(">", match.start()))
+        row_number = int(ref.group(1)) if ref else last_row + 1
+        last_row = row_number
+        if row_number < targets[next_target]:
+            continue
+
+        out.append(xml[position:match.start()])
+        # Righe nuove che precedono questa
+        while next_target < len(targets) and targets[next_target] < row_number:
+            new_row = targets[next_target]
+            out.append(_patch_row(f'<{prefix}row r="{new_row}"/>', new_row, cells_by_row[new_row], cell_re, prefix))
+            next_target += 1
+
+        if next_target < len(targets) and targets[next_target] == row_number:
+            out.append(_patch_row(match.group(0), row_number, cells_by_row[row_number], cell_re, prefix))
+            next_target += 1
+        else:
+            out.append(match.group(0))
+        position = match.end()
+
+    out.append(xml[position:data_end])
+    for new_row in targets[next_target:]:
+        out.append(_patch_row(f'<{prefix}row r="{new_row}"/>', new_row, cells_by_row[new_row], cell_re, prefix))
+    out.append(xml[data_end:])
+    return "".join(out)
+
+
+def column_cells(src_path: str, sheet_name: str, column: int) -> List[Any]:
+    """
+    Contenuto grezzo delle celle di una colonna (dalla riga 2) letto direttamente
+    dall'XML del foglio con una regex, senza costruire le righe intere:
+    - "=formula" per le formule
+    - (formula, riga) per le celle di una formula condivisa: la formula della cella master
+      della stessa colonna, scritta per la riga indicata
+    - (formula, None) per formule matrice e tabelle dati
+    - float per i numeri, None per celle vuote, testo, booleani ed errori
+    """
+    with zipfile.ZipFile(src_path) as zin:
+        parts = _sheet_parts(zin)
+        if sheet_name not in parts:
+            raise ValueError(f"Foglio '{sheet_name}' non trovato")
+        xml = zin.read(parts[sheet_name]).decode("utf-8")
+
+    prefix = re.search(r"<((?:\w+:)?)sheetData\b", xml).group(1)
+    letter = get_column_letter(column)
+    # Una sola regex per cella: attributi, formula (attributi e testo) e valore
+    cell_re = re.compile(
+        rf'<{prefix}c\b(?P<attrs>[^>]*?\br="{letter}(?P<row>\d+)"[^>]*?)(?:/>|>'
+        rf'(?:<{prefix}f\b(?P<formula_attrs>[^>]*?)(?:/>|>(?P<formula>[^<]*)</{prefix}f>))?'
+        rf'(?:<{prefix}v>(?P<value>[^<]*)</{prefix}v>|<{prefix}v\s*/>)?.*?</{prefix}c>)', re.S)
+
+    cells: Dict[int, Any] = {}
+    masters: Dict[str, tuple] = {}
+    for match in cell_re.finditer(xml):
+        row = int(match.group("row"))
+        attrs = match.group("formula_attrs")
+        if attrs is not None:
+            text = "=" + unescape(match.group("formula") or "", {"&quot;": '"', "&apos;": "'"})
+            if 't="' not in attrs or 't="normal"' in attrs:
+                cells[row] = text
+            elif 't="shared"' in attrs:
+                si = re.search(r'\bsi="(\d+)"', attrs).group(1)
+                if text != "=":
+                    masters[si] = (text, row)
+                cells[row] = masters.get(si, ("", None))
+            else:
+                cells[row] = (text, None)
+        elif match.group("value") and ('t="' not in match.group("attrs") or 't="n"' in match.group("attrs")):
+            cells[row] = float(match.group("value"))
+
+    last = max(cells, default=1)
+    return [cells.get(row) for row in range(2, last + 1)]
+
+
+# ---------------------------------------------------------------------------
+# Scrittura dello zip con copia byte-per-byte dei membri non modificati
+# ---------------------------------------------------------------------------
+
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+_END_RECORD = struct.Struct("<4s4H2LH")
+
+
+def _raw_member(source, info: zipfile.ZipInfo) -> bytes:
+    """Header locale + dati compressi (+ data descriptor) di un membro, così come sono nel file"""
+    source.seek(info.header_offset)
+    header = source.read(_LOCAL_HEADER.size)
+    fields = _LOCAL_HEADER.unpack(header)
+    name_length, extra_length = fields[9], fields[10]
+    length = _LOCAL_HEADER.size + name_length + extra_length + info.compress_size
+    source.seek(info.header_offset)
+    data = source.read(length)
+    if info.flag_bits & 0x08:
+        descriptor = source.read(16)
+        data += descriptor if descriptor[:4] == b"PK\x07\x08" else descriptor[:12]
+    return data
+
+
+def _central_records(source, zin: zipfile.ZipFile):
+    """Record grezzi della central directory, nell'ordine originale"""
+    source.seek(zin.start_dir)
+    records = []
+    for _ in zin.infolist():
+        header = source.read(_CENTRAL_HEADER.size)
+        fields = _CENTRAL_HEADER.unpack(header)
+        variable = source.read(fields[10] + fields[11] + fields[12])
+        records.append(bytearray(header + variable))
+    return records
+
+
+def _needs_zip64(zin: zipfile.ZipFile) -> bool:
+    return len(zin.infolist()) >= 0xFFFF or any(
+        info.header_offset >= 0xFFFFFFFF or info.file_size >= 0xFFFFFFFF or info.compress_size >= 0xFFFFFFFF
+        for info in zin.infolist()
+    )
+
+
+def _write_replaced(out, info: zipfile.ZipInfo, payload: bytes):
+    """Scrive un membro modificato (deflate) e restituisce i campi per la central directory"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(payload) + compressor.flush()
+    crc = zlib.crc32(payload)
+    flags = info.flag_bits & 0x800  # mantiene solo il flag UTF-8 del nome
+    name = info.orig_filename.encode("utf-8" if flags else "cp437")
+    dos_date = (info.date_time[0] - 1980) << 9 | info.date_time[1] << 5 | info.date_time[2]
+    dos_time = info.date_time[3] << 11 | info.date_time[4] << 5 | (info.date_time[5] // 2)
+    out.write(_LOCAL_HEADER.pack(b"PK\x03\x04", 20, flags, zipfile.ZIP_DEFLATED, dos_time, dos_date,
+                                 crc, len(compressed), len(payload), len(name), 0))
+    out.write(name)
+    out.write(compressed)
+    return flags, crc, len(compressed), len(payload)
+
+
+def _rewrite_zip(src_path: str, out, replacements: Dict[str, bytes]):
+    """Fallback (zip64): riscrive lo zip ricomprimendo tutti i membri"""
+    with zipfile.ZipFile(src_path) as zin, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zout:
+        for info in zin.infolist():
+            data = replacements.get(info.filename)
+            zout.writestr(info, zin.read(info) if data is None else data, compress_type=zipfile.ZIP_DEFLATED)
+
+
+def write_patched_zip(src_path: str, out, replacements: Dict[str, bytes]):
+    """
+    Copia lo zip sorgente su out (file binario aperto) sostituendo solo i membri indicati.
+    Tutti gli altri membri sono copiati byte per byte senza decompressione.
+    """
+    with zipfile.ZipFile(src_path) as zin, open(src_path, "rb") as source:
+        if _needs_zip64(zin):
+            _rewrite_zip(src_path, out, replacements)
+            return
+
+        records = _central_records(source, zin)
+        base = out.tell()
+        for info, record in zip(zin.infolist(), records):
+            offset = out.tell() - base
+            if info.filename in replacements:
+                flags, crc, compress_size, file_size = _write_replaced(out, info, replacements[info.filename])
+                struct.pack_into("<2H", record, 8, flags, zipfile.ZIP_DEFLATED)
+                struct.pack_into("<3L", record, 16, crc, compress_size, file_size)
+            else:
+                out.write(_raw_member(source, info))
+            struct.pack_into("<L", record, 42, offset)
+
+        directory_offset = out.tell() - base
+        for record in records:
+            out.write(record)
+        directory_size = out.tell() - base - directory_offset
+        count = len(records)
+        out.write(_END_RECORD.pack(b"PK\x05\x06", 0, 0, count, count, directory_size,
+                                   directory_offset, len(zin.comment)))
+        out.write(zin.comment)
+
+
+def patch_workbook(src_path: str, out, patches: Dict[str, Dict[str, CellValue]], full_calc_on_load: bool = True):
+    """
+    Scrive una copia della cartella di lavoro .xlsx modificando solo le celle indicate.
+
+    patches: {nome foglio: {riferimento cella: valore}}; i valori stringa che iniziano
+    con '=' sono scritti come formule. out può essere un percorso o un file binario.
+    Il costo dipende dal numero di celle modificate, non dalla dimensione del file.
+    """
+    with zipfile.ZipFile(src_path) as zin:
+        parts = _sheet_parts(zin)
+        replacements = {}
+        for sheet_name, cells in patches.items():
+            if sheet_name not in parts:
+                raise ValueError(f"Foglio '{sheet_name}' non trovato")
+            if not cells:
+                continue
+            part = parts[sheet_name]
+            xml = zin.read(part).decode("utf-8")
+            replacements[part] = patch_sheet_xml(xml, cells).encode("utf-8")
+
+        if full_calc_on_load:
+            xml = zin.read("xl/workbook.xml").decode("utf-8")
+            replacements["xl/workbook.xml"] = _set_full_calc_on_load(xml).encode("utf-8")
+
+    if isinstance(out, str):
+        with open(out, "wb") as f:
+            write_patched_zip(src_path, f, replacements)
+    else:
+        write_patched_zip(src_path, out, replacements)
+
+
+class FileCorretto:
+    """
+    File scritto da BufferUscita, serializzabile tra processi: il contenuto in memoria
+    oppure il percorso del file temporaneo, eliminato dopo l'invio.
+    """
+
+    def __init__(self, content: bytes = None, path: str = None, size: int = 0):
+        self.content = content
+        self.path = path
+        self.size = size
+
+    def stream(self, chunk_size: int = OUTPUT_CHUNK_BYTES) -> Iterator[bytes]:
+        """
+        Blocchi del file per una risposta in streaming. Il file temporaneo viene aperto
+        subito e rimosso dal disco (su Windows a fine invio), quindi non resta anche se
+        il client si disconnette prima di leggerlo.
+        """
+        if self.path is None:
+            return iter([self.content])
+        source = open(self.path, "rb")
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass  # Windows: file aperto, si elimina dopo la chiusura
+
+        def chunks():
+            try:
+                for chunk in iter(lambda: source.read(chunk_size), b""):
+                    yield chunk
+            finally:
+                source.close()
+                self.discard()
+
+        return chunks()
+
+    def discard(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class BufferUscita(io.RawIOBase):
+    """
+    Destinazione di patch_workbook: in memoria fino a max_size byte, poi su un file
+    temporaneo con nome casuale (mkstemp, leggibile solo dall'utente del server).
+    """
+
+    def __init__(self, max_size: int = None):
+        super().__init__()
+        self.max_size = OUTPUT_SPOOL_BYTES if max_size is None else max_size
+        self._target = io.BytesIO()
+        self.path = None
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.path is None and self._target.tell() + len(data) > self.max_size:
+            fd, self.path = tempfile.mkstemp(prefix="excel_output_", suffix=".xlsx")
+            spilled = os.fdopen(fd, "wb")
+            spilled.write(self._target.getbuffer())
+            self._target = spilled
+        return self._target.write(data)
+
+    def tell(self) -> int:
+        return self._target.tell()
+
+    def detach_file(self) -> FileCorretto:
+        """Chiude il buffer e restituisce il file scritto"""
+        size = self._target.tell()
+        if self.path is None:
+            output = FileCorretto(content=self._target.getvalue(), size=size)
+        else:
+            output = FileCorretto(path=self.path, size=size)
+        self._target.close()
+        self.close()
+        return output
+
+    def discard(self):
+        """Chiude il buffer eliminando l'eventuale file temporaneo (scrittura fallita)"""
+        self._target.close()
+        self.close()
+        FileCorretto(path=self.path).discard()
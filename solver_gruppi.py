@@ -0,0 +1,313 @@
+"""
+Correzione con un target per gruppo di righe (es. categoria o magazzino): normalizzazione,
+scaling e arrotondamento restano un unico passaggio vettorizzato su tutte le righe, con
+totali e fattori per gruppo calcolati da np.bincount; il residuo esatto di ogni gruppo si
+chiude sulle sole righe del gruppo (segmenti contigui delle righe ordinate per gruppo).
+Il costo resta lineare nelle righe, non righe × gruppi.
+"""
+import logging
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from avanzamento import PhaseTracker
+from centesimi import exact_segment_dots, exact_total
+from lettura_excel import ColonneFoglio, read_sheet_columns
+from limiti import water_filling
+from metriche import logger
+from solver_semplice import ExcelSolverSemplice
+
+
+def _decimals(value: float) -> int:
+    return max(0, -Decimal(str(value)).as_tuple().exponent)
+
+
+def _merge_compensations(compensations: List[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """Esito complessivo delle compensazioni dei singoli gruppi (come ChiusuraResiduo.to_dict)"""
+    closures = [closure for closure in compensations if closure]
+    if not closures:
+        return None
+    merged = {key: sum(closure[key] for closure in closures)
+              for key in ("residual", "remaining", "changes", "rows_changed")}
+    merged.update(closed=all(closure["closed"] for closure in closures),
+                  reachable=all(closure["reachable"] for closure in closures),
+                  method="groups")
+    return merged
+
+
+class ExcelSolverGruppi(ExcelSolverSemplice):
+    """
+    ExcelSolverSemplice con un target per gruppo: group_targets associa a ogni valore della
+    colonna group_column il totale da raggiungere sulle sue righe. Le righe degli altri gruppi
+    e quelle con la cella vuota formano il "resto": con target_total (totale complessivo)
+    ricevono target_total − Σ target dei gruppi, senza restano invariate.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        sheet_name: str,
+        quantity_column: str,
+        price_column: str,
+        remaining_column: str,
+        group_column: str,
+        group_targets: Dict[str, float],
+        target_total: float = None,
+        data_rows: int = None,
+        sheet_data: ColonneFoglio = None,
+        phases: PhaseTracker = None,
+        backend: str = None,
+        min_column: str = None,
+        max_column: str = None,
+        lock_column: str = None
+    ):
+        if not group_targets:
+            raise ValueError("Indicare almeno un target per gruppo")
+        if backend not in (None, "greedy"):
+            raise ValueError("I target per gruppo sono supportati solo dal solver greedy")
+        self.group_column = group_column
+        self.group_targets = {str(label): float(value) for label, value in group_targets.items()}
+        # Righe di ogni gruppo durante la compensazione (vedi _compensation_rows)
+        self._group_rows = None
+        self.group_factors = None
+
+        if sheet_data is None:
+            limit_columns = [column for column in (min_column, max_column, lock_column) if column]
+            sheet_data = read_sheet_columns(
+                file_path, sheet_name,
+                [quantity_column, price_column, remaining_column, group_column] + limit_columns,
+                data_rows, label_columns=[group_column] + ([lock_column] if lock_column else [])
+            )
+        # ColonneSolver usa il target solo per la scala dei prezzi in interi: quella del
+        # target con più cifre decimali vale per tutti i gruppi (e per il resto)
+        targets = list(self.group_targets.values()) + ([target_total] if target_total is not None else [])
+        super().__init__(file_path, sheet_name, quantity_column, price_column, remaining_column,
+                         max(targets, key=_decimals), data_rows, sheet_data, phases, "greedy",
+                         shard_workers=1, min_column=min_column, max_column=max_column,
+                         lock_column=lock_column)
+        self.target_total = target_total
+
+    def _groups(self) -> Tuple[np.ndarray, List[Optional[str]], List[Optional[Decimal]]]:
+        """
+        Gruppo di ogni riga (i gruppi con target nell'ordine di group_targets, poi il resto),
+        etichetta e target esatto di ogni gruppo (None = resto invariato)
+        """
+        label_codes, labels = self.sheet_data.labels(self.group_column)
+        label_codes = label_codes[:len(self.data)]
+        index = {label: code for code, label in enumerate(labels)}
+        missing = [label for label in self.group_targets if label not in index]
+        if missing:
+            raise ValueError(f"Gruppi non presenti nella colonna '{self.group_column}': {', '.join(missing)}")
+        if any(value < 0 for value in self.group_targets.values()):
+            raise ValueError("I target per gruppo non possono essere negativi")
+
+        names = list(self.group_targets)
+        # Codice dell'etichetta → gruppo; l'ultimo elemento (indice -1, celle vuote) è il resto
+        mapping = np.full(len(labels) + 1, len(names), dtype=np.int64)
+        for group, label in enumerate(names):
+            mapping[index[label]] = group
+        codes = mapping[label_codes]
+
+        targets = [Decimal(str(value)) for value in self.group_targets.values()]
+        rest = None
+        if self.target_total is not None:
+            explicit = sum(targets, Decimal(0))
+            rest = Decimal(str(self.target_total)) - explicit
+            if rest < 0:
+                raise ValueError(f"La somma dei target per gruppo ({explicit}) supera il totale target {self.target_total}")
+            if rest != 0 and not (codes == len(names)).any():
+                raise ValueError(f"Il totale target {self.target_total} è diverso dalla somma "
+                                 f"dei target per gruppo ({explicit})")
+        return codes, names + [None], targets + [rest]
+
+    def _compensation_rows(self, all_rows: bool = False) -> np.ndarray:
+        """Righe valide per gli Step B e C, limitate al gruppo in compensazione"""
+        rows = self._group_rows
+        valid = (self.normalized_quantities[rows] > 0) & (self.data.units[rows] > 0)
+        if self.limits is not None:
+            valid &= self.limits.movable[rows]
+        return rows[valid]
+
+    def _group_totals(self, order: np.ndarray, bounds: np.ndarray) -> List[Decimal]:
+        """Totale esatto di ogni gruppo (segmenti di order delimitati da bounds)"""
+        data = self.data
+        if data.is_integer and data.units is not None:
+            totals = exact_segment_dots(data.quantities[order], data.units[order], bounds)
+            return [Decimal(total).scaleb(-data.scale) for total in totals]
+        return [exact_total(data.quantities[order[start:stop]], data.prices[order[start:stop]])
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def adjust(self) -> Dict[str, Any]:
+        """
+        Stessi passaggi di ExcelSolverSemplice.adjust con un fattore di scaling per gruppo
+        e la chiusura del residuo (Step B e C) gruppo per gruppo
+        """
+        try:
+            data = self.data
+            codes, labels, targets = self._groups()
+            count = len(targets)
+            logger.debug("=== CORREZIONE PER GRUPPI O(n) ===")
+            logger.debug("Colonna dei gruppi: %s, gruppi con target: %d", self.group_column, count - 1)
+            logger.debug("Righe processate: %d", len(data))
+
+            original_prices = data.prices.copy()
+            constrained = np.array([target is not None for target in targets])
+            target_values = np.array([float(target) if target is not None else np.nan for target in targets])
+
+            # 🔹 Passaggio 1: Normalizzazione
+            self.phases.start("normalization")
+            self.phases.step("passaggio_1")
+            negative_mask = data.quantities < 0
+            data.quantities[negative_mask] = 0
+            invalid_price_mask = data.prices <= 0
+            data.quantities[invalid_price_mask] = 0
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("  Quantità negative eliminate: %d righe", int(negative_mask.sum()))
+                logger.debug("  Prodotti con prezzi invalidi ignorati: %d righe", int(invalid_price_mask.sum()))
+
+            # Totale corrente di ogni gruppo in un solo passaggio
+            totals = np.bincount(codes, weights=data.quantities * data.prices, minlength=count)
+            # Gruppi con target ma totale 0: quantità minime come nel solver globale
+            empty = constrained & (totals == 0)
+            if empty.any():
+                logger.debug("  Gruppi con totale corrente = 0: %d, assegnando quantità minime...", int(empty.sum()))
+                minimal = empty[codes] & (data.prices > 0)
+                if self.limits is not None:
+                    minimal &= ~self.limits.locked
+                data.quantities[minimal] = 1.0
+                totals = np.bincount(codes, weights=data.quantities * data.prices, minlength=count)
+            current_total = float(totals.sum())
+
+            # 🔹 Passaggio 2: Scaling proporzionale per gruppo
+            self.phases.start("scaling")
+            self.phases.step("passaggio_2")
+            # q_i' = q_i × (target_g / T_g); 1 per il resto senza target e i gruppi senza righe valide
+            scalable = constrained & (totals > 0)
+            factors = np.ones(count)
+            factors[scalable] = target_values[scalable] / totals[scalable]
+            bounds_range = None
+            if self.limits is not None:
+                # Con i limiti per riga un fattore λ per gruppo con Σ p × clip(λ × q) = target
+                # (water-filling su tutti i gruppi insieme); le righe del resto solo entro i limiti
+                factors, minimum, maximum = water_filling(data.quantities, data.prices, self.limits.lower,
+                                                          self.limits.upper, np.where(scalable, target_values, np.nan),
+                                                          codes)
+                bounds_range = (minimum, maximum)
+            self.normalized_quantities = data.quantities.copy()
+            self.group_factors = factors
+            data.quantities = data.quantities * factors[codes]
+            if self.limits is not None:
+                data.quantities = self.limits.clip(data.quantities)
+            if logger.isEnabledFor(logging.DEBUG):
+                # Prodotto scalare su tutte le righe: solo con il log di debug attivo
+                logger.debug("  Totale dopo scaling: %.2f€", data.total())
+
+            # 🔹 Passaggio 3: Arrotondamento
+            self.phases.start("rounding")
+            self.phases.step("passaggio_3")
+            data.round()
+
+            # 🔹 Step A – Residuo esatto di ogni gruppo
+            self.phases.step("step_a")
+            # Righe ordinate per gruppo (ordinamento stabile, radix sort sui codici a 16 bit):
+            # ogni gruppo è il segmento order[bounds[g]:bounds[g + 1]]
+            order = np.argsort(codes.astype(np.uint16) if count < 2 ** 16 else codes, kind="stable")
+            bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=count))])
+            finals = self._group_totals(order, bounds)
+
+            self.phases.start("compensation")
+            compensations = [None] * count
+            if data.units is None:
+                logger.debug("  Prezzi o target con troppe cifre decimali: compensazione non applicabile")
+            else:
+                for group, (target, final) in enumerate(zip(targets, finals)):
+                    if target is None or target == final:
+                        continue
+                    logger.debug("  Gruppo %s: residuo %.2f€", labels[group], target - final)
+                    self._group_rows = order[bounds[group]:bounds[group + 1]]
+                    self.compensation = None
+                    # 🔹 Step B e Step C sulle sole righe del gruppo
+                    residual = self._apply_atomic_step(int((target - final).scaleb(data.scale)))
+                    if residual != 0:
+                        self._apply_discrete_compensation(residual)
+                    compensations[group] = self.compensation
+                self._group_rows = None
+            self.phases.stop()
+
+            finals = self._group_totals(order, bounds)
+            groups = []
+            for group, (label, target, final) in enumerate(zip(labels, targets, finals)):
+                rows = int(bounds[group + 1] - bounds[group])
+                if label is None and rows == 0:
+                    continue
+                group_residual = target - final if target is not None else Decimal(0)
+                limits = {}
+                if bounds_range is not None and target is not None:
+                    minimum, maximum = bounds_range[0][group], bounds_range[1][group]
+                    limits = {"min_total": float(minimum), "max_total": float(maximum) if np.isfinite(maximum) else None,
+                              "feasible": bool(minimum <= float(target) <= maximum)}
+                groups.append({
+                    "group": label,
+                    "target_total": float(target) if target is not None else None,
+                    "original_total": float(totals[group]),
+                    "final_total": float(final),
+                    "residual": float(group_residual),
+                    "rows": rows,
+                    "target_reached_exactly": abs(group_residual) < Decimal("0.01"),
+                    "compensation": compensations[group],
+                    **limits
+                })
+
+            exact_final = sum(finals, Decimal(0))
+            # Senza totale complessivo il resto conta con il suo totale (invariato)
+            target_decimal = (Decimal(str(self.target_total)) if self.target_total is not None else
+                              sum((target if target is not None else final for target, final in zip(targets, finals)),
+                                  Decimal(0)))
+            target_total = float(target_decimal)
+            residual = target_decimal - exact_final
+            final_total = float(exact_final)
+            final_error = abs(float(residual))
+            precision = ((target_total - final_error) / target_total * 100) if target_total > 0 else 0
+            self.compensation = _merge_compensations(compensations)
+
+            logger.debug("🎯 RISULTATO FINALE:")
+            logger.debug("  Target: %.2f€", target_total)
+            logger.debug("  Totale raggiunto: %.2f€", final_total)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("  Gruppi raggiunti: %d/%d",
+                             sum(group["target_reached_exactly"] for group in groups), len(groups))
+
+            result = {
+                "success": True,
+                "message": "Correzione per gruppi applicata con algoritmo O(n)",
+                "original_total": current_total,
+                "final_total": final_total,
+                "target_total": target_total,
+                "precision": precision,
+                "prices_unchanged": bool(np.array_equal(data.prices, original_prices)),
+                "formulas_preserved": True,
+                "no_negative_quantities": bool((data.quantities >= 0).all()),
+                "all_integers": data.is_integer,
+                "target_reached_exactly": final_error < 0.01 and all(group["target_reached_exactly"] for group in groups),
+                "residual": float(residual),
+                "rows_processed": len(data),
+                "algorithm": "grouped_O(n)",
+                "solver": {"backend": self.backend, "shards": 1},
+                "compensation": self.compensation,
+                "group_column": self.group_column,
+                "groups": groups,
+                "timings": dict(self.phases.timings),
+                "steps": dict(self.phases.steps)
+            }
+            if self.limits is not None:
+                result["bounds"] = {**self.limits.to_dict(data.quantities),
+                                    "feasible": all(group.get("feasible", True) for group in groups)}
+            return result
+
+        except Exception as e:
+            logger.exception("❌ Errore nella correzione per gruppi: %s", e)
+            return {
+                "success": False,
+                "error": str(e)
+            }
@@ -0,0 +1,289 @@
+import os
+import time
+from decimal import Decimal
+from typing import Optional
+
+import numpy as np
+
+from centesimi import MAX_SCALA, exact_dot, to_scaled_int
+
+# Motore MILP: 'auto' (scipy se disponibile, altrimenti pulp), 'scipy' o 'pulp'
+MILP_ENGINE = os.getenv("EXCEL_MILP_ENGINE", "auto")
+# Tempo massimo (secondi) concesso al solver MILP
+MILP_TIME_LIMIT = float(os.getenv("EXCEL_MILP_TIME_LIMIT", "10"))
+# Gap relativo accettato tra soluzione e limite inferiore dell'obiettivo
+MILP_GAP = float(os.getenv("EXCEL_MILP_GAP", "0.001"))
+# Righe lasciate libere al solver, provate in sequenza (None = tutte):
+# le altre restano all'arrotondamento più vicino
+MILP_CANDIDATES = (256, 4096, None)
+# Scostamento massimo di ogni riga dall'arrotondamento più vicino
+MILP_WINDOW = 16
+
+
+class MilpResult:
+    """
+    Esito del solver intero. status:
+    'optimal' / 'feasible' (soluzione esatta trovata, ottima o entro il tempo limite),
+    'infeasible' (target non raggiungibile con quantità intere),
+    'timeout', 'inexact', 'unavailable', 'error' (si usa la soluzione greedy)
+    """
+
+    def __init__(self, status: str, engine: str = None, quantities: np.ndarray = None,
+                 objective: float = None, elapsed: float = 0.0, message: str = None):
+        self.status = status
+        self.engine = engine
+        self.quantities = quantities
+        self.objective = objective
+        self.elapsed = elapsed
+        self.message = message
+
+    @property
+    def exact(self) -> bool:
+        return self.status in ("optimal", "feasible")
+
+    def to_dict(self):
+        return {
+            "status": self.status,
+            "engine": self.engine,
+            "objective": self.objective,
+            "elapsed": self.elapsed,
+            "message": self.message
+        }
+
+
+def integer_problem(prices, target_total):
+    """
+    Riporta prezzi e target a interi sulla stessa scala decimale:
+    Σ q_i × p_i = target  ⇔  Σ q_i × c_i = T con c_i, T interi.
+    Restituisce (c, T, scale) oppure None se i valori non sono esatti in MAX_SCALA cifre.
+    """
+    scaled = to_scaled_int(prices)
+    if scaled is None:
+        return None
+    units, price_scale = scaled
+
+    target = Decimal(str(target_total))
+    target_scale = max(0, -target.as_tuple().exponent)
+    scale = max(price_scale, target_scale)
+    if scale > MAX_SCALA:
+        return None
+
+    units = units * 10 ** (scale - price_scale)
+    return units, int(target.scaleb(scale)), scale
+
+
+def _engine(engine: str) -> Optional[str]:
+    if engine in ("auto", "scipy"):
+        try:
+            from scipy.optimize import milp  # noqa: F401
+            return "scipy"
+        except ImportError:
+            if engine == "scipy":
+                return None
+    try:
+        import pulp  # noqa: F401
+        return "pulp"
+    except ImportError:
+        return None
+
+
+def _solve_scipy(fractions, units, residual, lower, upper, time_limit, gap, cutoff):
+    from scipy.optimize import Bounds, LinearConstraint, milp
+    from scipy.sparse import csr_matrix, hstack, identity, vstack
+
+    n = len(fractions)
+    # Variabili: [x_1..x_n interi, d_1..d_n continui], d_i ≥ |x_i − f_i|
+    cost = np.concatenate([np.zeros(n), np.ones(n)])
+    integrality = np.concatenate([np.ones(n), np.zeros(n)])
+    bounds = Bounds(np.concatenate([lower, np.zeros(n)]), np.concatenate([upper, np.full(n, np.inf)]))
+
+    eye = identity(n, format="csr")
+    constraints = [
+        LinearConstraint(hstack([csr_matrix(units.astype(np.float64)), csr_matrix((1, n))]), residual, residual),
+        LinearConstraint(vstack([hstack([-eye, eye]), hstack([eye, eye])]),
+                         np.concatenate([-fractions, fractions]), np.inf)
+    ]
+    if cutoff is not None:
+        # Soluzione greedy già esatta: scarta i rami che non la migliorano
+        constraints.append(LinearConstraint(csr_matrix(cost), 0, cutoff))
+
+    res = milp(cost, integrality=integrality, bounds=bounds, constraints=constraints,
+               options={"time_limit": time_limit, "mip_rel_gap": gap, "disp": False})
+    if res.x is None:
+        status = {1: "timeout", 2: "infeasible"}.get(res.status, "error")
+        return status, None, res.message
+    return ("optimal" if res.status == 0 else "feasible"), res.x[:n], res.message
+
+
+def _solve_pulp(fractions, units, residual, lower, upper, time_limit, gap, warm_start):
+    import pulp
+
+    n = len(fractions)
+    problem = pulp.LpProblem("quantita", pulp.LpMinimize)
+    x = [pulp.LpVariable(f"x{i}", int(lower[i]), int(upper[i]), cat="Integer") for i in range(n)]
+    d = [pulp.LpVariable(f"d{i}", 0) for i in range(n)]
+    problem += pulp.lpSum(d)
+    problem += pulp.lpSum(int(units[i]) * x[i] for i in range(n)) == residual
+    for i in range(n):
+        problem += d[i] >= x[i] - float(fractions[i])
+        problem += d[i] >= float(fractions[i]) - x[i]
+
+    if warm_start is not None:
+        for var, value in zip(x, warm_start):
+            var.setInitialValue(int(value))
+
+    solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit, gapRel=gap,
+                               warmStart=warm_start is not None)
+    problem.solve(solver)
+    status = pulp.LpStatus[problem.status]
+    if status == "Infeasible":
+        return "infeasible", None, status
+    # sol_status distingue una soluzione ammissibile trovata entro il tempo limite
+    # dai valori parziali lasciati da CBC quando non ne ha trovata nessuna
+    if problem.sol_status not in (pulp.LpSolutionOptimal, pulp.LpSolutionIntegerFeasible):
+        return "timeout", None, status
+    values = [var.value() for var in x]
+    if any(value is None for value in values):
+        return "timeout", None, status
+    optimal = problem.sol_status == pulp.LpSolutionOptimal
+    return ("optimal" if optimal else "feasible"), np.array(values, dtype=np.float64), status
+
+
+def _rounded_base(scaled, units, target, upper):
+    """
+    Arrotondamento di partenza vicino all'ottimo continuo: parte da ⌊s_i⌋ e arrotonda per
+    eccesso le righe con parte frazionaria maggiore finché il totale non supera il target.
+    Il residuo rimasto è minore del prezzo della prima riga esclusa.
+    """
+    base = np.minimum(np.floor(scaled).astype(np.int64), upper)
+    remaining = target - exact_dot(base, units)
+    if remaining <= 0:
+        return base
+    order = np.argsort(-(scaled - base), kind="stable")
+    order = order[base[order] < upper[order]]
+    # Somma cumulativa in interi Python se int64 rischia l'overflow
+    steps = units[order]
+    cumulative = np.cumsum(steps if int(steps.max(initial=0)) * len(steps) < 2 ** 62 else steps.astype(object))
+    count = int(np.searchsorted(cumulative, remaining, side="right"))
+    base[order[:count]] += 1
+    return base
+
+
+def _candidate_rows(flip_cost, units, residual, size):
+    """
+    Le size righe più economiche da spostare, più quelle necessarie perché il MCD
+    dei loro prezzi divida il residuo (altrimenti il sottoproblema non ha soluzione)
+    """
+    order = np.argsort(flip_cost, kind="stable")
+    rows, rest = order[:size], order[size:]
+    divisor = int(np.gcd.reduce(units[rows]))
+    if residual % divisor == 0 or len(rest) == 0:
+        return rows
+    divisors = np.gcd.accumulate(np.concatenate([[divisor], units[rest]]))[1:]
+    reached = np.flatnonzero(residual % divisors == 0)
+    end = int(reached[0]) + 1 if len(reached) else len(rest)
+    # Solo le righe che abbassano il MCD servono a renderlo un divisore del residuo
+    lowers = np.flatnonzero(np.diff(np.concatenate([[divisor], divisors[:end]])) != 0)
+    return np.concatenate([rows, rest[lowers]])
+
+
+def solve_quantities(scaled, prices, target_total, warm_start=None,
+                     time_limit: float = None, engine: str = None, gap: float = None) -> MilpResult:
+    """
+    Risolve il problema intero "raggiungi il target al centesimo":
+    quantità intere q_i ≥ 0 con Σ q_i × p_i = target, minimizzando Σ |q_i − s_i|
+    dove s_i sono le quantità scalate (non arrotondate).
+    Le righe con prezzo non valido restano a 0. warm_start (es. soluzione greedy)
+    accelera la ricerca. La soluzione è verificata in aritmetica intera esatta:
+    se il solver non ne trova una entro time_limit lo stato non è 'exact'.
+    """
+    started = time.perf_counter()
+    time_limit = MILP_TIME_LIMIT if time_limit is None else time_limit
+    gap = MILP_GAP if gap is None else gap
+    engine = _engine(engine or MILP_ENGINE)
+    if engine is None:
+        return MilpResult("unavailable", message="Nessun solver MILP installato (scipy o pulp)")
+
+    scaled = np.asarray(scaled, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    valid = np.isfinite(prices) & (prices > 0)
+    problem = integer_problem(prices[valid], target_total)
+    if problem is None:
+        return MilpResult("unavailable", engine, message="Prezzi o target con troppe cifre decimali")
+    units, target, _ = problem
+
+    # Raggiungibilità: Σ q_i × c_i è sempre multiplo del MCD dei c_i
+    if len(units) == 0 or target < 0 or target % int(np.gcd.reduce(units)) != 0:
+        return MilpResult("infeasible", engine, elapsed=time.perf_counter() - started,
+                          message="Target non raggiungibile con quantità intere")
+
+    valid_scaled = np.clip(np.where(np.isfinite(scaled[valid]), scaled[valid], 0.0), 0, None)
+    # Nessuna riga può superare da sola il target
+    upper = target // units
+
+    # Il solver sposta q_i = base_i + x_i solo sulle righe candidate, così il vincolo
+    # ha un termine noto piccolo (il residuo) e i numeri restano ben condizionati
+    base = _rounded_base(valid_scaled, units, target, upper)
+    fractions = valid_scaled - base
+    residual = target - exact_dot(base, units)
+    # Costo del primo passo nella direzione "sbagliata": minimo per s_i vicino a x.5
+    flip_cost = 1.0 - 2.0 * np.abs(fractions)
+
+    start = None
+    if warm_start is not None:
+        start = np.clip(np.round(np.asarray(warm_start, dtype=np.float64)[valid]), 0, upper).astype(np.int64) - base
+        if exact_dot(start, units) != residual:
+            start = None
+
+    status, values, message = "infeasible", None, None
+    for size in MILP_CANDIDATES:
+        remaining = time_limit - (time.perf_counter() - started)
+        if remaining <= 0:
+            status = "timeout"
+            break
+        if size is None or size >= len(units):
+            rows = np.arange(len(units))
+        else:
+            rows = _candidate_rows(flip_cost, units, residual, size)
+        if start is not None:
+            # Le righe cambiate dalla greedy restano libere: la warm start è sempre ammissibile
+            rows = np.union1d(rows, np.flatnonzero(start))
+        window = MILP_WINDOW if start is None else max(MILP_WINDOW, int(np.abs(start[rows]).max()))
+        lower = np.maximum(-base[rows], -window)
+        high = np.minimum(upper[rows] - base[rows], window)
+        row_start = start[rows] if start is not None else None
+        cutoff = float(np.abs(row_start - fractions[rows]).sum()) + 1e-6 if row_start is not None else None
+        try:
+            if engine == "scipy":
+                status, row_values, message = _solve_scipy(
+                    fractions[rows], units[rows], residual, lower.astype(np.float64),
+                    high.astype(np.float64), remaining, gap, cutoff)
+            else:
+                status, row_values, message = _solve_pulp(
+                    fractions[rows], units[rows], residual, lower, high, remaining, gap, row_start)
+        except Exception as e:
+            return MilpResult("error", engine, elapsed=time.perf_counter() - started, message=str(e))
+        # Con il cutoff "infeasible" significa solo che la greedy è già ottima
+        if row_values is None and status == "infeasible" and cutoff is not None:
+            status, row_values = "optimal", row_start.astype(np.float64)
+        if row_values is not None:
+            values = np.zeros(len(units))
+            values[rows] = row_values
+            break
+        if status != "infeasible":
+            break
+
+    elapsed = time.perf_counter() - started
+    if values is None:
+        return MilpResult(status, engine, elapsed=elapsed, message=str(message))
+
+    offsets = np.round(values).astype(np.int64)
+    solution = base + offsets
+    if solution.min() < 0 or exact_dot(offsets, units) != residual:
+        return MilpResult("inexact", engine, elapsed=elapsed,
+                          message="La soluzione del solver non raggiunge il target esatto")
+
+    quantities = np.zeros(len(prices), dtype=np.int64)
+    quantities[valid] = solution
+    objective = float(np.abs(offsets - fractions).sum())
+    return MilpResult(status, engine, quantities, objective, elapsed, str(message))
@@ -1,8 +1,22 @@
+import logging
+import os
 import pandas as pd
 import numpy as np
 from typing import Dict, Any
 import warnings
 from decimal import Decimal, getcontext
+from lettura_excel import ColonneFoglio, read_sheet_columns
+from avanzamento import PhaseTracker
+from metriche import logger
+from colonne_solver import ColonneSolver
+from compensazione import close_residual
+from limiti import LimitiRighe, water_filling
+from solver_milp import solve_quantities
+from solver_shard import SHARD_MIN_ROWS, SHARD_WORKERS, CorrezioneAShard
+
+# Backend di risoluzione: 'greedy' (algoritmo O(n)) o 'milp' (ottimo intero, con greedy come fallback)
+SOLVER_BACKEND = os.getenv("EXCEL_SOLVER", "greedy")
+SOLVER_BACKENDS = ("greedy", "milp")
 
 # Imposta precisione alta per calcoli decimali
 getcontext().prec = 50
@@ -22,7 +36,14 @@ class ExcelSolverSemplice:
         price_column: str,
         remaining_column: str,
         target_total: float,
-        data_rows: int = None
+        data_rows: int = None,
+        sheet_data: ColonneFoglio = None,
+        phases: PhaseTracker = None,
+        backend: str = None,
+        shard_workers: int = None,
+        min_column: str = None,
+        max_column: str = None,
+        lock_column: str = None
     ):
         self.file_path = file_path
         self.sheet_name = sheet_name
@@ -31,274 +52,352 @@ class ExcelSolverSemplice:
         self.remaining_column = remaining_column
         self.target_total = target_total
         self.data_rows = data_rows
+        self.backend = backend or SOLVER_BACKEND
+        # Esito dell'ultima compensazione discreta (Step C)
+        self.compensation = None
+        self.normalized_quantities = None
+        self.scaling_factor = None
+        # Processi per la correzione a shard (solver_shard), usati oltre SHARD_MIN_ROWS righe
+        self.shard_workers = shard_workers or SHARD_WORKERS
+        self.shards = None
+        if self.backend not in SOLVER_BACKENDS:
+            raise ValueError(f"Solver non supportato: {self.backend} (valori ammessi: {', '.join(SOLVER_BACKENDS)})")
+        # Colonne opzionali dei limiti per riga (quantità minima, massima, riga bloccata)
+        limit_columns = [column for column in (min_column, max_column, lock_column) if column]
+        if limit_columns and self.backend == "milp":
+            raise ValueError("I limiti per riga (minimo, massimo, blocco) sono supportati solo dal solver greedy")
+        self.limits = None
         
-        # Carica il file Excel
-        self.df = pd.read_excel(file_path, sheet_name=sheet_name)
-        
-        # Limita il DataFrame alle prime data_rows righe se specificato
-        if data_rows is not None and data_rows < len(self.df):
-            self.df = self.df.iloc[:data_rows].copy()
-            print(f"Limitato il DataFrame alle prime {data_rows} righe")
+        # Avanzamento e tempi per fase (condivisibile con chi scrive il file)
+        self.phases = phases if phases is not None else PhaseTracker()
+        self.phases.start("parsing")
         
-        # Pulizia dei dati: sostituisci NaN e infiniti con 0
-        self.df[self.quantity_column] = self.df[self.quantity_column].fillna(0)
-        self.df[self.price_column] = self.df[self.price_column].fillna(0)
+        # Ingestione in streaming: legge solo le tre colonne necessarie
+        # (sheet_data può essere già stato estratto dal chiamante)
+        if sheet_data is None:
+            sheet_data = read_sheet_columns(
+                file_path, sheet_name,
+                [quantity_column, price_column, remaining_column] + limit_columns,
+                data_rows, label_columns=[lock_column] if lock_column else None
+            )
+        self.sheet_data = sheet_data
         
-        # Sostituisci infiniti con 0
-        self.df[self.quantity_column] = np.where(np.isfinite(self.df[self.quantity_column]), self.df[self.quantity_column], 0)
-        self.df[self.price_column] = np.where(np.isfinite(self.df[self.price_column]), self.df[self.price_column], 0)
+        # Solo quantità e prezzi in array contigui (le altre colonne non servono al solver);
+        # a shard la conversione dei prezzi in interi avviene nei processi degli shard
+        # (i limiti per riga richiedono la correzione in un solo processo)
+        rows = sheet_data.n_rows if data_rows is None else min(data_rows, sheet_data.n_rows)
+        self.sharded = self.shard_workers > 1 and rows >= SHARD_MIN_ROWS and not limit_columns
+        self.data = ColonneSolver.from_sheet(sheet_data, quantity_column, price_column, target_total, data_rows,
+                                             to_units=not self.sharded)
+        if data_rows is not None and data_rows < sheet_data.n_rows:
+            logger.debug("Limitati i dati alle prime %d righe", data_rows)
+        if limit_columns:
+            self.limits = LimitiRighe.from_sheet(sheet_data, self.data.quantities, self.data.rows,
+                                                 min_column, max_column, lock_column)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Limiti per riga: %s (%d righe bloccate)", ", ".join(limit_columns),
+                             int(self.limits.locked.sum()))
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """Quantità e prezzi correnti come DataFrame (copia, per compatibilità)"""
+        return self.data.to_frame(self.quantity_column, self.price_column)
+
+    def _exact_total(self) -> Decimal:
+        """
+        Totale Σ(q_i × p_i) esatto calcolato sugli array NumPy in interi scalati
+        """
+        return self.data.exact_total()
+
+    def _compensation_rows(self, all_rows: bool = False) -> np.ndarray:
+        """
+        Righe su cui chiudere il residuo: prezzo valido e giacenza dopo la normalizzazione,
+        comprese quelle che lo scaling ha arrotondato a 0 (le altre restano invariate).
+        A shard, salvo all_rows, solo le candidate di ogni shard (le più economiche e le più care).
+        """
+        data = self.data
+        if not all_rows and self.shards is not None and self.shards.candidates is not None:
+            return self.shards.candidates
+        valid = (self.normalized_quantities > 0) & (data.units > 0)
+        if self.limits is not None:
+            # Le righe bloccate (o con minimo = massimo) non si spostano
+            valid &= self.limits.movable
+        return np.flatnonzero(valid)
+
+    def _floor(self, rows):
+        """Quantità minima delle righe quando diminuiscono: almeno 1 (e il minimo della riga)"""
+        if self.limits is None:
+            return 1
+        return np.maximum(self.limits.lower[rows], 1).astype(np.int64)
+
+    def _close_residual(self, valid: np.ndarray, residual: int):
+        """close_residual sulle righe valid: le diminuzioni non scendono sotto _floor"""
+        units = self.data.units[valid]
+        upper = self.limits.upper[valid] if self.limits is not None else None
+        return close_residual(units, self.data.quantities[valid], residual,
+                              min_quantity=self._floor(valid), max_quantity=upper)
 
-    def _apply_discrete_compensation(self, residual_decimal, target_decimal):
+    def _release_shards(self):
+        """Riporta gli array degli shard in memoria privata e libera la memoria condivisa"""
+        if self.shards is not None:
+            self.shards.release()
+            self.shards = None
+
+    def _apply_atomic_step(self, residual: int):
+        """
+        Step B – Aggancio finale "atomico" in interi
+        Sposta sulla riga con il prezzo più alto che ha margine nella direzione del residuo
+        il numero intero di unità che più avvicina il totale al target (troncato verso zero;
+        in diminuzione la quantità resta ≥ 1 come nello Step C e, con i limiti per riga,
+        entro minimo e massimo della riga).
+        """
+        self.phases.step("step_b")
+        logger.debug("  Step B: Applicando aggancio finale atomico...")
+        data = self.data
+        valid = self._compensation_rows()
+        # Solo righe con margine nella direzione del residuo
+        if residual < 0:
+            valid = valid[data.quantities[valid] > self._floor(valid)]
+        elif self.limits is not None:
+            valid = valid[data.quantities[valid] < self.limits.upper[valid]]
+        if len(valid) == 0:
+            logger.debug("  Nessuna riga valida per l'aggancio atomico")
+            return residual
+
+        # Riga con prezzo più alto: minimizza l'effetto visivo della correzione
+        row = int(valid[np.argmax(data.units[valid])])
+        unit = int(data.units[row])
+        current_qty = int(data.quantities[row])
+        if residual > 0:
+            delta_q = residual // unit
+            if self.limits is not None:
+                delta_q = int(min(delta_q, self.limits.upper[row] - current_qty))
+        else:
+            delta_q = max(-(-residual // unit), int(self._floor(row)) - current_qty)
+        data.quantities[row] = current_qty + delta_q
+        residual -= delta_q * unit
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("  Riga con prezzo più alto: %.2f€ (riga %d)", data.prices[row], data.rows[row])
+            logger.debug("  Correzione atomica: Δq = %d", delta_q)
+            logger.debug("  Quantità: %d → %d", current_qty, current_qty + delta_q)
+            logger.debug("  Residuo dopo aggancio atomico: %s€", Decimal(residual).scaleb(-data.scale))
+        return residual
+
+    def _apply_discrete_compensation(self, residual: int):
         """
         Step C – Compensazione discreta per quantità intere
-        È matematicamente impossibile fallire: arriva sempre al valore più vicino realizzabile
+        Chiude il residuo esatto con il minor numero di unità spostate
+        (compensazione.close_residual). Se il target non è multiplo del MCD dei prezzi
+        arriva al valore realizzabile più vicino.
         """
-        print("    Applicando compensazione discreta...")
-        
-        # Converte il residuo in centesimi
-        residual_cents = int(residual_decimal * 100)
-        print(f"    Residuo in centesimi: {residual_cents}")
-        
-        if residual_cents == 0:
-            print("    Nessuna compensazione necessaria")
-            return
-        
-        # Trova le righe valide con prezzo > 0
-        valid_mask = (self.df[self.quantity_column] > 0) & (self.df[self.price_column] > 0)
-        valid_indices = self.df[valid_mask].index
-        
-        if len(valid_indices) == 0:
-            print("    Nessuna riga valida per compensazione")
+        self.phases.step("step_c")
+        logger.debug("  Step C: Applicando compensazione discreta per quantità intere...")
+        data = self.data
+
+        valid = self._compensation_rows()
+        if len(valid) == 0:
+            logger.debug("    Nessuna riga valida per compensazione")
             return
+        units = data.units[valid]
+        if logger.isEnabledFor(logging.DEBUG):
+            # MCD su tutte le righe candidate: calcolato solo con il log di debug attivo
+            logger.debug("    Residuo: %d unità da %s€", residual, Decimal(1).scaleb(-data.scale))
+            logger.debug("    Righe valide per compensazione: %d", len(valid))
+            logger.debug("    Passo minimo (MCD): %d unità", int(np.gcd.reduce(units)))
+
+        closure = self._close_residual(valid, residual)
+        if not closure.closed and self.shards is not None:
+            logger.debug("    Righe candidate degli shard insufficienti: compensazione su tutte le righe")
+            valid = self._compensation_rows(all_rows=True)
+            closure = self._close_residual(valid, residual)
+        data.quantities[valid] += closure.delta
+        self.compensation = closure.to_dict()
+
+        if not closure.reachable:
+            logger.debug("    Target non multiplo del MCD dei prezzi: raggiunto il valore più vicino")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("    Unità spostate: %d su %d righe (%s)", closure.changes,
+                         self.compensation["rows_changed"], closure.method)
+            logger.debug("    Residuo finale: %s€", Decimal(closure.remaining).scaleb(-data.scale))
+
+    def _solve_milp(self, scaled_quantities) -> Dict[str, Any]:
+        """
+        Sostituisce le quantità greedy con la soluzione intera a minima distanza
+        dalle quantità scalate, se il solver ne trova una esatta entro il tempo limite.
+        La soluzione greedy (se già esatta) fa da punto di partenza.
+        """
+        self.phases.step("milp")
+        logger.debug("  Solver MILP: ricerca delle quantità intere più vicine allo scaling...")
+        data = self.data
+        result = solve_quantities(scaled_quantities, data.prices, self.target_total,
+                                  warm_start=data.quantities.astype(float))
         
-        # Ordina le righe per prezzo crescente (più economiche per prime)
-        sorted_indices = self.df.loc[valid_indices, self.price_column].sort_values().index
-        prices_cents = (self.df.loc[sorted_indices, self.price_column] * 100).astype(int)
-        
-        print(f"    Righe valide per compensazione: {len(sorted_indices)}")
-        print(f"    Prezzo minimo: {prices_cents.min()} centesimi")
-        print(f"    Prezzo massimo: {prices_cents.max()} centesimi")
-        
-        # Calcola il GCD dei prezzi in centesimi per il passo minimo
-        from math import gcd
-        from functools import reduce
-        
-        def gcd_list(numbers):
-            return reduce(gcd, numbers)
-        
-        step_min = gcd_list(prices_cents.tolist())
-        print(f"    Passo minimo (GCD): {step_min} centesimi")
-        
-        # Applica la compensazione discreta
-        remaining_residual = residual_cents
-        
-        if remaining_residual > 0:
-            # Aumenta le quantità delle righe più economiche
-            print(f"    Aumentando quantità per {remaining_residual} centesimi...")
-            for idx in sorted_indices:
-                if remaining_residual <= 0:
-                    break
-                
-                price_cents = int(self.df.loc[idx, self.price_column] * 100)
-                current_qty = int(self.df.loc[idx, self.quantity_column])
-                
-                # Calcola quante unità possiamo aggiungere
-                max_increase = remaining_residual // price_cents
-                if max_increase > 0:
-                    new_qty = current_qty + max_increase
-                    self.df.loc[idx, self.quantity_column] = new_qty
-                    remaining_residual -= max_increase * price_cents
-                    print(f"      Riga {idx}: {current_qty} → {new_qty} (+{max_increase})")
-        
-        elif remaining_residual < 0:
-            # Riduci le quantità delle righe più economiche
-            remaining_residual = abs(remaining_residual)
-            print(f"    Riducendo quantità per {remaining_residual} centesimi...")
-            for idx in sorted_indices:
-                if remaining_residual <= 0:
-                    break
-                
-                price_cents = int(self.df.loc[idx, self.price_column] * 100)
-                current_qty = int(self.df.loc[idx, self.quantity_column])
-                
-                # Calcola quante unità possiamo ridurre (minimo 1)
-                max_decrease = min(current_qty - 1, remaining_residual // price_cents)
-                if max_decrease > 0:
-                    new_qty = current_qty - max_decrease
-                    self.df.loc[idx, self.quantity_column] = new_qty
-                    remaining_residual -= max_decrease * price_cents
-                    print(f"      Riga {idx}: {current_qty} → {new_qty} (-{max_decrease})")
-        
-        # Verifica il risultato finale
-        final_total_decimal = Decimal('0')
-        for idx, row in self.df.iterrows():
-            qty = Decimal(str(int(row[self.quantity_column])))  # Forza interi
-            price = Decimal(str(row[self.price_column]))
-            final_total_decimal += qty * price
-        
-        final_residual = target_decimal - final_total_decimal
-        print(f"    Totale finale dopo compensazione: {final_total_decimal:.2f}€")
-        print(f"    Residuo finale: {final_residual:.2f}€")
-        print(f"    Residuo in centesimi: {int(final_residual * 100)}")
+        fallback = not result.exact
+        if fallback:
+            logger.debug("  Solver MILP: %s (%s), mantenuta la soluzione greedy", result.status, result.message)
+        else:
+            data.quantities = np.asarray(result.quantities).astype(np.int64)
+            logger.debug("  Solver MILP: %s in %.2fs, scostamento totale %.2f", result.status, result.elapsed,
+                         result.objective)
         
-        # Forza tutte le quantità a essere intere
-        self.df[self.quantity_column] = self.df[self.quantity_column].astype(int)
-        print("    Tutte le quantità convertite a numeri interi")
+        info = result.to_dict()
+        info["fallback"] = fallback
+        return info
 
     def adjust(self) -> Dict[str, Any]:
         """
         Algoritmo matematicamente garantito O(n) che non può fallire
         """
         try:
-            print("=== ALGORITMO MATEMATICAMENTE GARANTITO O(n) ===")
-            print(f"Target: {self.target_total}€")
-            print(f"Righe processate: {len(self.df)}")
+            data = self.data
+            logger.debug("=== ALGORITMO MATEMATICAMENTE GARANTITO O(n) ===")
+            logger.debug("Target: %s€", self.target_total)
+            logger.debug("Righe processate: %d", len(data))
             
             # Salva i prezzi originali (per riferimento)
-            original_prices = self.df[self.price_column].copy()
+            original_prices = data.prices.copy()
+            if self.sharded:
+                # Fino alla compensazione gli array stanno nella memoria condivisa degli shard
+                self.shards = CorrezioneAShard(data, self.shard_workers)
+                logger.debug("Correzione a shard su %d processi", self.shard_workers)
             
             # 🔹 Passaggio 1: Normalizzazione
-            print("🔹 Passaggio 1: Normalizzazione")
+            self.phases.start("normalization")
+            self.phases.step("passaggio_1")
+            logger.debug("🔹 Passaggio 1: Normalizzazione")
             
-            # Tutte le quantità negative → 0
-            negative_mask = self.df[self.quantity_column] < 0
-            negative_count = negative_mask.sum()
+            if self.shards is not None:
+                negative_count, invalid_count, current_total = self.shards.normalize()
+            else:
+                # Tutte le quantità negative → 0
+                negative_mask = data.quantities < 0
+                negative_count = int(negative_mask.sum())
+                data.quantities[negative_mask] = 0
+                # Tutti i prezzi negativi o nulli → ignorati (imposta quantità a 0)
+                invalid_price_mask = data.prices <= 0
+                invalid_count = int(invalid_price_mask.sum())
+                data.quantities[invalid_price_mask] = 0
+                # Calcola il totale corrente T = Σ(q_i × p_i)
+                current_total = data.total()
             if negative_count > 0:
-                self.df.loc[negative_mask, self.quantity_column] = 0
-                print(f"  Quantità negative eliminate: {negative_count} righe")
-            
-            # Tutti i prezzi negativi o nulli → ignorati (imposta quantità a 0)
-            invalid_price_mask = (self.df[self.price_column] <= 0) | (~np.isfinite(self.df[self.price_column]))
-            invalid_count = invalid_price_mask.sum()
+                logger.debug("  Quantità negative eliminate: %d righe", negative_count)
             if invalid_count > 0:
-                self.df.loc[invalid_price_mask, self.quantity_column] = 0
-                print(f"  Prodotti con prezzi invalidi ignorati: {invalid_count} righe")
-            
-            # Calcola il totale corrente T = Σ(q_i × p_i)
-            current_total = (self.df[self.quantity_column] * self.df[self.price_column]).sum()
-            print(f"  Totale corrente dopo normalizzazione: {current_total:.2f}€")
+                logger.debug("  Prodotti con prezzi invalidi ignorati: %d righe", invalid_count)
+            logger.debug("  Totale corrente dopo normalizzazione: %.2f€", current_total)
             
             # Se T = 0: assegna tutte le quantità a 1 (o un valore minimo) e ricalcola
             if current_total == 0:
-                print("  Totale corrente = 0, assegnando quantità minime...")
-                valid_mask = (self.df[self.price_column] > 0) & np.isfinite(self.df[self.price_column])
-                self.df.loc[valid_mask, self.quantity_column] = 1.0
-                current_total = (self.df[self.quantity_column] * self.df[self.price_column]).sum()
-                print(f"  Nuovo totale corrente: {current_total:.2f}€")
+                logger.debug("  Totale corrente = 0, assegnando quantità minime...")
+                minimal = data.prices > 0
+                if self.limits is not None:
+                    minimal &= ~self.limits.locked
+                data.quantities[minimal] = 1.0
+                current_total = data.total()
+                logger.debug("  Nuovo totale corrente: %.2f€", current_total)
             
             # 🔹 Passaggio 2: Scaling proporzionale
-            print("🔹 Passaggio 2: Scaling proporzionale")
+            self.phases.start("scaling")
+            self.phases.step("passaggio_2")
+            logger.debug("🔹 Passaggio 2: Scaling proporzionale")
             
             # Applica un fattore moltiplicativo globale: q_i' = q_i × (target / T)
             scaling_factor = self.target_total / current_total
-            print(f"  Fattore di scaling: {scaling_factor:.6f}")
+            bounds_info = None
+            if self.limits is not None:
+                # Con i limiti per riga: q_i' = clip(λ × q_i, min_i, max_i) con λ tale che
+                # il totale sia il target (il residuo si ridistribuisce sulle righe non saturate)
+                limits = self.limits
+                factors, minimum, maximum = water_filling(data.quantities, data.prices, limits.lower,
+                                                          limits.upper, np.array([self.target_total]))
+                scaling_factor = float(factors[0])
+                lowest, highest = float(minimum[0]), float(maximum[0])
+                # Massimo illimitato (righe senza quantità massima) → None
+                bounds_info = {"min_total": lowest, "max_total": highest if np.isfinite(highest) else None,
+                               "feasible": lowest <= self.target_total <= highest}
+                if not bounds_info["feasible"]:
+                    logger.debug("  Target fuori dai limiti per riga (%.2f€ – %.2f€)", lowest, highest)
+            logger.debug("  Fattore di scaling: %.6f", scaling_factor)
+            # Stato per le correzioni incrementali (vedi incrementale.StatoCorrezione)
+            self.normalized_quantities = data.quantities.copy()
+            self.scaling_factor = scaling_factor
             
-            # Applica il fattore a tutte le quantità
-            self.df[self.quantity_column] = self.df[self.quantity_column] * scaling_factor
-            
-            # Verifica che il totale sia esattamente uguale al target in aritmetica reale
-            scaled_total = (self.df[self.quantity_column] * self.df[self.price_column]).sum()
-            print(f"  Totale dopo scaling: {scaled_total:.2f}€")
-            print(f"  Errore in aritmetica reale: {abs(scaled_total - self.target_total):.10f}€")
+            if self.shards is None:
+                # Applica il fattore a tutte le quantità
+                data.quantities = data.quantities * scaling_factor
+                if self.limits is not None:
+                    data.quantities = self.limits.clip(data.quantities)
+                scaled_total = data.total()
             
             # 🔹 Passaggio 3: Correzione iterativa (solo per arrotondamento)
-            print("🔹 Passaggio 3: Correzione iterativa per quantità intere")
+            self.phases.start("rounding")
+            self.phases.step("passaggio_3")
+            logger.debug("🔹 Passaggio 3: Correzione iterativa per quantità intere")
             
-            # Arrotonda tutte le quantità
-            rounded_quantities = self.df[self.quantity_column].round()
-            self.df[self.quantity_column] = rounded_quantities
+            if self.shards is None:
+                # Arrotonda tutte le quantità (da qui in poi interi int64)
+                data.round()
+            else:
+                # Scaling e arrotondamento insieme in ogni shard (e prezzi in interi)
+                scaled_total = self.shards.scale_and_round(scaling_factor, self.target_total)
             
-            # 🔹 Step A – Calcolo del residuo in decimale esatto
-            print("  Step A: Calcolo del residuo in decimale esatto")
+            # Verifica che il totale scalato sia uguale al target in aritmetica reale
+            logger.debug("  Totale dopo scaling: %.2f€", scaled_total)
+            logger.debug("  Errore in aritmetica reale: %.10f€", abs(scaled_total - self.target_total))
             
-            # Calcola totale usando Decimal per precisione esatta
-            total_decimal = Decimal('0')
-            for idx, row in self.df.iterrows():
-                qty = Decimal(str(row[self.quantity_column]))
-                price = Decimal(str(row[self.price_column]))
-                total_decimal += qty * price
+            # 🔹 Step A – Calcolo del residuo in decimale esatto
+            self.phases.step("step_a")
+            logger.debug("  Step A: Calcolo del residuo in decimale esatto")
             
-            # Calcola il residuo in decimale esatto
             target_decimal = Decimal(str(self.target_total))
+            total_decimal = self._exact_total()
             residual_decimal = target_decimal - total_decimal
-            residual_error = float(residual_decimal)
+            logger.debug("  Totale calcolato con Decimal: %.2f€", total_decimal)
+            logger.debug("  Residuo in decimale esatto: %.2f€", residual_decimal)
             
-            print(f"  Totale calcolato con Decimal: {total_decimal:.2f}€")
-            print(f"  Residuo in decimale esatto: {residual_decimal:.2f}€")
+            self.phases.start("compensation")
+            if data.units is None:
+                logger.debug("  Prezzi o target con troppe cifre decimali: compensazione non applicabile")
+            elif residual_decimal != 0:
+                # Residuo in unità intere (es. centesimi) sulla scala dei prezzi
+                residual = int(residual_decimal.scaleb(data.scale))
+                # 🔹 Step B – Aggancio finale "atomico"
+                residual = self._apply_atomic_step(residual)
+                # 🔹 Step C – Compensazione discreta (se necessario)
+                if residual != 0:
+                    self._apply_discrete_compensation(residual)
+            self._release_shards()
             
-            # 🔹 Step B – Aggancio finale "atomico"
-            if abs(residual_decimal) > Decimal('0.01'):  # Se l'errore è > 1 centesimo
-                print("  Step B: Applicando aggancio finale atomico...")
-                
-                # Trova la riga con il prezzo più alto per minimizzare l'effetto visivo
-                valid_mask = (self.df[self.quantity_column] > 0) & (self.df[self.price_column] > 0)
-                valid_indices = self.df[valid_mask].index
-                
-                if len(valid_indices) > 0:
-                    # Trova la riga con prezzo più alto
-                    max_price_idx = self.df.loc[valid_indices, self.price_column].idxmax()
-                    max_price = Decimal(str(self.df.loc[max_price_idx, self.price_column]))
-                    
-                    # Calcola la correzione atomica
-                    delta_q = residual_decimal / max_price
-                    current_qty = Decimal(str(self.df.loc[max_price_idx, self.quantity_column]))
-                    new_qty = current_qty + delta_q
-                    
-                    print(f"  Riga con prezzo più alto: {max_price:.2f}€")
-                    print(f"  Correzione atomica: Δq = {delta_q:.6f}")
-                    print(f"  Quantità originale: {current_qty}")
-                    print(f"  Quantità corretta: {new_qty:.6f}")
-                    
-                    # Applica la correzione atomica
-                    self.df.loc[max_price_idx, self.quantity_column] = float(new_qty)
-                    
-                    # Verifica che il totale sia ora esatto
-                    total_after_atomic = Decimal('0')
-                    for idx, row in self.df.iterrows():
-                        qty = Decimal(str(row[self.quantity_column]))
-                        price = Decimal(str(row[self.price_column]))
-                        total_after_atomic += qty * price
-                    
-                    final_residual = target_decimal - total_after_atomic
-                    print(f"  Totale dopo aggancio atomico: {total_after_atomic:.2f}€")
-                    print(f"  Residuo finale: {final_residual:.2f}€")
-                    
-                    # Se il residuo è ancora significativo, applica Step C
-                    if abs(final_residual) > Decimal('0.01'):
-                        print("  Step C: Applicando compensazione discreta per quantità intere...")
-                        self._apply_discrete_compensation(final_residual, target_decimal)
+            solver_info = {"backend": self.backend, "shards": self.shard_workers if self.sharded else 1}
+            if self.backend == "milp":
+                # Quantità continue prima dell'arrotondamento come riferimento
+                solver_info.update(self._solve_milp(self.normalized_quantities * scaling_factor))
             
-            # 🔹 Step C – Compensazione discreta (se necessario)
-            # Verifica se le quantità devono essere intere
-            final_total = (self.df[self.quantity_column] * self.df[self.price_column]).sum()
-            final_error = abs(final_total - self.target_total)
+            self.phases.stop()
             
-            # Se l'errore è ancora significativo e vogliamo quantità intere
-            if abs(final_error) > 0.01:
-                print("  Step C: Applicando compensazione discreta per quantità intere...")
-                self._apply_discrete_compensation(Decimal(str(final_error)), Decimal(str(self.target_total)))
-            
-            # Calcola il totale finale
-            final_total = (self.df[self.quantity_column] * self.df[self.price_column]).sum()
-            final_error = abs(final_total - self.target_total)
+            # Scarto esatto dal target (target − Σ q_i × p_i in interi scalati)
+            exact_final = self._exact_total()
+            residual = target_decimal - exact_final
+            final_total = float(exact_final)
+            final_error = abs(float(residual))
             precision = ((self.target_total - final_error) / self.target_total * 100) if self.target_total > 0 else 0
             
-            print(f"🎯 RISULTATO FINALE:")
-            print(f"  Target: {self.target_total:.2f}€")
-            print(f"  Totale raggiunto: {final_total:.2f}€")
-            print(f"  Errore: {final_error:.2f}€")
-            print(f"  Precisione: {precision:.2f}%")
+            logger.debug("🎯 RISULTATO FINALE:")
+            logger.debug("  Target: %.2f€", self.target_total)
+            logger.debug("  Totale raggiunto: %.2f€", final_total)
+            logger.debug("  Errore: %.2f€", final_error)
+            logger.debug("  Precisione: %.2f%%", precision)
             
             # Verifiche finali
-            no_negative_quantities = (self.df[self.quantity_column] >= 0).all()
-            all_integers = self.df[self.quantity_column].dtype in ['int64', 'int32'] or (self.df[self.quantity_column] % 1 == 0).all()
-            prices_unchanged = (self.df[self.price_column] == original_prices).all()
+            no_negative_quantities = bool((data.quantities >= 0).all())
+            all_integers = data.is_integer or bool((data.quantities % 1 == 0).all())
+            prices_unchanged = bool(np.array_equal(data.prices, original_prices))
             
-            print(f"  Quantità negative: {not no_negative_quantities}")
-            print(f"  Tutte quantità intere: {all_integers}")
-            print(f"  Prezzi invariati: {prices_unchanged}")
+            logger.debug("  Quantità negative: %s", not no_negative_quantities)
+            logger.debug("  Tutte quantità intere: %s", all_integers)
+            logger.debug("  Prezzi invariati: %s", prices_unchanged)
             
-            return {
+            result = {
                 "success": True,
                 "message": "Correzione applicata con algoritmo matematicamente garantito O(n) - Non può fallire",
                 "original_total": current_total,
@@ -310,14 +409,23 @@ class ExcelSolverSemplice:
                 "no_negative_quantities": no_negative_quantities,
                 "all_integers": all_integers,
                 "target_reached_exactly": final_error < 0.01,
-                "algorithm": "mathematically_guaranteed_O(n)"
+                "residual": float(residual),
+                "rows_processed": len(data),
+                "algorithm": "mathematically_guaranteed_O(n)",
+                "solver": solver_info,
+                "compensation": self.compensation,
+                "timings": dict(self.phases.timings),
+                "steps": dict(self.phases.steps)
             }
+            if self.limits is not None:
+                result["bounds"] = {**self.limits.to_dict(data.quantities), **bounds_info}
+            return result
             
         except Exception as e:
-            print(f"❌ Errore nell'algoritmo: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("❌ Errore nell'algoritmo: %s", e)
             return {
                 "success": False,
                 "error": str(e)
             }
+        finally:
+            self._release_shards()
@@ -0,0 +1,186 @@
+"""
+Correzione a shard per fogli con milioni di righe: normalizzazione, conversione dei prezzi
+in interi, scaling e arrotondamento di ogni blocco di righe in un processo separato, sugli
+stessi array in memoria condivisa (multiprocessing.shared_memory, nessuna copia).
+La chiusura del residuo resta un unico passaggio globale nel processo del solver, prima
+sulle righe candidate di ogni shard e, se non basta, su tutte: il totale resta esatto al
+centesimo come nella correzione in un solo processo.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from centesimi import MAX_SCALA, decimal_scale
+from colonne_solver import ColonneSolver
+
+# Processi per gli shard (0 = uno per core; 1 = correzione in un solo processo)
+SHARD_WORKERS = int(os.getenv("EXCEL_SHARD_WORKERS", "0")) or os.cpu_count() or 1
+# Righe minime per correggere a shard (sotto, l'avvio dei processi costa più del guadagno)
+SHARD_MIN_ROWS = int(os.getenv("EXCEL_SHARD_MIN_ROWS", 1_000_000))
+# Righe più economiche e più care di ogni shard candidate per la chiusura del residuo
+SHARD_CANDIDATES = 256
+# Allineamento (byte) di ogni array nel blocco condiviso
+_ALIGN = 64
+
+
+class ArrayCondivisi:
+    """
+    Array NumPy della stessa lunghezza in un unico blocco di memoria condivisa: il processo
+    che li crea li copia dentro, i processi degli shard vi si agganciano per nome
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, layout: Dict[str, Tuple[str, int]], length: int):
+        self.memory = memory
+        # nome → (dtype, offset nel blocco)
+        self.layout = layout
+        self.length = length
+
+    @classmethod
+    def create(cls, length: int, dtypes: Dict[str, str]) -> "ArrayCondivisi":
+        layout, size = {}, 0
+        for name, dtype in dtypes.items():
+            layout[name] = (np.dtype(dtype).str, size)
+            size += -(-length * np.dtype(dtype).itemsize // _ALIGN) * _ALIGN
+        memory = shared_memory.SharedMemory(create=True, size=max(size, _ALIGN))
+        return cls(memory, layout, length)
+
+    @classmethod
+    def attach(cls, spec) -> "ArrayCondivisi":
+        name, layout, length = spec
+        return cls(shared_memory.SharedMemory(name=name), layout, length)
+
+    @property
+    def spec(self):
+        """Quanto serve a un altro processo per agganciarsi (serializzabile)"""
+        return self.memory.name, self.layout, self.length
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        dtype, offset = self.layout[name]
+        return np.ndarray(self.length, dtype=dtype, buffer=self.memory.buf, offset=offset)
+
+    def slice(self, start: int, stop: int) -> Dict[str, np.ndarray]:
+        return {name: self[name][start:stop] for name in self.layout}
+
+    def close(self):
+        """Sgancia il blocco (dopo aver rilasciato ogni vista sugli array)"""
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def _run(task, spec, start: int, stop: int, *args):
+    """Esegue task sulle righe [start, stop) del blocco condiviso (nel processo dello shard)"""
+    shared = ArrayCondivisi.attach(spec)
+    try:
+        return task(shared.slice(start, stop), start, *args)
+    finally:
+        shared.close()
+
+
+def _normalize(arrays, start: int):
+    """Passaggio 1 sullo shard: quantità negative e righe con prezzo non valido → 0"""
+    quantities, prices = arrays["quantities"], arrays["prices"]
+    negative = quantities < 0
+    invalid = prices <= 0
+    quantities[negative | invalid] = 0
+    return int(negative.sum()), int(invalid.sum()), float(np.dot(quantities, prices)), decimal_scale(prices)
+
+
+def _scale_and_round(arrays, start: int, factor: float, price_scale: Optional[int], scale: Optional[int]):
+    """
+    Passaggi 2–3 sullo shard: prezzi in interi sulla scala comune, quantità scalate e
+    arrotondate, righe candidate per la chiusura del residuo (le più economiche e le più care)
+    """
+    quantities, prices, units = arrays["quantities"], arrays["prices"], arrays["units"]
+    if scale is not None:
+        units[:] = np.round(prices * 10.0 ** price_scale).astype(np.int64) * 10 ** (scale - price_scale)
+    scaled = quantities * factor
+    arrays["rounded"][:] = np.rint(scaled)
+
+    rows = np.flatnonzero((quantities > 0) & (units > 0))
+    if len(rows) > 2 * SHARD_CANDIDATES:
+        order = np.argpartition(units[rows], [SHARD_CANDIDATES, len(rows) - SHARD_CANDIDATES - 1])
+        rows = rows[np.concatenate([order[:SHARD_CANDIDATES], order[-SHARD_CANDIDATES:]])]
+    return float(np.dot(scaled, prices)), np.sort(rows) + start
+
+
+class CorrezioneAShard:
+    """
+    Passaggi 1–3 di ExcelSolverSemplice su data divisi in shard di righe contigue, uno per
+    processo. Durante la correzione gli array di data sono viste sul blocco condiviso;
+    release() li riporta in memoria privata e libera il blocco.
+    """
+
+    def __init__(self, data: ColonneSolver, workers: int):
+        self.data = data
+        self.workers = workers
+        self.shared = ArrayCondivisi.create(len(data), {
+            "quantities": "f8", "prices": "f8", "units": "i8", "rounded": "i8"
+        })
+        self.shared["quantities"][:] = data.quantities
+        self.shared["prices"][:] = data.prices
+        self.shared["units"][:] = 0
+        data.quantities, data.prices = self.shared["quantities"], self.shared["prices"]
+        self.bounds = np.linspace(0, len(data), workers + 1).astype(np.int64)
+        self.candidates: Optional[np.ndarray] = None
+        self._price_scale: Optional[int] = None
+        # Un pool per correzione: un pool globale resterebbe appeso all'uscita dei worker
+        # di JobRunner, che a loro volta attendono i propri processi figli
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    def _map(self, task, *args):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        executor = self.executor
+        spec = self.shared.spec
+        futures = [executor.submit(_run, task, spec, int(start), int(stop), *args)
+                   for start, stop in zip(self.bounds[:-1], self.bounds[1:]) if stop > start]
+        return [future.result() for future in futures]
+
+    def normalize(self) -> Tuple[int, int, float]:
+        """Passaggio 1: (quantità negative, prezzi non validi, totale corrente)"""
+        results = self._map(_normalize)
+        scales = [scale for *_, scale in results]
+        self._price_scale = None if any(scale is None for scale in scales) else max(scales, default=0)
+        return (sum(result[0] for result in results), sum(result[1] for result in results),
+                sum(result[2] for result in results))
+
+    def scale_and_round(self, factor: float, target_total: float) -> float:
+        """
+        Passaggi 2–3: quantità scalate e arrotondate (data.quantities diventa int64) e prezzi
+        in interi sulla scala comune con il target; restituisce il totale dopo lo scaling
+        """
+        data = self.data
+        scale = None
+        if self._price_scale is not None:
+            # Stessa scala di solver_milp.integer_problem
+            target_scale = max(0, -Decimal(str(target_total)).as_tuple().exponent)
+            scale = max(self._price_scale, target_scale)
+            if scale > MAX_SCALA:
+                scale = None
+        results = self._map(_scale_and_round, factor, self._price_scale, scale)
+        data.quantities = self.shared["rounded"]
+        if scale is not None:
+            data.units, data.scale = self.shared["units"], scale
+        self.candidates = np.concatenate([rows for _, rows in results])
+        return sum(total for total, _ in results)
+
+    def release(self):
+        """Chiude i processi degli shard, copia gli array fuori dalla memoria condivisa e la libera"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        data = self.data
+        data.quantities = np.array(data.quantities)
+        data.prices = np.array(data.prices)
+        if data.units is not None:
+            data.units = np.array(data.units)
+        self.shared.unlink()
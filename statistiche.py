@@ -0,0 +1,153 @@
+import numpy as np
+from typing import Dict, Optional
+
+# Campione per colonna usato per la mediana approssimata
+RESERVOIR_SIZE = 10_000
+
+
+def _as_block(block) -> np.ndarray:
+    """Blocco 2-D righe × colonne in float64, colonne contigue (riduzioni per colonna)"""
+    block = np.asarray(block, dtype=np.float64)
+    if block.ndim == 1:
+        block = block[:, None]
+    return np.asfortranarray(block)
+
+
+def _finalize(count, mean, m2, minimum, maximum, integers, median) -> Dict[str, np.ndarray]:
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Deviazione standard campionaria (ddof=1), come pandas
+        std = np.sqrt(np.where(count > 1, m2 / (count - 1), np.nan))
+        integer_ratio = np.where(count > 0, integers / np.maximum(count, 1), 0.0)
+    return {
+        "count": count,
+        "mean": np.where(count > 0, mean, np.nan),
+        "std": std,
+        "min": minimum,
+        "max": maximum,
+        "median": median,
+        "integer_ratio": integer_ratio,
+        "decimal_ratio": np.where(count > 0, 1.0 - integer_ratio, 0.0)
+    }
+
+
+def column_statistics(block) -> Dict[str, np.ndarray]:
+    """
+    Statistiche di tutte le colonne di un blocco 2-D in un solo passaggio vettoriale:
+    numero di valori, media, deviazione standard, minimo, massimo, mediana esatta
+    e quota di valori interi. Le celle vuote sono NaN e vengono ignorate.
+    Ogni voce del risultato è un array con un valore per colonna.
+    """
+    block = _as_block(block)
+    filled = ~np.isnan(block)
+    count = filled.sum(axis=0)
+    n_columns = block.shape[1]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        zeroed = np.where(filled, block, 0.0)
+        mean = zeroed.sum(axis=0) / count
+        # Due passaggi (somma degli scarti al quadrato) per la stabilità numerica
+        m2 = (np.where(filled, block - mean, 0.0) ** 2).sum(axis=0)
+        integers = (filled & (block == np.floor(block))).sum(axis=0)
+
+    empty = count == 0
+    minimum = np.full(n_columns, np.nan)
+    maximum = np.full(n_columns, np.nan)
+    median = np.full(n_columns, np.nan)
+    if not empty.all():
+        with np.errstate(invalid='ignore'):
+            minimum[~empty] = np.nanmin(block[:, ~empty], axis=0)
+            maximum[~empty] = np.nanmax(block[:, ~empty], axis=0)
+            median[~empty] = np.nanmedian(block[:, ~empty], axis=0)
+
+    return _finalize(count, mean, m2, minimum, maximum, integers, median)
+
+
+class StreamingStatistics:
+    """
+    Le stesse statistiche di column_statistics calcolate a blocchi di righe,
+    senza tenere in memoria il foglio intero: momenti combinati blocco per blocco
+    (formula di Chan) e mediana approssimata su un campione (reservoir sampling).
+    La mediana è esatta finché i valori di una colonna non superano reservoir_size.
+    """
+
+    def __init__(self, n_columns: int, reservoir_size: int = RESERVOIR_SIZE, seed: Optional[int] = 0):
+        self.n_columns = n_columns
+        self.reservoir_size = reservoir_size
+        self.rng = np.random.default_rng(seed)
+
+        self.count = np.zeros(n_columns, dtype=np.int64)
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+        self.minimum = np.full(n_columns, np.nan)
+        self.maximum = np.full(n_columns, np.nan)
+        self.integers = np.zeros(n_columns, dtype=np.int64)
+        self.reservoirs = [np.empty(reservoir_size) for _ in range(n_columns)]
+
+    def update(self, block):
+        """Aggiunge un blocco di righe (righe × n_columns)"""
+        block = _as_block(block)
+        filled = ~np.isnan(block)
+        count_b = filled.sum(axis=0)
+        if not count_b.any():
+            return
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_b = np.where(filled, block, 0.0).sum(axis=0) / count_b
+            m2_b = (np.where(filled, block - mean_b, 0.0) ** 2).sum(axis=0)
+            self.integers += (filled & (block == np.floor(block))).sum(axis=0)
+            # fmin/fmax ignorano i NaN delle colonne vuote in questo blocco
+            self.minimum = np.fmin(self.minimum, np.where(filled, block, np.inf).min(axis=0))
+            self.maximum = np.fmax(self.maximum, np.where(filled, block, -np.inf).max(axis=0))
+
+        has = count_b > 0
+        total = self.count + count_b
+        delta = np.where(has, mean_b, 0.0) - self.mean
+        ratio = np.where(has, count_b / np.maximum(total, 1), 0.0)
+        self.mean = self.mean + delta * ratio
+        self.m2 = self.m2 + np.where(has, m2_b, 0.0) + delta ** 2 * self.count * ratio
+
+        self.minimum[self.minimum == np.inf] = np.nan
+        self.maximum[self.maximum == -np.inf] = np.nan
+        for column in np.flatnonzero(has):
+            self._sample(column, block[filled[:, column], column])
+        self.count = total
+
+    def _sample(self, column: int, values: np.ndarray):
+        """Algorithm R vettoriale: ogni valore resta nel campione con probabilità k / n"""
+        reservoir = self.reservoirs[column]
+        seen = int(self.count[column])
+        k = self.reservoir_size
+
+        free = max(0, min(k - seen, len(values)))
+        reservoir[seen:seen + free] = values[:free]
+        rest = values[free:]
+        if len(rest) == 0:
+            return
+        positions = seen + free + np.arange(len(rest))
+        slots = (self.rng.random(len(rest)) * (positions + 1)).astype(np.int64)
+        keep = slots < k
+        # Con indici ripetuti vince l'ultima assegnazione, come nell'algoritmo sequenziale
+        reservoir[slots[keep]] = rest[keep]
+
+    def result(self) -> Dict[str, np.ndarray]:
+        median = np.full(self.n_columns, np.nan)
+        for column in range(self.n_columns):
+            size = min(int(self.count[column]), self.reservoir_size)
+            if size:
+                median[column] = np.median(self.reservoirs[column][:size])
+        return _finalize(self.count, self.mean, self.m2, self.minimum, self.maximum,
+                         self.integers, median)
+
+    @property
+    def median_exact(self) -> np.ndarray:
+        return self.count <= self.reservoir_size
+
+
+def streaming_statistics(block, chunk_rows: int = 65536, reservoir_size: int = RESERVOIR_SIZE,
+                         seed: Optional[int] = 0):
+    """column_statistics in modalità streaming/approssimata, a blocchi di chunk_rows righe"""
+    block = _as_block(block)
+    stats = StreamingStatistics(block.shape[1], reservoir_size, seed)
+    for start in range(0, block.shape[0], chunk_rows):
+        stats.update(block[start:start + chunk_rows])
+    return stats.result(), stats.median_exact
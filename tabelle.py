@@ -0,0 +1,522 @@
+"""
+Lettura e scrittura dei file tabellari (CSV, Parquet, Arrow/Feather) con lo stesso risultato
+delle cartelle Excel di lettura_excel: un solo foglio (formati.TABLE_SHEET), intestazione
+nella prima riga, solo le colonne richieste come array NumPy.
+- Parquet e Arrow (pyarrow, facoltativo): file mappati in memoria, lette solo le colonne
+  usate; il risultato è riscritto un row group / record batch alla volta sostituendo solo
+  le colonne corrette (stesso schema, stessi metadati).
+- CSV: parser C di pandas, con codifica e separatore riconosciuti dalla prima riga (';' con
+  la virgola decimale, come negli export italiani); il risultato copia il file riga per riga
+  con il modulo csv, riscrivendo solo le celle corrette.
+"""
+import codecs
+import csv
+import io
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from formati import TABLE_SHEET, file_format
+from lettura_excel import CampioneFoglio, _column_positions, _header_names, _label, _sample, _trim_trailing_empty_rows
+
+# Byte letti all'inizio del CSV per riconoscere codifica, separatore e fine riga
+CSV_SNIFF_BYTES = 64 * 1024
+# Separatori riconosciuti (quello più frequente nell'intestazione)
+CSV_DELIMITERS = (";", ",", "\t", "|")
+# Blocchi letti per contare le righe di un CSV (analisi a campione)
+CSV_COUNT_BYTES = 4 * 1024 * 1024
+# Righe lette per blocco da Parquet quando serve solo l'inizio del file
+PARQUET_BATCH_ROWS = 64 * 1024
+# Nomi dei codec nei metadati Parquet → nomi accettati da ParquetWriter
+PARQUET_CODECS = {"uncompressed": "none", "lz4_raw": "lz4"}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError("I file Parquet e Arrow richiedono pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def _check_sheet(sheet_name: str):
+    if sheet_name != TABLE_SHEET:
+        raise ValueError(f"Foglio '{sheet_name}' non trovato (i file tabellari hanno solo '{TABLE_SHEET}')")
+
+
+# ----------------------------------------------------------------------
+# CSV
+# ----------------------------------------------------------------------
+
+class DialettoCsv:
+    """Codifica, separatore, virgolette, separatore decimale e fine riga di un CSV"""
+
+    __slots__ = ("encoding", "delimiter", "decimal", "lineterminator", "quote_all")
+
+    def __init__(self, encoding: str, delimiter: str, decimal: str, lineterminator: str, quote_all: bool):
+        self.encoding = encoding
+        self.delimiter = delimiter
+        self.decimal = decimal
+        self.lineterminator = lineterminator
+        self.quote_all = quote_all
+
+    @classmethod
+    def from_file(cls, path: str) -> "DialettoCsv":
+        with open(path, "rb") as f:
+            head = f.read(CSV_SNIFF_BYTES)
+        if head.startswith(codecs.BOM_UTF8):
+            encoding = "utf-8-sig"
+        else:
+            # Decodifica incrementale: un carattere spezzato a fine blocco non è un errore
+            try:
+                codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+                encoding = "utf-8"
+            except UnicodeDecodeError:
+                # Export di Windows (es. '€' = 0x80)
+                encoding = "cp1252"
+        text = head.decode(encoding, errors="replace")
+        first_line = text.splitlines()[0] if text else ""
+        delimiter = max(CSV_DELIMITERS, key=first_line.count) if first_line else ","
+        if first_line.count(delimiter) == 0:
+            delimiter = ","
+        return cls(
+            encoding=encoding,
+            delimiter=delimiter,
+            decimal="," if delimiter == ";" else ".",
+            lineterminator="\r\n" if "\r\n" in text else "\n",
+            # Export con tutti i campi tra virgolette: il risultato mantiene lo stesso stile
+            quote_all=first_line.startswith('"')
+        )
+
+    def read_csv(self, path: str, **kwargs) -> pd.DataFrame:
+        """pd.read_csv con il dialetto del file: solo le celle vuote sono NaN, righe vuote comprese"""
+        return pd.read_csv(path, sep=self.delimiter, decimal=self.decimal, encoding=self.encoding,
+                           encoding_errors="replace", keep_default_na=False, na_values=[""],
+                           skip_blank_lines=False, **kwargs)
+
+
+def _csv_header_values(path: str, dialect: DialettoCsv) -> List[str]:
+    """Campi della prima riga del file"""
+    with open(path, newline="", encoding=dialect.encoding, errors="replace") as f:
+        return next(csv.reader(f, delimiter=dialect.delimiter), [])
+
+
+def _csv_header(path: str, dialect: DialettoCsv, width: int = 0) -> List[str]:
+    """Intestazione normalizzata come in Excel, estesa a width colonne ('Unnamed: i')"""
+    values = _csv_header_values(path, dialect)
+    return _header_names(values + [None] * (width - len(values)))
+
+
+def _numbers(values: pd.Series, decimal: str = ".") -> np.ndarray:
+    """Valori numerici di una colonna (NaN per celle vuote, testo non numerico e booleani)"""
+    if values.dtype == bool:
+        return np.full(len(values), np.nan)
+    if values.dtype.kind in "iuf":
+        return values.to_numpy(dtype=np.float64, na_value=np.nan)
+    if decimal != "." and values.dtype.kind == "O":
+        # Colonna di testo (letta come tale o con qualche cella non numerica): pandas non ha
+        # applicato la virgola decimale
+        values = values.str.replace(decimal, ".", regex=False)
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+# Codici con zeri iniziali ('00123'): restano testo, non sono quantità né prezzi
+_ZERO_PADDED = r"^[+-]?0\d"
+
+
+def _typed_frame(frame: pd.DataFrame, decimal: str) -> pd.DataFrame:
+    """
+    Tipi delle colonne lette come testo: numeriche se tutte le celle piene sono numeri
+    (interi se lo sono tutti), altrimenti testo, come l'inferenza di pandas ma con i codici
+    a zeri iniziali lasciati come testo (l'analisi non li propone come colonne numeriche)
+    """
+    for column, values in frame.items():
+        filled = values.notna()
+        if not filled.any() or values[filled].str.contains(_ZERO_PADDED).any():
+            continue
+        numbers = _numbers(values, decimal)
+        if np.isnan(numbers[filled.to_numpy()]).any():
+            continue
+        finite = numbers[~np.isnan(numbers)]
+        if filled.all() and (np.mod(finite, 1) == 0).all() and (np.abs(finite) < 2 ** 63).all():
+            frame[column] = numbers.astype(np.int64)
+        else:
+            frame[column] = numbers
+    return frame
+
+
+def _label_codes(values: pd.Series) -> Tuple[np.ndarray, List[str]]:
+    """Codici (float, NaN per le celle vuote) ed etichette nell'ordine di prima comparsa, come _label_code"""
+    labels = values.map(_label, na_action="ignore")
+    labels = labels.where(labels != "")
+    codes, uniques = pd.factorize(labels, use_na_sentinel=True)
+    codes = codes.astype(np.float64)
+    codes[codes < 0] = np.nan
+    return codes, [str(label) for label in uniques]
+
+
+def _read_csv(path: str, columns: List[str], data_rows: Optional[int], label_columns: List[str]):
+    dialect = DialettoCsv.from_file(path)
+    header = _csv_header(path, dialect)
+    positions = _column_positions(header, columns, TABLE_SHEET)
+    # Le etichette restano testo ('007' non diventa 7)
+    frame = dialect.read_csv(path, header=None, skiprows=1, usecols=sorted(set(positions)), nrows=data_rows,
+                             dtype={position: str for column, position in zip(columns, positions)
+                                    if column in label_columns})
+    arrays, categories = {}, {}
+    for column, position in zip(columns, positions):
+        if column in label_columns:
+            arrays[column], categories[column] = _label_codes(frame[position])
+        else:
+            arrays[column] = _numbers(frame[position], dialect.decimal)
+    return header, arrays, categories
+
+
+def _count_lines(path: str) -> int:
+    count = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CSV_COUNT_BYTES), b""):
+            count += block.count(b"\n")
+            last = block[-1:]
+    return count + (last != b"\n")
+
+
+def _sample_csv(path: str, max_rows: int) -> CampioneFoglio:
+    dialect = DialettoCsv.from_file(path)
+    header = _csv_header_values(path, dialect)
+    frame = _typed_frame(dialect.read_csv(path, header=None, skiprows=1, nrows=max_rows + 1, dtype=str),
+                         dialect.decimal)
+    rows = [tuple(None if isinstance(value, float) and np.isnan(value) else value for value in row)
+            for row in frame.itertuples(index=False, name=None)]
+    exhausted = len(rows) <= max_rows
+    rows = _trim_trailing_empty_rows(rows[:max_rows])
+    if exhausted:
+        return _sample(TABLE_SHEET, header, rows, len(rows), True)
+    # Righe fisiche del file meno l'intestazione: stima (campi con a capo, righe vuote finali)
+    return _sample(TABLE_SHEET, header, rows, max(len(rows), _count_lines(path) - 1), False)
+
+
+def _format_number(value: float, decimal: str) -> str:
+    """Numero come scritto dal CSV di origine: interi senza decimali, virgola decimale se serve"""
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    text = repr(float(value))
+    return text.replace(".", decimal) if decimal != "." else text
+
+
+def _format_numbers(values: np.ndarray, decimal: str) -> List[str]:
+    """_format_number su tutto l'array: gli interi (il caso delle quantità) in blocco"""
+    integer = (np.mod(values, 1) == 0) & (np.abs(values) < 1e15)
+    if integer.all():
+        return values.astype(np.int64).astype(str).tolist()
+    return [_format_number(value, decimal) for value in values.tolist()]
+
+
+def _write_csv(src_path: str, out, cells: Dict[int, Tuple[np.ndarray, np.ndarray]]):
+    dialect = DialettoCsv.from_file(src_path)
+    # Riga del file (0 = intestazione) → {colonna: testo}
+    by_record: Dict[int, Dict[int, str]] = {}
+    for column, (rows, values) in cells.items():
+        for row, text in zip((rows + 1).tolist(), _format_numbers(values, dialect.decimal)):
+            by_record.setdefault(row, {})[column] = text
+
+    text_out = open(out, "w", newline="", encoding=dialect.encoding, errors="surrogateescape") \
+        if isinstance(out, str) else io.TextIOWrapper(out, encoding=dialect.encoding, errors="surrogateescape",
+                                                      newline="")
+    try:
+        writer = csv.writer(text_out, delimiter=dialect.delimiter, lineterminator=dialect.lineterminator,
+                            quoting=csv.QUOTE_ALL if dialect.quote_all else csv.QUOTE_MINIMAL)
+        with open(src_path, newline="", encoding=dialect.encoding, errors="surrogateescape") as source:
+            records = csv.reader(source, delimiter=dialect.delimiter)
+            last = max(by_record, default=-1)
+            for index, record in enumerate(records):
+                patched = by_record.get(index)
+                if patched:
+                    record.extend([""] * (max(patched) + 1 - len(record)))
+                    for column, value in patched.items():
+                        record[column] = value
+                writer.writerow(record)
+                if index >= last:
+                    # Nessuna altra cella da correggere: il resto è copiato senza controlli
+                    writer.writerows(records)
+                    break
+    finally:
+        if isinstance(out, str):
+            text_out.close()
+        else:
+            text_out.flush()
+            text_out.detach()
+
+
+# ----------------------------------------------------------------------
+# Parquet e Arrow (pyarrow)
+# ----------------------------------------------------------------------
+
+def _arrow_numbers(column) -> np.ndarray:
+    """Colonna Arrow come float64 (NaN per null, testo non numerico, booleani, date)"""
+    pa = _pyarrow()
+    import pyarrow.compute as pc
+
+    kind = column.type
+    if pa.types.is_dictionary(kind):
+        column, kind = pc.cast(column, kind.value_type), kind.value_type
+    if pa.types.is_integer(kind) or pa.types.is_floating(kind) or pa.types.is_decimal(kind):
+        return pc.cast(column, pa.float64(), safe=False).to_numpy()
+    if pa.types.is_string(kind) or pa.types.is_large_string(kind):
+        return _numbers(column.to_pandas())
+    return np.full(len(column), np.nan)
+
+
+def _arrow_labels(column) -> Tuple[np.ndarray, List[str]]:
+    """Codici ed etichette di una colonna Arrow, con dictionary_encode (vettoriale)"""
+    pa = _pyarrow()
+    import pyarrow.compute as pc
+
+    if pa.types.is_dictionary(column.type):
+        column = pc.cast(column, column.type.value_type)
+    encoded = (column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column).dictionary_encode()
+    # Etichette normalizzate come _label: valori diversi possono dare la stessa etichetta ('A ' e 'A')
+    labels: Dict[str, int] = {}
+    remap = []
+    for value in encoded.dictionary.to_pylist():
+        label = _label(value) if value is not None else ""
+        remap.append(labels.setdefault(label, len(labels)) if label != "" else -1)
+    indices = pc.fill_null(encoded.indices, -1).to_numpy(zero_copy_only=False).astype(np.int64)
+    codes = np.append(np.array(remap, dtype=np.int64), -1)[indices]
+    # Codici densi nell'ordine di prima comparsa (le etichette vuote non hanno codice)
+    codes = codes.astype(np.float64)
+    codes[codes < 0] = np.nan
+    return codes, list(labels)
+
+
+def _table_arrays(table, fields: Dict[str, str], label_columns: List[str]):
+    """Colonne richieste {colonna: campo della tabella Arrow} come in _read_xlsx"""
+    arrays, categories = {}, {}
+    for column, field in fields.items():
+        values = table.column(field)
+        if column in label_columns:
+            arrays[column], categories[column] = _arrow_labels(values)
+        else:
+            arrays[column] = _arrow_numbers(values)
+    return arrays, categories
+
+
+def _open_parquet(path: str):
+    _pyarrow()
+    import pyarrow.parquet as pq
+
+    return pq.ParquetFile(path, memory_map=True)
+
+
+def _open_arrow(path: str):
+    pa = _pyarrow()
+    return pa.ipc.open_file(pa.memory_map(path, "r"))
+
+
+def _read_parquet(path: str, columns: List[str], data_rows: Optional[int], label_columns: List[str]):
+    pa = _pyarrow()
+    parquet = _open_parquet(path)
+    names = parquet.schema_arrow.names
+    header = _header_names(names)
+    positions = _column_positions(header, columns, TABLE_SHEET)
+    selected = [names[position] for position in positions]
+    if data_rows is None:
+        table = parquet.read(columns=selected)
+    else:
+        # Solo i primi row group necessari
+        batches, rows = [], 0
+        for batch in parquet.iter_batches(batch_size=min(max(data_rows, 1), PARQUET_BATCH_ROWS), columns=selected):
+            batches.append(batch)
+            rows += batch.num_rows
+            if rows >= data_rows:
+                break
+        table = pa.Table.from_batches(batches, schema=parquet.schema_arrow.empty_table().select(selected).schema)
+        table = table.slice(0, data_rows)
+    return header, *_table_arrays(table, dict(zip(columns, selected)), label_columns)
+
+
+def _read_arrow(path: str, columns: List[str], data_rows: Optional[int], label_columns: List[str]):
+    reader = _open_arrow(path)
+    names = reader.schema.names
+    header = _header_names(names)
+    positions = _column_positions(header, columns, TABLE_SHEET)
+    # File mappato: read_all non copia i dati, select e slice nemmeno
+    table = reader.read_all().select(sorted(set(positions)))
+    if data_rows is not None:
+        table = table.slice(0, data_rows)
+    return header, *_table_arrays(table, {column: names[position] for column, position in zip(columns, positions)},
+                                  label_columns)
+
+
+def _table_rows(table) -> List[tuple]:
+    frame = table.to_pandas()
+    return [tuple(None if isinstance(value, float) and np.isnan(value) else value for value in row)
+            for row in frame.itertuples(index=False, name=None)]
+
+
+def _sample_columnar(header: List[str], table, total_rows: int, max_rows: int) -> CampioneFoglio:
+    rows = _trim_trailing_empty_rows(_table_rows(table.slice(0, max_rows)))
+    # Il numero di righe è nei metadati del file: sempre esatto
+    return _sample(TABLE_SHEET, header, rows, len(rows) if total_rows <= max_rows else total_rows, True)
+
+
+def _sample_parquet(path: str, max_rows: int) -> CampioneFoglio:
+    pa = _pyarrow()
+    parquet = _open_parquet(path)
+    batch = next(parquet.iter_batches(batch_size=max(max_rows, 1)), None)
+    table = pa.Table.from_batches([batch]) if batch is not None else parquet.schema_arrow.empty_table()
+    return _sample_columnar(parquet.schema_arrow.names, table, parquet.metadata.num_rows, max_rows)
+
+
+def _sample_arrow(path: str, max_rows: int) -> CampioneFoglio:
+    table = _open_arrow(path).read_all()
+    return _sample_columnar(table.column_names, table, table.num_rows, max_rows)
+
+
+def _patched_column(column, rows: np.ndarray, values: np.ndarray):
+    """Colonna Arrow con le righe indicate sostituite, nel tipo originale"""
+    pa = _pyarrow()
+    import pyarrow.compute as pc
+
+    kind = column.type
+    if pa.types.is_dictionary(kind):
+        column, kind = pc.cast(column, kind.value_type), kind.value_type
+    if pa.types.is_string(kind) or pa.types.is_large_string(kind):
+        texts = column.to_pylist()
+        for row, value in zip(rows.tolist(), values.tolist()):
+            texts[row] = _format_number(value, ".")
+        return pa.array(texts, type=kind)
+    if not (pa.types.is_integer(kind) or pa.types.is_floating(kind) or pa.types.is_decimal(kind)):
+        raise ValueError(f"Colonna di tipo {kind} non modificabile con valori numerici")
+    data = pc.cast(column, pa.float64(), safe=False).to_numpy().copy()
+    empty = np.asarray(column.is_null().to_numpy(zero_copy_only=False), dtype=bool).copy()
+    data[rows] = values
+    empty[rows] = False
+    if pa.types.is_integer(kind):
+        if not np.all(np.mod(values, 1) == 0):
+            raise ValueError("Quantità non intere in una colonna di interi")
+        return pa.array(np.where(empty, 0, data).astype(np.int64), mask=empty).cast(kind)
+    return pa.array(data, mask=empty).cast(kind, safe=False)
+
+
+def _patched_table(table, cells: Dict[int, Tuple[np.ndarray, np.ndarray]], offset: int):
+    """Sostituisce le celle corrette che cadono nelle righe [offset, offset + righe della tabella)"""
+    for column, (rows, values) in cells.items():
+        if column >= table.num_columns:
+            raise ValueError(f"Colonna {column + 1} non presente nel file")
+        inside = (rows >= offset) & (rows < offset + table.num_rows)
+        if inside.any():
+            patched = _patched_column(table.column(column), rows[inside] - offset, values[inside])
+            table = table.set_column(column, table.schema.field(column), patched)
+    return table
+
+
+def _write_parquet(src_path: str, out, cells: Dict[int, Tuple[np.ndarray, np.ndarray]]):
+    import pyarrow.parquet as pq
+
+    parquet = _open_parquet(src_path)
+    metadata = parquet.metadata
+    compression = (metadata.row_group(0).column(0).compression.lower()
+                   if metadata.num_row_groups and metadata.num_columns else "snappy")
+    compression = PARQUET_CODECS.get(compression, compression)
+    offset = 0
+    with pq.ParquetWriter(out, parquet.schema_arrow, compression=compression) as writer:
+        for index in range(parquet.num_row_groups):
+            table = parquet.read_row_group(index)
+            writer.write_table(_patched_table(table, cells, offset), row_group_size=max(table.num_rows, 1))
+            offset += table.num_rows
+
+
+def _write_arrow(src_path: str, out, cells: Dict[int, Tuple[np.ndarray, np.ndarray]]):
+    pa = _pyarrow()
+    reader = _open_arrow(src_path)
+    offset = 0
+    with pa.ipc.new_file(out, reader.schema) as writer:
+        for index in range(reader.num_record_batches):
+            # Batch mappati: in memoria finisce solo la colonna corretta
+            table = pa.Table.from_batches([reader.get_batch(index)])
+            writer.write_table(_patched_table(table, cells, offset))
+            offset += table.num_rows
+
+
+# ----------------------------------------------------------------------
+# Punti di ingresso (per formato, vedi formati.FormatoFile)
+# ----------------------------------------------------------------------
+
+_READERS = {"csv": _read_csv, "parquet": _read_parquet, "arrow": _read_arrow}
+_SAMPLERS = {"csv": _sample_csv, "parquet": _sample_parquet, "arrow": _sample_arrow}
+_WRITERS = {"csv": _write_csv, "parquet": _write_parquet, "arrow": _write_arrow}
+
+
+def read_table_columns(file_path: str, sheet_name: str, columns: List[str], data_rows: Optional[int],
+                       label_columns: List[str]):
+    """Come lettura_excel._read_xlsx: (intestazione, {colonna: valori}, {colonna: etichette})"""
+    _check_sheet(sheet_name)
+    return _READERS[file_format(file_path).name](file_path, columns, data_rows, label_columns)
+
+
+def sample_table(file_path: str, sheet_names: Optional[List[str]], max_rows: int):
+    """Come lettura_excel.sample_sheets: (nomi dei fogli, campioni) con il solo TABLE_SHEET"""
+    for sheet_name in sheet_names or []:
+        _check_sheet(sheet_name)
+    return [TABLE_SHEET], [_SAMPLERS[file_format(file_path).name](file_path, max_rows)]
+
+
+def read_table_frame(file_path: str) -> pd.DataFrame:
+    """Tabella per intero come DataFrame (analisi completa di /introspect), intestazione come Excel"""
+    name = file_format(file_path).name
+    if name == "csv":
+        dialect = DialettoCsv.from_file(file_path)
+        frame = _typed_frame(dialect.read_csv(file_path, header=None, skiprows=1, dtype=str), dialect.decimal)
+        header = _csv_header(file_path, dialect, frame.shape[1])
+        frame = frame.reindex(columns=range(len(header)))
+        frame.columns = header
+        return frame
+    table = _open_parquet(file_path).read() if name == "parquet" else _open_arrow(file_path).read_all()
+    frame = table.to_pandas()
+    frame.columns = _header_names(table.column_names)
+    return frame
+
+
+def _split_refs(refs: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Colonna (0-based) e riga (1-based) di ogni riferimento ('E5'), in blocco sui codici dei
+    caratteri: le lettere sono cifre in base 26, le cifre in base 10
+    """
+    codes = np.array(refs).view(np.uint32).reshape(len(refs), -1).astype(np.int64)
+    letters = (codes >= 65) & (codes <= 90)
+    digits = (codes >= 48) & (codes <= 57)
+    if not (letters | digits | (codes == 0)).all() or not letters[:, 0].all():
+        raise ValueError("Riferimento di cella non valido tra le celle corrette")
+    # Posizione di ogni carattere contando da destra tra quelli dello stesso tipo
+    letter_rank = np.maximum(np.cumsum(letters[:, ::-1], axis=1)[:, ::-1] - 1, 0)
+    digit_rank = np.maximum(np.cumsum(digits[:, ::-1], axis=1)[:, ::-1] - 1, 0)
+    columns = np.where(letters, (codes - 64) * 26 ** letter_rank, 0).sum(axis=1) - 1
+    rows = np.where(digits, (codes - 48) * 10 ** digit_rank, 0).sum(axis=1)
+    return columns, rows
+
+
+def write_table(src_path: str, out, patches: Dict[str, Dict[str, Any]]):
+    """
+    Copia del file tabellare src_path in out (percorso o file binario) con le celle corrette
+    {TABLE_SHEET: {riferimento: valore}} (riferimenti come in Excel: 'E5' = colonna E,
+    quinta riga del file contando l'intestazione). Le formule non sono ammesse.
+    """
+    for sheet_name in patches:
+        _check_sheet(sheet_name)
+    patched = patches.get(TABLE_SHEET, {})
+    cells = {}
+    if patched:
+        try:
+            values = np.fromiter(patched.values(), np.float64, len(patched))
+        except ValueError:
+            ref = next(ref for ref, value in patched.items() if isinstance(value, str))
+            raise ValueError(f"I file tabellari non contengono formule ({ref}: '{patched[ref]}')")
+        columns, rows = _split_refs(list(patched))
+        # Righe di dati 0-based (la riga 1 è l'intestazione)
+        for column in np.unique(columns).tolist():
+            selected = columns == column
+            cells[column] = (rows[selected] - 2, values[selected])
+    _WRITERS[file_format(src_path).name](src_path, out, cells)
@@ -0,0 +1,44 @@
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Moduli del progetto (nella radice) e, dopo, generatore dei benchmark (benchmarks/ ha
+# moduli con lo stesso nome di quelli del progetto, es. compensazione.py)
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "benchmarks"))
+
+# Cartella di esempio distribuita con il progetto
+INVENTARIO = os.path.join(ROOT, "inventario 2023.xlsx")
+COLONNE = {"quantity_column": "Quantità", "price_column": "Prezzo", "remaining_column": "Rimanenze"}
+
+
+def decimal_total(quantities, prices) -> Decimal:
+    """Riferimento: Σ Decimal(str(q)) × Decimal(str(p)) riga per riga, come il vecchio ciclo iterrows"""
+    total = Decimal(0)
+    for quantity, price in zip(list(quantities), list(prices)):
+        total += Decimal(str(quantity)) * Decimal(str(price))
+    return total
+
+
+@pytest.fixture(scope="session")
+def inventario():
+    from lettura_excel import read_sheet_columns
+
+    return read_sheet_columns(INVENTARIO, "Foglio1", list(COLONNE.values()))
+
+
+@pytest.fixture(scope="session")
+def synthetic_sheets(tmp_path_factory):
+    """Fogli sintetici grandi di benchmarks/generatore.py, uno per distribuzione dei prezzi"""
+    from generatore import generate_workbook
+    from lettura_excel import read_sheet_columns
+
+    directory = tmp_path_factory.mktemp("generatore")
+    sheets = {}
+    for prices in ("lognormal", "round"):
+        path = generate_workbook(str(directory / f"{prices}.xlsx"), 30_000, prices=prices, seed=7)
+        sheets[prices] = read_sheet_columns(path, "Foglio1", list(COLONNE.values()))
+    return sheets
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from elaborazione import prepare_batch
+
+SPEC = {"sheet_name": "Foglio1", "quantity_column": "Quantità", "price_column": "Prezzo",
+        "remaining_column": "Rimanenze", "target_total": 100.0}
+
+
+@pytest.mark.parametrize("filename", ["inventario.xls", "INVENTARIO.XLS"])
+def test_xls_converted_once_for_zip(tmp_path, filename):
+    xlwt = pytest.importorskip("xlwt")
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet("Foglio1")
+    for column, name in enumerate(["Quantità", "Prezzo", "Rimanenze"]):
+        sheet.write(0, column, name)
+    for row in range(1, 6):
+        sheet.write(row, 0, row)
+        sheet.write(row, 1, 2.5)
+        sheet.write(row, 2, row * 2.5)
+    path = str(tmp_path / filename)
+    workbook.save(path)
+
+    prepared = prepare_batch(path, filename, [SPEC, {**SPEC, "target_total": 200.0}], None, "zip")
+    try:
+        # Una sola conversione in .xlsx condivisa da tutte le specifiche, anche con l'estensione maiuscola
+        assert prepared["xlsx_path"] != path and prepared["xlsx_path"].endswith(".xlsx")
+    finally:
+        if prepared["xlsx_path"] != path:
+            os.unlink(prepared["xlsx_path"])
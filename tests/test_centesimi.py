@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from centesimi import decimal_scale, exact_dot, exact_segment_dots, exact_total, exact_total_cents, to_scaled_int
+from conftest import decimal_total
+
+
+def python_dot(a, b) -> int:
+    return sum(int(x) * int(y) for x, y in zip(a.tolist(), b.tolist()))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_exact_total_matches_decimal(seed):
+    rng = np.random.default_rng(seed)
+    prices = np.round(rng.lognormal(2.5, 1.0, 5000), 2)
+    # Quantità intere, scalate (più cifre decimali) e negative
+    for quantities in (rng.integers(-5, 500, 5000).astype(float),
+                       np.round(rng.uniform(0, 50, 5000), 4),
+                       rng.integers(0, 40, 5000) * 0.37):
+        assert exact_total(quantities, prices) == decimal_total(quantities.tolist(), prices.tolist())
+
+
+def test_exact_total_not_scalable_falls_back_to_decimal():
+    quantities = np.array([1 / 3, 2.5, 7.0])
+    prices = np.array([0.1, 1e-12, 3.3])
+    assert decimal_scale(quantities) is None
+    assert exact_total(quantities, prices) == decimal_total(quantities.tolist(), prices.tolist())
+
+
+def test_exact_total_cents_truncates_like_decimal():
+    quantities = np.array([3.0, 1.5, 2.0])
+    prices = np.array([0.333, 1.01, 2.005])
+    expected = decimal_total(quantities.tolist(), prices.tolist())
+    assert exact_total_cents(quantities, prices) == int(expected * 100)
+
+
+def test_to_scaled_int_round_trip():
+    values = np.array([0.01, 12.5, 199.99, 0.0])
+    ints, scale = to_scaled_int(values)
+    assert scale == 2
+    assert ints.tolist() == [1, 1250, 19999, 0]
+    assert to_scaled_int(np.array([np.nan])) is None
+
+
+@pytest.mark.parametrize("high", [
+    10 ** 4,  # somma in int64
+    2 ** 31,  # somma a blocchi (il singolo prodotto sta in int64)
+    2 ** 40,  # prodotti oltre int64: interi Python
+])
+def test_exact_dot_overflow_paths(high):
+    rng = np.random.default_rng(high % 97)
+    a = rng.integers(-high, high, 20_000, dtype=np.int64)
+    b = rng.integers(-high, high, 20_000, dtype=np.int64)
+    assert exact_dot(a, b) == python_dot(a, b)
+
+
+def test_exact_dot_edge_cases():
+    empty = np.array([], dtype=np.int64)
+    assert exact_dot(empty, empty) == 0
+    big = np.array([2 ** 62, 2 ** 62], dtype=np.int64)
+    assert exact_dot(big, np.array([4, -3])) == 2 ** 62
+    assert exact_dot(big, big) == 2 * 2 ** 124
+
+
+@pytest.mark.parametrize("high", [10 ** 4, 2 ** 40])
+def test_exact_segment_dots(high):
+    rng = np.random.default_rng(3)
+    a = rng.integers(-high, high, 1000, dtype=np.int64)
+    b = rng.integers(-high, high, 1000, dtype=np.int64)
+    # Segmenti vuoti compresi (all'inizio, in mezzo e alla fine)
+    bounds = [0, 0, 10, 10, 400, 999, 1000, 1000]
+    expected = [python_dot(a[start:stop], b[start:stop]) for start, stop in zip(bounds[:-1], bounds[1:])]
+    assert exact_segment_dots(a, b, bounds) == expected
+
+
+def test_exact_segment_dots_empty_arrays():
+    empty = np.array([], dtype=np.int64)
+    assert exact_segment_dots(empty, empty, [0, 0, 0]) == [0, 0]
+
+
+def test_decimal_scale_limits():
+    assert decimal_scale([]) == 0
+    assert decimal_scale([1.0, 2.0]) == 0
+    assert decimal_scale([0.5, 0.25]) == 2
+    assert decimal_scale([float(2 ** 53)]) is None
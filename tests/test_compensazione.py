@@ -0,0 +1,252 @@
+import tracemalloc
+from collections import deque
+
+import numpy as np
+import pytest
+
+from centesimi import exact_dot
+from compensazione import RESIDUAL_KEEP, _bounded_steps, _half_width, _reduce, _shortest_steps, _spread, close_residual
+
+
+def greedy_loop(units, quantities, residual):
+    """Ciclo greedy precedente: righe per prezzo crescente, più unità possibili per riga"""
+    delta = np.zeros(len(units), dtype=np.int64)
+    remaining = abs(residual)
+    for index in np.argsort(units, kind="stable"):
+        price = int(units[index])
+        step = remaining // price if residual > 0 else min(int(quantities[index]) - 1, remaining // price)
+        if step > 0:
+            delta[index] = step if residual > 0 else -step
+            remaining -= step * price
+    return delta
+
+
+def fewest_units(units, residual):
+    """Riferimento: minimo Σ|delta| con Σ delta_i × c_i = residual (ricerca in ampiezza, senza limiti)"""
+    prices = sorted(set(int(unit) for unit in units))
+    bound = abs(residual) + 2 * max(prices)
+    seen = {0: 0}
+    frontier = deque([0])
+    while frontier:
+        value = frontier.popleft()
+        if value == residual:
+            return seen[value]
+        for step in prices + [-price for price in prices]:
+            reached = value + step
+            if abs(reached) <= bound and reached not in seen:
+                seen[reached] = seen[value] + 1
+                frontier.append(reached)
+    return None
+
+
+def check_closure(closure, units, quantities, residual, min_quantity=1):
+    assert closure.remaining == residual - exact_dot(closure.delta, units)
+    assert ((quantities + closure.delta >= min_quantity) | (closure.delta >= 0)).all()
+
+
+def synthetic(rows, rng):
+    """Prezzi in centesimi con fattori comuni (multipli di 5 e 10) e quantità intere"""
+    units = rng.integers(50, 50_000, rows) * rng.choice([1, 5, 10], rows)
+    return units.astype(np.int64), rng.integers(1, 60, rows).astype(np.int64)
+
+
+@pytest.mark.parametrize("residual", [137, -5_003, 98_765, -1_234_567, 4_999_999, -9_876_543, -100_000_000_000])
+def test_closes_more_than_greedy_loop(residual):
+    units, quantities = synthetic(50_000, np.random.default_rng(0))
+    closure = close_residual(units, quantities, residual)
+    check_closure(closure, units, quantities, residual)
+    greedy = greedy_loop(units, quantities, residual)
+    greedy_remaining = residual - exact_dot(greedy, units)
+    assert abs(closure.remaining) <= abs(greedy_remaining)
+    if closure.reachable and abs(residual) < 10_000_000:
+        assert closure.closed
+        assert closure.changes <= int(np.abs(greedy).sum())
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_small_residuals_use_fewest_units(seed):
+    """Entro RESIDUAL_KEEP × prezzo più alto il residuo va tutto alla programmazione dinamica: ottimo"""
+    rng = np.random.default_rng(seed)
+    units = rng.integers(1, 40, rng.integers(2, 6)) * 5
+    quantities = np.full(len(units), 1000, dtype=np.int64)
+    divisor = int(np.gcd.reduce(units))
+    keep = RESIDUAL_KEEP * int(units.max())
+    residual = int(rng.integers(-keep // divisor, keep // divisor + 1)) * divisor
+    closure = close_residual(units, quantities, residual)
+    check_closure(closure, units, quantities, residual)
+    assert closure.closed
+    assert closure.changes == fewest_units(units, residual)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_large_residuals_close_exactly(seed):
+    rng = np.random.default_rng(seed)
+    units = rng.integers(1, 400, rng.integers(2, 30)) * 5
+    quantities = np.full(len(units), 1000, dtype=np.int64)
+    residual = int(rng.integers(-100_000, 100_000)) * int(np.gcd.reduce(units))
+    closure = close_residual(units, quantities, residual)
+    check_closure(closure, units, quantities, residual)
+    assert closure.reachable and closure.closed
+
+
+def test_unreachable_residual_goes_to_nearest_multiple():
+    units = np.array([500, 1000, 250], dtype=np.int64)
+    quantities = np.array([10, 10, 10], dtype=np.int64)
+    closure = close_residual(units, quantities, 1_130)
+    assert not closure.reachable
+    assert closure.remaining == 1_130 - 1_250
+    check_closure(closure, units, quantities, 1_130)
+
+
+@pytest.mark.parametrize("min_quantity", [0, 1, 2])
+def test_decrease_respects_min_quantity(min_quantity):
+    rng = np.random.default_rng(min_quantity)
+    units = rng.integers(1, 500, 200).astype(np.int64)
+    quantities = rng.integers(0, 4, 200).astype(np.int64)
+    residual = -int(exact_dot(np.maximum(quantities - min_quantity, 0), units)) // 2
+    closure = close_residual(units, quantities, residual, min_quantity=min_quantity)
+    check_closure(closure, units, quantities, residual, min_quantity)
+    assert closure.closed
+
+
+def test_memory_cap_keeps_result_consistent():
+    units, quantities = synthetic(5_000, np.random.default_rng(1))
+    for max_bytes in (64, 4_096, 1 << 20):
+        closure = close_residual(units, quantities, 1_234_567, max_bytes=max_bytes)
+        check_closure(closure, units, quantities, 1_234_567)
+
+
+def peak_bytes(function, *args):
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("max_bytes", [1 << 20, 8 << 20])
+@pytest.mark.parametrize("prices", [[2, 4], list(range(2, 66, 2))])
+def test_shortest_steps_peak_within_max_bytes(max_bytes, prices):
+    """Prezzi pari e target dispari: la ricerca visita tutta la finestra senza trovarlo"""
+    prices = np.array(prices, dtype=np.int64)
+    steps = np.concatenate([prices, -prices])
+    peak, counts = peak_bytes(_shortest_steps, steps, 1, _half_width(max_bytes), max_bytes)
+    assert counts is None
+    assert peak <= max_bytes
+
+
+@pytest.mark.parametrize("max_bytes", [1 << 20, 8 << 20])
+@pytest.mark.parametrize("rows", [1, 3, 8])
+def test_bounded_steps_peak_within_max_bytes(max_bytes, rows):
+    """Capacità ampie: la finestra si restringe attorno al target entro max_bytes"""
+    prices = np.arange(1, rows + 1) * 7 + 3
+    capacity = np.full(rows, 10 ** 6)
+    peak, counts = peak_bytes(_bounded_steps, prices, -capacity, capacity, 12_340, max_bytes)
+    assert peak <= max_bytes
+    if counts is not None:
+        assert exact_dot(counts, prices) == 12_340
+
+
+def test_residual_beyond_int64():
+    units, quantities = synthetic(1_000, np.random.default_rng(2))
+    residual = 3 * 10 ** 19 + 5
+    closure = close_residual(units, quantities, residual)
+    check_closure(closure, units, quantities, residual)
+    assert closure.closed == closure.reachable
+
+
+def test_nothing_to_move():
+    units = np.array([0, 0], dtype=np.int64)
+    closure = close_residual(units, np.array([3, 4]), 100)
+    assert closure.remaining == 100 and closure.changes == 0 and closure.method == "none"
+    closure = close_residual(np.array([5]), np.array([3]), 0)
+    assert closure.closed and closure.changes == 0
+
+
+def test_bounded_closure_beyond_retry():
+    """I passi minimi superano i massimi per riga: la chiusura passa alla programmazione con capacità"""
+    units = np.array([110, 42830, 9590, 1577, 19685], dtype=np.int64)
+    quantities = np.array([16, 19, 12, 15, 5], dtype=np.int64)
+    maximum = np.array([21, 23, 15, 16, 14], dtype=np.int64)
+    closure = close_residual(units, quantities, -15952, min_quantity=0, max_quantity=maximum)
+    check_closure(closure, units, quantities, -15952, min_quantity=0)
+    assert closure.reachable and closure.closed
+    assert (quantities + closure.delta <= maximum).all()
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_feasible_bounded_residuals_close(seed):
+    """Residuo ottenuto da una variazione entro i limiti di ogni riga: esiste sempre una chiusura"""
+    rng = np.random.default_rng(seed)
+    rows = int(rng.integers(2, 7))
+    units = rng.integers(50, 50_000, rows).astype(np.int64)
+    quantities = rng.integers(0, 20, rows).astype(np.int64)
+    lower = np.maximum(quantities - rng.integers(0, 12, rows), 0)
+    upper = quantities + rng.integers(0, 8, rows)
+    residual = exact_dot(rng.integers(lower, upper + 1) - quantities, units)
+    closure = close_residual(units, quantities, residual, min_quantity=lower, max_quantity=upper)
+    check_closure(closure, units, quantities, residual, lower)
+    assert closure.closed
+    assert (quantities + closure.delta <= upper).all()
+
+
+def reduce_loop(prices, down_capacity, residual, keep):
+    """Riduzione precedente: un prezzo alla volta dal più alto, entro la capacità in diminuzione"""
+    used = np.zeros(len(prices), dtype=np.int64)
+    remaining = residual
+    sign = 1 if remaining > 0 else -1
+    for index in range(len(prices) - 1, -1, -1):
+        excess = abs(remaining) - keep
+        if excess < prices[index]:
+            continue
+        count = excess // int(prices[index])
+        if sign < 0:
+            count = min(count, int(down_capacity[index]))
+        used[index] += sign * count
+        remaining -= sign * count * int(prices[index])
+    return used, remaining
+
+
+def spread_loop(count, capacity):
+    """Distribuzione precedente su un solo prezzo: livello cercato per bisezione scalare"""
+    capacity = np.minimum(capacity.astype(np.int64), count)
+    low, high = 0, count
+    while low < high:
+        level = (low + high) // 2
+        if int(np.minimum(capacity, level).sum()) >= count:
+            high = level
+        else:
+            low = level + 1
+    delta = np.minimum(capacity, max(low - 1, 0))
+    delta[np.flatnonzero(capacity >= low)[:count - int(delta.sum())]] += 1
+    return delta
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_vectorized_reduce_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    prices = np.unique(rng.integers(1, 5_000, rng.integers(1, 300))).astype(np.int64)
+    down_capacity = rng.integers(0, 50, len(prices)).astype(np.int64)
+    down_capacity[rng.random(len(prices)) < 0.3] = 0
+    keep = 2 * int(prices[:32].max())
+    magnitude = int(rng.choice([10 ** 3, 10 ** 6, 10 ** 9, 10 ** 20]))
+    residual = int(rng.integers(1, 1 << 62)) % magnitude * int(rng.choice([1, -1]))
+    used, remaining = _reduce(prices, down_capacity, residual, keep)
+    expected_used, expected_remaining = reduce_loop(prices, down_capacity, residual, keep)
+    assert used.tolist() == expected_used.tolist()
+    assert remaining == expected_remaining
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_vectorized_spread_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(1, 20, rng.integers(1, 15))
+    capacity = rng.integers(0, 30, int(sizes.sum())).astype(np.int64)
+    starts = np.cumsum(sizes) - sizes
+    groups = np.split(capacity, starts[1:])
+    counts = np.array([int(rng.integers(1, group.sum() + 1)) if group.sum() else 0 for group in groups])
+    delta = _spread(counts, capacity, starts)
+    expected = np.concatenate([spread_loop(int(count), group) for count, group in zip(counts, groups)])
+    assert delta.tolist() == expected.tolist()
+    assert np.add.reduceat(delta, starts).tolist() == counts.tolist()
@@ -0,0 +1,68 @@
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from conftest import COLONNE, INVENTARIO, decimal_total
+from incrementale import StatoCorrezione
+from solver_semplice import ExcelSolverSemplice
+
+
+def full_solver(sheet_data, target_total):
+    solver = ExcelSolverSemplice(INVENTARIO, "Foglio1", target_total=target_total, sheet_data=sheet_data,
+                                 shard_workers=1, **COLONNE)
+    result = solver.adjust()
+    assert result["success"], result.get("error")
+    return solver, result
+
+
+def movable_rows(solver):
+    """Righe che la correzione completa può spostare (ExcelSolverSemplice._compensation_rows)"""
+    mask = np.zeros(len(solver.data), dtype=bool)
+    mask[solver._compensation_rows(all_rows=True)] = True
+    return mask
+
+
+@pytest.fixture(scope="module")
+def first(inventario):
+    return full_solver(inventario, 50_000.0)
+
+
+@pytest.mark.parametrize("target_total", [50_100.0, 49_000.13, 51_234.56])
+def test_retarget_matches_full_correction(inventario, first, target_total):
+    solver, _ = first
+    state = StatoCorrezione.from_solver(solver)
+    before = state.quantities.copy()
+    state.apply(target_total=target_total)
+
+    full, result = full_solver(inventario, target_total)
+    # Stesso totale esatto della correzione completa
+    assert state.final_total == Decimal(str(target_total))
+    assert decimal_total(state.quantities.tolist(), state.prices.tolist()) == Decimal(str(result["final_total"]))
+    # Si spostano solo le righe che la correzione completa può spostare: le giacenze a zero restano a zero
+    movable = movable_rows(full)
+    assert np.array_equal(movable, movable_rows(solver))
+    assert (state.quantities[~movable] == before[~movable]).all()
+    assert (state.quantities[~movable] == full.data.quantities[~movable]).all()
+    assert (state.quantities[state.normalized == 0] == 0).all()
+    assert (state.quantities >= 0).all()
+
+
+def test_row_changes_keep_zero_stock_rows(inventario, first):
+    solver, _ = first
+    state = StatoCorrezione.from_solver(solver)
+    zero = np.flatnonzero(state.normalized == 0)
+    stocked = np.flatnonzero(state.normalized > 0)
+    # Una riga a zero riceve giacenza, una con giacenza viene azzerata, un prezzo cambia
+    changes = [{"row": int(zero[0]) + 2, "quantity": 4},
+               {"row": int(stocked[0]) + 2, "quantity": 0},
+               {"row": int(stocked[1]) + 2, "price": 7.5}]
+    state.apply(changes, target_total=50_250.0)
+    assert state.final_total == Decimal("50250")
+    untouched = np.setdiff1d(zero, [zero[0]])
+    assert (state.quantities[untouched] == 0).all()
+    assert state.quantities[stocked[0]] == 0
+    # L'indice per prezzo contiene esattamente le righe spostabili
+    assert np.array_equal(np.sort(state.order), np.flatnonzero(state._movable(np.arange(len(state.units)))))
+    assert (np.diff(state.sorted_units) >= 0).all()
+    assert np.array_equal(state.sorted_units, state.units[state.order])
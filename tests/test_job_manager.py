@@ -0,0 +1,109 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import job_manager
+from job_manager import JobManager
+from job_runner import JobRunner
+from job_store import JobStore, MemoryJobStore, SQLiteJobStore
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_manager, "_WATCH_INTERVAL", 0.02)
+    return JobManager(JobRunner(max_workers=1, timeout=0.1), MemoryJobStore(ttl=60), str(tmp_path), timeout=0.3)
+
+
+def create_job(manager, job_id="lavoro"):
+    job = {"id": job_id, "status": "queued", "phase": None, "progress": 0.0, "timings": {},
+           "created_at": time.time(), "started_at": None, "finished_at": None, "result": None,
+           "error": None, "output_filename": None,
+           "input_path": os.path.join(manager.directory, f"{job_id}_input.xlsx"),
+           "output_path": os.path.join(manager.directory, f"{job_id}.xlsx")}
+    open(job["input_path"], "wb").close()
+    manager.store.create(job)
+    return job
+
+
+def start(manager, job):
+    """Primo avanzamento del worker (come JobManager._drain)"""
+    manager.store.update(job["id"], status="running", started_at=time.time())
+
+
+def outcome():
+    return {"timings": {}, "output_filename": "adjusted.xlsx", "result": {"success": True}}
+
+
+def later(delay, action):
+    timer = threading.Timer(delay, action)
+    timer.start()
+    return timer
+
+
+def test_queue_time_does_not_count(manager):
+    job = create_job(manager)
+    future = Future()
+
+    def run():
+        # In coda oltre il tempo massimo (e oltre EXCEL_JOB_TIMEOUT del runner), poi eseguito in tempo
+        start(manager, job)
+        later(0.1, lambda: future.set_result(outcome()))
+
+    later(0.5, run)
+    asyncio.run(manager._watch(job["id"], future))
+    stored = manager.get(job["id"])
+    assert stored["status"] == "done", stored["error"]
+    assert not os.path.exists(job["input_path"])
+
+
+def test_running_job_timeout_removes_output(manager):
+    job = create_job(manager)
+    future = Future()
+    future.set_running_or_notify_cancel()  # già nel worker: cancel() non ha effetto
+    start(manager, job)
+    with open(job["output_path"], "wb") as f:
+        f.write(b"PK parziale")
+
+    asyncio.run(manager._watch(job["id"], future))
+    stored = manager.get(job["id"])
+    assert stored["status"] == "failed"
+    assert stored["finished_at"] - stored["started_at"] == pytest.approx(0.3, abs=0.1)
+    assert not os.path.exists(job["output_path"])
+
+    # Il worker termina dopo e scrive comunque il risultato: viene eliminato
+    with open(job["output_path"], "wb") as f:
+        f.write(b"PK completo")
+    future.set_result(outcome())
+    assert not os.path.exists(job["output_path"])
+    assert manager.get(job["id"])["status"] == "failed"
+
+
+def test_failed_job_removes_output(manager):
+    job = create_job(manager)
+    future = Future()
+    start(manager, job)
+    with open(job["output_path"], "wb") as f:
+        f.write(b"PK parziale")
+    later(0.05, lambda: future.set_exception(ValueError("Foglio 'X' non trovato")))
+
+    asyncio.run(manager._watch(job["id"], future))
+    stored = manager.get(job["id"])
+    assert stored["status"] == "failed" and stored["error"] == "Foglio 'X' non trovato"
+    assert not os.path.exists(job["output_path"])
+
+
+def test_incomplete_store_fails_on_creation(tmp_path):
+    class SenzaScadenza(JobStore):
+        def create(self, job): ...
+        def update(self, job_id, **fields): ...
+        def get(self, job_id): ...
+        def delete(self, job_id): ...
+
+    with pytest.raises(TypeError, match="expired"):
+        SenzaScadenza(ttl=60)
+    MemoryJobStore(ttl=60)
+    SQLiteJobStore(str(tmp_path / "lavori.db"), ttl=60)
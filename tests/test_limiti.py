@@ -0,0 +1,57 @@
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from centesimi import exact_total
+from conftest import decimal_total
+from lettura_excel import ColonneFoglio
+from limiti import water_filling
+from solver_semplice import ExcelSolverSemplice
+
+
+@pytest.fixture(scope="module")
+def sheet():
+    """Foglio con minimo, massimo e blocco su una parte delle righe (codice 0 = "X" = bloccata)"""
+    rng = np.random.default_rng(1)
+    rows = 20_000
+    quantities = rng.integers(0, 50, rows).astype(float)
+    prices = np.round(rng.uniform(0.5, 200, rows), 2)
+    minimum = np.where(rng.random(rows) < 0.3, rng.integers(0, 10, rows), np.nan)
+    maximum = np.where(rng.random(rows) < 0.3, rng.integers(10, 60, rows), np.nan)
+    lock = np.where(rng.random(rows) < 0.1, 0.0, 1.0)
+    return ColonneFoglio("S", ["Q", "P", "R", "MIN", "MAX", "L"],
+                         {"Q": quantities, "P": prices, "R": np.zeros(rows), "MIN": minimum,
+                          "MAX": maximum, "L": lock},
+                         categories={"L": ["X", "no"]})
+
+
+@pytest.mark.parametrize("factor", [1.3, 0.7, 5.0])
+def test_bounds_respected(sheet, factor):
+    quantities, prices = sheet["Q"], sheet["P"]
+    target_total = round(float(np.dot(quantities, prices)) * factor, 2)
+    solver = ExcelSolverSemplice("x.xlsx", "S", "Q", "P", "R", target_total, sheet_data=sheet,
+                                 min_column="MIN", max_column="MAX", lock_column="L")
+    result = solver.adjust()
+    assert result["success"], result.get("error")
+    final, limits = solver.data.quantities, solver.limits
+    assert ((final >= limits.lower) & (final <= limits.upper)).all()
+    assert result["bounds"]["respected"]
+    # Le righe bloccate restano alla quantità originale
+    assert (final[limits.locked] == quantities[limits.locked]).all()
+    if result["bounds"]["feasible"]:
+        assert exact_total(final, prices) == Decimal(str(target_total))
+        assert decimal_total(final.tolist(), prices.tolist()) == Decimal(str(target_total))
+
+
+def test_water_filling_hits_target_within_bounds():
+    rng = np.random.default_rng(4)
+    quantities = rng.integers(1, 30, 1000).astype(float)
+    prices = np.round(rng.uniform(1, 50, 1000), 2)
+    lower = np.where(rng.random(1000) < 0.5, 2.0, 0.0)
+    upper = np.where(rng.random(1000) < 0.5, 25.0, np.inf)
+    target = float(np.dot(quantities, prices)) * 1.4
+    factors, minimum, maximum = water_filling(quantities, prices, lower, upper, np.array([target]))
+    scaled = np.clip(factors[0] * quantities, lower, upper)
+    assert minimum[0] <= target <= maximum[0]
+    assert float(np.dot(scaled, prices)) == pytest.approx(target, rel=1e-12)
@@ -0,0 +1,105 @@
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from conftest import COLONNE, INVENTARIO, decimal_total
+from lettura_excel import ColonneFoglio
+from solver_semplice import ExcelSolverSemplice
+
+
+class SolverConRiferimento(ExcelSolverSemplice):
+    """Ogni totale esatto del solver (Step A e risultato finale) confrontato con il ciclo Decimal"""
+
+    def _exact_total(self) -> Decimal:
+        total = super()._exact_total()
+        reference = decimal_total(self.data.quantities.tolist(), self.data.prices.tolist())
+        assert total == reference
+        self.totals.append(total)
+        return total
+
+
+def adjust(sheet_data, target_total, **kwargs):
+    solver = SolverConRiferimento(INVENTARIO, "Foglio1", target_total=target_total, sheet_data=sheet_data,
+                                  shard_workers=1, **COLONNE, **kwargs)
+    solver.totals = []
+    result = solver.adjust()
+    assert result["success"], result.get("error")
+    return solver, result
+
+
+def check_parity(solver, result, target_total):
+    """Totale finale e residuo come li calcolerebbe il percorso Decimal sulle quantità finali"""
+    data = solver.data
+    final = decimal_total(data.quantities.tolist(), data.prices.tolist())
+    residual = Decimal(str(target_total)) - final
+    assert solver.totals[-1] == final
+    assert result["final_total"] == float(final)
+    assert result["residual"] == float(residual)
+    assert result["target_reached_exactly"] == (abs(float(residual)) < 0.01)
+    assert (data.quantities >= 0).all()
+    prices = np.nan_to_num(solver.sheet_data[COLONNE["price_column"]][:len(data)], nan=0.0)
+    assert result["prices_unchanged"] and np.array_equal(data.prices, prices)
+
+
+@pytest.mark.parametrize("target_total", [50_100.0, 12_345.67, 49_000.13, 1_234_567.89, 0.05])
+def test_inventario_parity(inventario, target_total):
+    solver, result = adjust(inventario, target_total)
+    check_parity(solver, result, target_total)
+    # Il file di esempio ha prezzi al centesimo: il target è sempre raggiungibile
+    assert result["residual"] == 0.0 or target_total == 0.05
+
+
+def test_inventario_original_total(inventario):
+    solver, result = adjust(inventario, 50_100.0)
+    quantities = np.nan_to_num(inventario[COLONNE["quantity_column"]], nan=0.0).clip(min=0)
+    prices = np.nan_to_num(inventario[COLONNE["price_column"]], nan=0.0)
+    quantities[prices <= 0] = 0
+    expected = decimal_total(quantities.tolist(), prices.tolist())
+    assert result["original_total"] == pytest.approx(float(expected), abs=1e-6)
+
+
+@pytest.mark.parametrize("prices", ["lognormal", "round"])
+@pytest.mark.parametrize("target_total", [987_654.32, 1_500_000.0, 3_333.33])
+def test_synthetic_parity(synthetic_sheets, prices, target_total):
+    solver, result = adjust(synthetic_sheets[prices], target_total)
+    check_parity(solver, result, target_total)
+    if result["compensation"] is not None and result["compensation"]["reachable"]:
+        # Righe tutte a 1 (o 0) dopo lo scaling: le diminuzioni non scendono sotto 1
+        floor_reached = result["residual"] < 0 and solver.data.quantities.max() <= 1
+        assert result["residual"] == 0.0 or floor_reached
+
+
+def test_data_rows_parity(inventario):
+    solver, result = adjust(inventario, 20_000.0, data_rows=1000)
+    assert len(solver.data) == 1000
+    check_parity(solver, result, 20_000.0)
+
+
+def small_sheet(quantities, prices):
+    columns = list(COLONNE.values())
+    values = [np.array(quantities, dtype=float), np.array(prices), np.zeros(len(prices))]
+    return ColonneFoglio("Foglio1", columns, dict(zip(columns, values)))
+
+
+def test_decrease_keeps_quantity_at_least_one():
+    # Dopo lo scaling tutte le righe sono a 1: il residuo negativo resta aperto invece di azzerarle
+    solver, result = adjust(small_sheet([1, 1, 1, 1], [1.0, 2.0, 3.0, 4.0]), 7.0)
+    check_parity(solver, result, 7.0)
+    assert solver.data.quantities.tolist() == [1, 1, 1, 1]
+    assert result["residual"] == -3.0 and not result["compensation"]["closed"]
+
+
+def test_atomic_step_moves_whole_units():
+    # Target al 2% del totale: Step B sposta unità intere e non porta righe sotto 1
+    solver, result = adjust(small_sheet([500, 300, 200], [10.0, 3.0, 0.5]), 122.0)
+    check_parity(solver, result, 122.0)
+    assert solver.data.quantities.dtype == np.int64
+    assert (solver.data.quantities >= 1).all() and result["residual"] == 0.0
+
+
+def test_compensation_raises_rows_rounded_to_zero():
+    # 0,40 arrotondato a 0: lo Step C può solo aumentarla e la usa per chiudere 0,37€
+    solver, result = adjust(small_sheet([100, 1], [1.0, 0.37]), 40.37)
+    check_parity(solver, result, 40.37)
+    assert solver.data.quantities.tolist() == [40, 1] and result["residual"] == 0.0
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import COLONNE, INVENTARIO
+from elaborazione import adjust_incremental, adjust_workbook
+from formule import product_values
+from lettura_excel import read_sheet_columns
+
+
+@pytest.fixture(scope="module")
+def exports(tmp_path_factory):
+    """inventario 2023.xlsx esportato in CSV (anche con ';' e virgola decimale) e Parquet"""
+    directory = tmp_path_factory.mktemp("tabelle")
+    frame = pd.read_excel(INVENTARIO, sheet_name="Foglio1")
+    paths = {"csv": directory / "inventario.csv", "csv_it": directory / "inventario_it.csv"}
+    frame.to_csv(paths["csv"], index=False)
+    frame.to_csv(paths["csv_it"], index=False, sep=";", decimal=",")
+    try:
+        import pyarrow  # noqa: F401
+        text = {column: str for column in frame.columns if frame[column].dtype == object}
+        paths["parquet"] = directory / "inventario.parquet"
+        frame.astype(text).to_parquet(paths["parquet"], index=False)
+    except ImportError:
+        pass
+    return {name: str(path) for name, path in paths.items()}
+
+
+def check_written(path, target_total):
+    """Ogni rimanenza scritta vale quantità × prezzo e la colonna somma al target"""
+    sheet = read_sheet_columns(path, "Foglio1", list(COLONNE.values()))
+    quantities, prices, remaining = (np.nan_to_num(sheet[column], nan=0.0) for column in COLONNE.values())
+    assert np.abs(remaining - quantities * prices).max() < 0.005
+    assert remaining.sum() == pytest.approx(target_total, abs=0.005)
+
+
+@pytest.mark.parametrize("name", ["csv", "csv_it", "parquet"])
+@pytest.mark.parametrize("target_total", [50_100.0, 12_345.67])
+def test_remaining_column_follows_quantities(exports, tmp_path, name, target_total):
+    if name not in exports:
+        pytest.skip("pyarrow non installato")
+    output_path = str(tmp_path / f"corretto{os.path.splitext(exports[name])[1]}")
+    outcome = adjust_workbook(exports[name], exports[name], "Foglio1", target_total=target_total,
+                              data_rows=None, output_path=output_path, **COLONNE)
+    check = outcome["result"]["formula_check"]
+    assert check["consistent"] and check["inconsistent"] == 0
+    assert check["total"] == pytest.approx(target_total, abs=0.005)
+    check_written(output_path, target_total)
+
+
+def test_incremental_writes_remaining(exports, tmp_path):
+    first = adjust_workbook(exports["csv"], "inventario.csv", "Foglio1", target_total=50_000.0,
+                            data_rows=None, output_path=str(tmp_path / "primo.csv"), keep_state=True, **COLONNE)
+    state = first["state"]
+    row = int(np.flatnonzero(state.normalized > 0)[0]) + 2
+    output_path = str(tmp_path / "incrementale.csv")
+    adjust_incremental(exports["csv"], "inventario.csv", state, [{"row": row, "price": 7.5}], 50_100.0,
+                       output_path=output_path)
+    check_written(output_path, 50_100.0)
+
+
+def test_product_values_rounds_to_factor_digits():
+    assert product_values(np.array([3.0, 13.0, 7.0]), np.array([1.1, 3.9, 0.125])).tolist() == [3.3, 50.7, 0.875]
+    # Fattori non rappresentabili in decimale: prodotto float così com'è
+    assert product_values(np.array([1.0]), np.array([1 / 3]))[0] == 1 / 3